@@ -1 +1,3 @@
 from .rest_client import Request, RequestStatus, RestClient
+from .scheduler import RequestPriority
+from .dispatch import DispatchPolicy, OrderKeyPolicy, WorkerAffinityPolicy, SerialPolicy
@@ -0,0 +1,147 @@
+# encoding: UTF-8
+
+import asyncio
+import sys
+from threading import Thread
+from queue import Empty
+from time import monotonic, time
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import h2  # noqa
+except ImportError:
+    h2 = None
+
+
+class AsyncTransport(object):
+    """
+    Send requests of a RestClient from an asyncio event loop with httpx.
+
+    One loop thread keeps up to max_inflight requests in flight over
+    keep-alive (optionally HTTP/2) connections, a dispatch thread pulls
+    requests from the scheduler. Callbacks are called in the loop thread,
+    so they should not block for long.
+    """
+
+    def __init__(self, client, max_inflight: int = 64, http2: bool = False):
+        """"""
+        self.client = client
+        self.max_inflight = max_inflight
+        self.http2 = http2
+
+        self._loop = None  # type: asyncio.AbstractEventLoop
+        self._thread = None  # type: Thread
+
+    def start(self):
+        """"""
+        if httpx is None:
+            raise ImportError("AsyncTransport requires httpx, please pip install httpx")
+
+        if self.http2 and h2 is None:
+            sys.stderr.write("h2 is not installed, AsyncTransport falls back to HTTP/1.1\n")
+            self.http2 = False
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def join(self):
+        """
+        Wait till loop thread exits after client is stopped.
+        """
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        """"""
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._main())
+        except:  # noqa
+            et, ev, tb = sys.exc_info()
+            self.client.on_error(et, ev, tb, None)
+        finally:
+            self._loop.close()
+
+    def _create_http_client(self):
+        """"""
+        kwargs = {
+            "http2": self.http2,
+            "limits": httpx.Limits(
+                max_connections=self.max_inflight,
+                max_keepalive_connections=self.max_inflight,
+            ),
+        }
+        if self.client.proxies:
+            kwargs["proxy"] = self.client.proxies["https"]
+        return httpx.AsyncClient(**kwargs)
+
+    async def _main(self):
+        """
+        Keep dispatching requests till client is stopped.
+        """
+        client = self.client
+        scheduler = client._scheduler
+        stats = client._worker_stats[0]
+        semaphore = asyncio.Semaphore(self.max_inflight)
+        tasks = set()
+
+        async with self._create_http_client() as http:
+            while client._active:
+                await semaphore.acquire()
+                try:
+                    request = await self._loop.run_in_executor(
+                        None, scheduler.get, 0.05, 0
+                    )
+                except Empty:
+                    semaphore.release()
+                    continue
+
+                stats.inflight += 1
+                stats.last_path = request.path
+                task = self._loop.create_task(
+                    self._send(http, request, semaphore, stats)
+                )
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _send(self, http, request, semaphore, stats):
+        """
+        Sign and send one request, then handle response with client callbacks.
+        """
+        client = self.client
+        start = monotonic()
+
+        # noinspection PyBroadException
+        try:
+            request = client.sign(request)
+            url = client.make_full_url(request.path)
+
+            kwargs = {
+                "headers": request.headers,
+                "params": request.params,
+            }
+            if isinstance(request.data, (str, bytes)):
+                kwargs["content"] = request.data
+            elif request.data is not None:
+                kwargs["data"] = request.data
+
+            request.sent_time = time()
+            response = await http.request(request.method, url, **kwargs)
+            client._handle_response(request, response)
+        except:  # noqa
+            client._handle_error(request)
+        finally:
+            client._scheduler.task_done(request)
+            semaphore.release()
+            stats.inflight -= 1
+            stats.processed += 1
+            stats.busy_time += monotonic() - start
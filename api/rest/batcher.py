@@ -0,0 +1,163 @@
+# encoding: UTF-8
+
+from threading import Condition, Lock
+from time import monotonic
+from typing import Callable
+
+
+class BatchRule(object):
+    """
+    Rule for merging requests sent to one path into batch requests.
+
+    * merge(requests) returns data dict of the batch request.
+    * split(data, requests) returns list of results, one for each request, in
+      the same format as the single request path returns.
+    * group(request) returns key of requests allowed to be merged together,
+      e.g. symbol for cancel requests.
+    """
+
+    def __init__(
+            self,
+            path: str,
+            batch_path: str,
+            merge: Callable,
+            split: Callable,
+            group: Callable = None,
+            max_size: int = 10,
+            window: float = 0.002,
+    ):
+        """"""
+        self.path = path
+        self.batch_path = batch_path
+        self.merge = merge
+        self.split = split
+        self.group = group
+        self.max_size = max_size
+        self.window = window
+
+
+class RequestBatcher(object):
+    """
+    Hold requests matching a BatchRule for a short window, then hand them
+    over to on_batch(rule, requests) as one group.
+
+    A key (e.g. client order id) is held by at most one buffer: a request
+    whose key is already waiting in another buffer, like a cancel of an
+    order still in its batching window, flushes that buffer first. Buffers
+    are handed over one at a time, so requests sharing a key reach on_batch
+    in the order they were added.
+
+    get_keys(request) returns the ordering keys of a request, it should be
+    the get_keys of the scheduler's dispatch policy.
+    """
+
+    def __init__(self, on_batch: Callable, get_keys: Callable):
+        """"""
+        self._cond = Condition()
+        self._dispatch_lock = Lock()
+        self._on_batch = on_batch
+        self._get_keys = get_keys
+
+        self._rules = {}  # path: rule
+        self._buffers = {}  # (path, group): [deadline, requests, keys]
+        self._flushing = 0
+
+        self.batch_count = 0
+        self.request_count = 0
+
+    def add_rule(self, rule: BatchRule):
+        """"""
+        with self._cond:
+            self._rules[rule.path] = rule
+
+    def get_rule(self, path: str):
+        """"""
+        return self._rules.get(path, None)
+
+    def put(self, rule: BatchRule, request):
+        """
+        Add request into batch buffer, flush at once if buffer is full.
+        """
+        group = rule.group(request) if rule.group else None
+        buffer_key = (rule.path, group)
+        keys = self._get_keys(request)
+
+        with self._dispatch_lock:
+            with self._cond:
+                due = self._pop_buffers([
+                    k for k, buf in self._buffers.items()
+                    if k != buffer_key and not buf[2].isdisjoint(keys)
+                ])
+            self._flush_all(due)
+
+            with self._cond:
+                buf = self._buffers.get(buffer_key, None)
+                if not buf:
+                    buf = [monotonic() + rule.window, [], set()]
+                    self._buffers[buffer_key] = buf
+                buf[1].append(request)
+                buf[2].update(keys)
+
+                if len(buf[1]) < rule.max_size:
+                    self._cond.notify_all()
+                    return
+                due = self._pop_buffers([buffer_key])
+            self._flush_all(due)
+
+    def run(self, is_active: Callable):
+        """
+        Flush buffers whose window expired, keep running while is_active().
+        """
+        while is_active():
+            with self._dispatch_lock:
+                with self._cond:
+                    now = monotonic()
+                    due = self._pop_buffers([
+                        k for k, buf in self._buffers.items() if buf[0] <= now
+                    ])
+                self._flush_all(due)
+            if due:
+                continue
+
+            with self._cond:
+                wait = 0.05
+                now = monotonic()
+                for deadline, _, _ in self._buffers.values():
+                    wait = min(wait, deadline - now)
+                if wait > 0:
+                    self._cond.wait(wait)
+
+    def _pop_buffers(self, buffer_keys: list):
+        """
+        Remove buffers from pending, must be called with self._cond held.
+        """
+        due = []
+        for buffer_key in buffer_keys:
+            buf = self._buffers.pop(buffer_key)
+            self._flushing += 1
+            due.append((self._rules[buffer_key[0]], buf[1]))
+        return due
+
+    def _flush_all(self, due: list):
+        """"""
+        for rule, requests in due:
+            self._flush(rule, requests)
+
+    def _flush(self, rule: BatchRule, requests: list):
+        """"""
+        try:
+            self._on_batch(rule, requests)
+        finally:
+            with self._cond:
+                self.batch_count += 1
+                self.request_count += len(requests)
+                self._flushing -= 1
+                self._cond.notify_all()
+
+    def join(self):
+        """
+        Block until all buffers are flushed.
+        """
+        with self._cond:
+            while self._buffers or self._flushing:
+                self._cond.wait()
@@ -0,0 +1,70 @@
+# encoding: UTF-8
+
+from zlib import crc32
+
+
+class DispatchPolicy(object):
+    """
+    Decide how requests are spread over RestClient session workers.
+
+    * get_keys returns ordering keys of a request, requests sharing a key are
+      sent one after another in the order they were added.
+    * accept tells whether a worker may send the request.
+    """
+
+    def __init__(self):
+        """"""
+        self.worker_count = 1
+
+    def set_worker_count(self, n: int):
+        """"""
+        self.worker_count = n
+
+    def get_keys(self, request):
+        """
+        Get ordering keys of request, request.key can be None, a str or a
+        tuple of str (batch request).
+        """
+        key = request.key
+        if key is None:
+            return ()
+        if isinstance(key, tuple):
+            return key
+        return (key,)
+
+    def accept(self, worker_id: int, request):
+        """"""
+        return True
+
+
+class OrderKeyPolicy(DispatchPolicy):
+    """
+    Requests of the same order are kept in order, unrelated requests are
+    sent by any idle worker in parallel.
+    """
+
+    pass
+
+
+class WorkerAffinityPolicy(OrderKeyPolicy):
+    """
+    Requests of the same order are always sent by the same worker, so that
+    they reuse its keep-alive connection.
+    """
+
+    def accept(self, worker_id: int, request):
+        """"""
+        keys = self.get_keys(request)
+        if len(keys) != 1:
+            return True
+        return crc32(keys[0].encode()) % self.worker_count == worker_id
+
+
+class SerialPolicy(DispatchPolicy):
+    """
+    All requests are sent one by one in order, as if there was only one worker.
+    """
+
+    def get_keys(self, request):
+        """"""
+        return ("serial",)
@@ -4,11 +4,20 @@ import sys
 import traceback
 from datetime import datetime
 from enum import Enum
+from functools import partial
 from multiprocessing.dummy import Pool
-from queue import Empty, Queue
+from queue import Empty
+from threading import Thread
+from time import monotonic, time
 from typing import Any, Callable
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from .async_transport import AsyncTransport
+from .batcher import BatchRule, RequestBatcher
+from .dispatch import DispatchPolicy
+from .scheduler import RequestPriority, RequestScheduler
 
 
 class RequestStatus(Enum):
@@ -34,6 +43,8 @@ class Request(object):
             on_failed: Callable = None,
             on_error: Callable = None,
             extra: Any = None,
+            priority: RequestPriority = RequestPriority.query,
+            key: str = None,
     ):
         """"""
         self.method = method
@@ -47,8 +58,12 @@ class Request(object):
         self.on_error = on_error
         self.extra = extra
 
+        self.priority = priority
+        self.key = key
+
         self.response = None
         self.status = RequestStatus.ready
+        self.sent_time = 0  # Time (seconds since epoch) request was sent
 
     def __str__(self):
         if self.response is None:
@@ -75,6 +90,24 @@ class Request(object):
         )
 
 
+class WorkerStats(object):
+    """
+    Statistics of one session worker.
+    """
+
+    def __init__(self, worker_id: int):
+        """"""
+        self.worker_id = worker_id
+        self.inflight = 0
+        self.processed = 0
+        self.busy_time = 0
+        self.last_path = ""
+
+    def to_dict(self):
+        """"""
+        return dict(self.__dict__)
+
+
 class RestClient(object):
     """
     HTTP Client designed for all sorts of trading RESTFul API.
@@ -83,6 +116,14 @@ class RestClient(object):
     * Reimplement on_failed function to handle Non-2xx responses.
     * Use on_failed parameter in add_request function for individual Non-2xx response handling.
     * Reimplement on_error function to handle exception msg.
+    * Use add_rate_limit function to declare exchange rate limits, requests are
+      then scheduled by priority (cancel > order > query) within the limits.
+    * Use add_batch_rule function to merge requests added within a short window
+      into one batch request, callbacks are fanned out to each request.
+    * Requests are sent by n session workers in parallel, use set_dispatch_policy
+      to change how requests are spread over workers.
+    * Use set_transport('async') before start to send requests from an asyncio
+      event loop instead of worker threads.
     """
 
     def __init__(self):
@@ -91,8 +132,16 @@ class RestClient(object):
         self.url_base = None  # type: str
         self._active = False
 
-        self._queue = Queue()
+        self._scheduler = RequestScheduler()
+        self._batcher = RequestBatcher(self._send_batch, self._get_request_keys)
         self._pool = None  # type: Pool
+        self._batch_thread = None  # type: Thread
+        self._worker_stats = []
+
+        self.transport = "requests"
+        self.http2 = False
+        self.max_inflight = 64
+        self._async_transport = None  # type: AsyncTransport
 
         self.proxies = None
 
@@ -107,20 +156,121 @@ class RestClient(object):
             proxy = f"{proxy_host}:{proxy_port}"
             self.proxies = {"http": proxy, "https": proxy}
 
+    def add_rate_limit(self, pattern: str, capacity: int, interval: float):
+        """
+        Limit requests whose path matches regex pattern to capacity per interval seconds.
+        e.g. add_rate_limit('/api/v1/contract_order', 30, 3)
+        """
+        self._scheduler.add_rate_limit(pattern, capacity, interval)
+
+    def add_batch_rule(
+            self,
+            path: str,
+            batch_path: str,
+            merge: Callable,
+            split: Callable,
+            group: Callable = None,
+            max_size: int = 10,
+            window: float = 0.002,
+    ):
+        """
+        Merge requests to path added within window seconds into one request to batch_path.
+        :param merge: function(requests) returning data dict of the batch request
+        :param split: function(data, requests) returning result list for each request
+        :param group: function(request) returning key of requests which can be merged
+        :param max_size: max requests in one batch, batch is sent at once when full
+        """
+        rule = BatchRule(path, batch_path, merge, split, group, max_size, window)
+        self._batcher.add_rule(rule)
+
+    def get_budget(self, path: str = ""):
+        """
+        Get requests which can be sent right now without hitting rate limit.
+
+        If path is given, return budget of that path (inf if not limited),
+        otherwise return dict of pattern: budget.
+        """
+        return self._scheduler.get_budget(path)
+
+    def set_transport(self, transport: str, http2: bool = False, max_inflight: int = 64):
+        """
+        Choose how requests are sent, call it before start.
+        :param transport: 'requests' for session worker threads, 'async' for asyncio + httpx
+        :param http2: use HTTP/2 with async transport if h2 is installed
+        :param max_inflight: max requests in flight with async transport
+        """
+        self.transport = transport
+        self.http2 = http2
+        self.max_inflight = max_inflight
+
+    def set_dispatch_policy(self, policy: DispatchPolicy):
+        """
+        Set policy deciding which requests must stay ordered and which
+        worker can send them. Call it before start.
+        """
+        self._scheduler.set_policy(policy)
+
+    def _get_request_keys(self, request: Request):
+        """
+        Get ordering keys of request from the current dispatch policy.
+        """
+        return self._scheduler.policy.get_keys(request)
+
+    def get_worker_stats(self):
+        """
+        Get in-flight count, processed count and busy seconds of each worker.
+        """
+        return [stats.to_dict() for stats in self._worker_stats]
+
+    def get_queue_size(self):
+        """
+        Get count of requests waiting in queue of each priority.
+        """
+        return self._scheduler.qsize()
+
     def _create_session(self):
-        """"""
-        return requests.session()
+        """
+        Create session with keep-alive connection pool.
+        """
+        session = requests.session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
 
     def start(self, n: int = 3):
         """
         Start rest client with session count n.
+
+        With async transport, n is ignored and all requests are sent from
+        one event loop.
         """
         if self._active:
             return
 
         self._active = True
-        self._pool = Pool(n)
-        self._pool.apply_async(self._run)
+
+        if self.transport == "async":
+            self._scheduler.policy.set_worker_count(1)
+            self._worker_stats = [WorkerStats(0)]
+
+            self._async_transport = AsyncTransport(self, self.max_inflight, self.http2)
+            self._async_transport.start()
+        else:
+            self._scheduler.policy.set_worker_count(n)
+            self._worker_stats = [WorkerStats(i) for i in range(n)]
+
+            self._pool = Pool(n)
+            for worker_id in range(n):
+                self._pool.apply_async(self._run, (worker_id,))
+
+        self._batch_thread = Thread(target=self._batcher.run, args=(self._is_active,))
+        self._batch_thread.daemon = True
+        self._batch_thread.start()
+
+    def _is_active(self):
+        """"""
+        return self._active
 
     def stop(self):
         """
@@ -132,7 +282,8 @@ class RestClient(object):
         """
         Wait till all requests are processed.
         """
-        self._queue.join()
+        self._batcher.join()
+        self._scheduler.join()
 
     def add_request(
             self,
@@ -145,6 +296,8 @@ class RestClient(object):
             on_failed: Callable = None,
             on_error: Callable = None,
             extra: Any = None,
+            priority: RequestPriority = None,
+            key: str = None,
     ):
         """
         Add a new request.
@@ -157,8 +310,16 @@ class RestClient(object):
         :param on_failed: callback function if Non-2xx status, type, type: (code, dict, Request)
         :param on_error: callback function when catching Python exception, type: (etype, evalue, tb, Request)
         :param extra: Any extra data which can be used when handling callback
+        :param priority: RequestPriority, default query for GET and order for others
+        :param key: requests with same key (e.g. client order id) are sent in order
         :return: Request
         """
+        if priority is None:
+            if method == "GET":
+                priority = RequestPriority.query
+            else:
+                priority = RequestPriority.order
+
         request = Request(
             method,
             path,
@@ -169,22 +330,115 @@ class RestClient(object):
             on_failed,
             on_error,
             extra,
+            priority,
+            key,
         )
-        self._queue.put(request)
-        return request
 
-    def _run(self):
+        rule = self._batcher.get_rule(path)
+        if rule:
+            self._batcher.put(rule, request)
+            return request
+        return self._scheduler.put(request)
+
+    def _send_batch(self, rule: BatchRule, requests: list):
+        """
+        Merge requests held by batcher into one batch request.
+        """
+        if len(requests) == 1:
+            self._scheduler.put(requests[0])
+            return
+
+        keys = []
+        for request in requests:
+            if isinstance(request.key, tuple):
+                keys.extend(request.key)
+            elif request.key is not None:
+                keys.append(request.key)
+
+        batch_request = Request(
+            "POST",
+            rule.batch_path,
+            None,
+            rule.merge(requests),
+            None,
+            partial(self._on_batch_callback, rule),
+            self._on_batch_failed,
+            self._on_batch_error,
+            requests,
+            min([r.priority for r in requests], key=lambda p: p.value),
+            tuple(keys) or None,
+        )
+        self._scheduler.put(batch_request)
+
+    def _on_batch_callback(self, rule: BatchRule, data: dict, batch_request: Request):
+        """
+        Fan out result of batch request to callback of each request.
+        """
+        requests = batch_request.extra
+        results = rule.split(data, requests)
+
+        for request, result in zip(requests, results):
+            request.response = batch_request.response
+            request.sent_time = batch_request.sent_time
+            # noinspection PyBroadException
+            try:
+                request.callback(result, request)
+                request.status = RequestStatus.success
+            except:  # noqa
+                self._handle_error(request)
+
+    def _on_batch_failed(self, status_code: int, batch_request: Request):
+        """
+        Fan out Non-2xx response of batch request to each request.
+        """
+        for request in batch_request.extra:
+            request.response = batch_request.response
+            request.status = RequestStatus.failed
+
+            if request.on_failed:
+                request.on_failed(status_code, request)
+            else:
+                self.on_failed(status_code, request)
+
+    def _on_batch_error(
+            self,
+            exception_type: type,
+            exception_value: Exception,
+            tb,
+            batch_request: Request,
+    ):
+        """
+        Fan out exception of batch request to each request.
+        """
+        for request in batch_request.extra:
+            request.response = batch_request.response
+            request.status = RequestStatus.error
+
+            if request.on_error:
+                request.on_error(exception_type, exception_value, tb, request)
+            else:
+                self.on_error(exception_type, exception_value, tb, request)
+
+    def _run(self, worker_id: int = 0):
+        """
+        Keep sending requests with worker's own session till stop is called.
+        """
+        stats = self._worker_stats[worker_id]
         try:
             session = self._create_session()
             while self._active:
                 try:
-                    # request = self._queue.get()
-                    # print('request: ',request)
-                    request = self._queue.get(timeout=0.05)
+                    request = self._scheduler.get(0.05, worker_id)
+                    stats.inflight += 1
+                    stats.last_path = request.path
+                    start = monotonic()
                     try:
                         self._process_request(request, session)
                     finally:
-                        self._queue.task_done()
+                        self._scheduler.task_done(request)
+                        stats.inflight -= 1
+                        stats.processed += 1
+                        stats.busy_time += monotonic() - start
                 except Empty:
                     pass
         except:  # noqa
@@ -249,6 +503,7 @@ class RestClient(object):
             # print('request:',request)
             url = self.make_full_url(request.path)
 
+            request.sent_time = time()
             response = session.request(
                 request.method,
                 url,
@@ -257,27 +512,43 @@ class RestClient(object):
                 data=request.data,
                 proxies=self.proxies,
             )
-            request.response = response
-            # print('response:',response.json())
-            status_code = response.status_code
-            if status_code / 100 == 2:  # 2xx都算成功，尽管交易所都用200
-                jsonBody = response.json()
-                request.callback(jsonBody, request)
-                request.status = RequestStatus.success
-            else:
-                request.status = RequestStatus.failed
-
-                if request.on_failed:
-                    request.on_failed(status_code, request)
-                else:
-                    self.on_failed(status_code, request)
+            self._handle_response(request, response)
         except:  # noqa
-            request.status = RequestStatus.error
-            t, v, tb = sys.exc_info()
-            if request.on_error:
-                request.on_error(t, v, tb, request)
+            self._handle_error(request)
+
+    def _handle_response(self, request: Request, response):
+        """
+        Pass response to callback or on_failed of request, response can be
+        from requests or httpx.
+        """
+        request.response = response
+        status_code = response.status_code
+        if status_code / 100 == 2:  # 2xx都算成功，尽管交易所都用200
+            jsonBody = response.json()
+            request.callback(jsonBody, request)
+            request.status = RequestStatus.success
+        else:
+            request.status = RequestStatus.failed
+
+            # 触发限频，清空令牌桶等待恢复
+            if status_code == 429:
+                self._scheduler.penalize(request.path)
+
+            if request.on_failed:
+                request.on_failed(status_code, request)
             else:
-                self.on_error(t, v, tb, request)
+                self.on_failed(status_code, request)
+
+    def _handle_error(self, request: Request):
+        """
+        Pass exception being handled to on_error of request.
+        """
+        request.status = RequestStatus.error
+        t, v, tb = sys.exc_info()
+        if request.on_error:
+            request.on_error(t, v, tb, request)
+        else:
+            self.on_error(t, v, tb, request)
 
     def make_full_url(self, path: str):
         """
@@ -0,0 +1,287 @@
+# encoding: UTF-8
+
+import re
+from collections import deque
+from enum import Enum
+from queue import Empty
+from threading import Condition
+from time import monotonic
+
+from .dispatch import DispatchPolicy, OrderKeyPolicy
+
+
+class RequestPriority(Enum):
+    cancel = 0  # Cancel requests go out first
+    order = 1  # New orders
+    query = 2  # Contract/position/account queries
+
+
+class TokenBucket(object):
+    """
+    Token bucket for one rate limit rule.
+
+    capacity tokens are refilled evenly over interval seconds.
+    """
+
+    def __init__(self, capacity: int, interval: float):
+        """"""
+        self.capacity = capacity
+        self.interval = interval
+        self.rate = capacity / interval
+
+        self.tokens = float(capacity)
+        self.timestamp = monotonic()
+
+    def _refill(self, now: float):
+        """"""
+        elapsed = now - self.timestamp
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.timestamp = now
+
+    def available(self, now: float = None):
+        """
+        Get tokens which can be consumed right now.
+        """
+        self._refill(now or monotonic())
+        return self.tokens
+
+    def wait_time(self, now: float):
+        """
+        Get seconds to wait before next token is available.
+        """
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now: float):
+        """"""
+        self._refill(now)
+        self.tokens -= 1
+
+    def drain(self):
+        """
+        Empty the bucket, called after exchange replied with 429.
+        """
+        self.tokens = 0
+        self.timestamp = monotonic()
+
+
+class RequestScheduler(object):
+    """
+    Priority queue of requests limited by per-endpoint token buckets.
+
+    * Requests are sent by priority (cancel > order > query), FIFO inside
+      each priority.
+    * Requests with the same key (e.g. client order id) are always sent in
+      the order they were added and never run concurrently. A batch request
+      carries a tuple of keys of all requests merged into it. Keys and worker
+      assignment are decided by a pluggable DispatchPolicy.
+    * Rate limit rules are regex patterns matched against request path, a
+      request is released only when every matching bucket has a token.
+    * Under pressure, a query identical to one still waiting in queue is
+      coalesced into the pending one.
+    """
+
+    def __init__(self, policy: DispatchPolicy = None):
+        """"""
+        self._cond = Condition()
+        self.policy = policy or OrderKeyPolicy()
+
+        self._queues = {priority: deque() for priority in RequestPriority}
+        self._rules = []  # list of (pattern, bucket)
+
+        self._key_queues = {}  # key: deque of requests
+        self._inflight_keys = set()
+        self._pending_queries = {}  # coalesce key: request
+
+        self._unfinished = 0
+        self.pressure_ratio = 0.2
+
+        self.coalesced_count = 0
+
+    def add_rate_limit(self, pattern: str, capacity: int, interval: float):
+        """
+        Limit requests whose path matches pattern to capacity per interval seconds.
+        """
+        with self._cond:
+            self._rules.append((re.compile(pattern), TokenBucket(capacity, interval)))
+
+    def _match_buckets(self, path: str):
+        """"""
+        return [bucket for pattern, bucket in self._rules if pattern.match(path)]
+
+    def put(self, request):
+        """
+        Add request into scheduler, return the request which will be sent.
+        """
+        with self._cond:
+            if request.priority == RequestPriority.query:
+                coalesce_key = self._get_coalesce_key(request)
+                pending = self._pending_queries.get(coalesce_key, None)
+                if (
+                    pending
+                    and pending.callback == request.callback
+                    and self._under_pressure(request.path)
+                ):
+                    self.coalesced_count += 1
+                    return pending
+                self._pending_queries[coalesce_key] = request
+
+            for key in self.policy.get_keys(request):
+                self._key_queues.setdefault(key, deque()).append(request)
+
+            self._queues[request.priority].append(request)
+            self._unfinished += 1
+            self._cond.notify_all()
+        return request
+
+    def set_policy(self, policy: DispatchPolicy):
+        """
+        Change dispatch policy, only allowed before any request is added.
+        """
+        with self._cond:
+            self.policy = policy
+
+    def get(self, timeout: float, worker_id: int = 0):
+        """
+        Get next request worker is allowed to send, raise Empty after timeout.
+        """
+        deadline = monotonic() + timeout
+        with self._cond:
+            while True:
+                now = monotonic()
+                request, wait = self._pop_ready(now, worker_id)
+                if request:
+                    return request
+
+                remaining = deadline - now
+                if remaining <= 0:
+                    raise Empty
+                if wait:
+                    remaining = min(wait, remaining)
+                self._cond.wait(remaining)
+
+    def _pop_ready(self, now: float, worker_id: int):
+        """
+        Find first request which can be sent now.
+        @:return (request, seconds to wait for next token)
+        """
+        wait = 0
+        for queue in self._queues.values():
+            for i, request in enumerate(queue):
+                if not self._is_key_ready(request):
+                    continue
+                if not self.policy.accept(worker_id, request):
+                    continue
+
+                buckets = self._match_buckets(request.path)
+                bucket_wait = max([b.wait_time(now) for b in buckets], default=0)
+                if bucket_wait:
+                    wait = min(wait, bucket_wait) if wait else bucket_wait
+                    continue
+
+                for bucket in buckets:
+                    bucket.consume(now)
+                del queue[i]
+                self._on_popped(request)
+                return request, 0
+        return None, wait
+
+    def _is_key_ready(self, request):
+        """
+        Check request is the first of its keys and none of them is in flight.
+        """
+        for key in self.policy.get_keys(request):
+            if key in self._inflight_keys:
+                return False
+            if self._key_queues[key][0] is not request:
+                return False
+        return True
+
+    def _on_popped(self, request):
+        """"""
+        for key in self.policy.get_keys(request):
+            key_queue = self._key_queues[key]
+            key_queue.popleft()
+            if not key_queue:
+                self._key_queues.pop(key)
+            self._inflight_keys.add(key)
+
+        if request.priority == RequestPriority.query:
+            coalesce_key = self._get_coalesce_key(request)
+            if self._pending_queries.get(coalesce_key, None) is request:
+                self._pending_queries.pop(coalesce_key)
+
+    def task_done(self, request):
+        """
+        Mark request processed, release its key for the next request.
+        """
+        with self._cond:
+            for key in self.policy.get_keys(request):
+                self._inflight_keys.discard(key)
+            self._unfinished -= 1
+            self._cond.notify_all()
+
+    def join(self):
+        """
+        Block until all requests are processed.
+        """
+        with self._cond:
+            while self._unfinished:
+                self._cond.wait()
+
+    def penalize(self, path: str):
+        """
+        Drain buckets of path after server replied with rate limit error.
+        """
+        with self._cond:
+            for bucket in self._match_buckets(path):
+                bucket.drain()
+
+    def _under_pressure(self, path: str):
+        """"""
+        now = monotonic()
+        for bucket in self._match_buckets(path):
+            if bucket.available(now) < bucket.capacity * self.pressure_ratio:
+                return True
+        return False
+
+    def get_budget(self, path: str = ""):
+        """
+        Get tokens available now.
+
+        If path is given, return the least budget among rules matching path
+        (inf if no rule matches). Otherwise return dict of pattern: budget.
+        """
+        now = monotonic()
+        with self._cond:
+            if path:
+                return min(
+                    [b.available(now) for b in self._match_buckets(path)],
+                    default=float("inf"),
+                )
+            return {
+                pattern.pattern: bucket.available(now)
+                for pattern, bucket in self._rules
+            }
+
+    def qsize(self):
+        """"""
+        with self._cond:
+            return {
+                priority.name: len(queue)
+                for priority, queue in self._queues.items()
+            }
+
+    @staticmethod
+    def _get_coalesce_key(request):
+        """"""
+        return (
+            request.method,
+            request.path,
+            repr(request.params),
+            repr(request.data),
+        )
+
@@ -1 +1,2 @@
-from .websocket_client import WebsocketClient
+from .websocket_client import WebsocketClient, ConnectionState
+from .decoder import JsonDecoder, ZlibJsonDecoder, GzipJsonDecoder, DeflateJsonDecoder
@@ -0,0 +1,102 @@
+# encoding: UTF-8
+
+import json
+import zlib
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+def get_json_loads(name: str = ""):
+    """
+    Get fastest json loads function installed: orjson > ujson > json.
+    Use name to pick a specific one.
+    """
+    if name in ("", "orjson") and orjson:
+        return orjson.loads
+    if name in ("", "ujson") and ujson:
+        return ujson.loads
+    return json.loads
+
+
+class JsonDecoder(object):
+    """
+    Decode text (or utf-8 bytes) frames as json.
+
+    All json libraries accept bytes, so binary frames are parsed without
+    decoding into str first.
+    """
+
+    def __init__(self, json_lib: str = ""):
+        """"""
+        self.loads = get_json_loads(json_lib)
+
+    def decode(self, data):
+        """"""
+        return self.loads(data)
+
+    def reset(self):
+        """
+        Called when connection is (re)established.
+        """
+        pass
+
+
+class ZlibJsonDecoder(JsonDecoder):
+    """
+    Decompress binary frames with zlib, then decode as json.
+
+    * wbits=47 (32 + 15): gzip or zlib header detected automatically (Huobi)
+    * wbits=-15: raw deflate (OKEX)
+
+    Huobi and OKEX compress every frame as an independent stream, so each
+    frame is inflated on its own. Set stream=True for protocols compressing
+    the whole connection as one stream with sync flushes, then a single
+    decompressobj is reused for the connection and reset on reconnect.
+    """
+
+    def __init__(self, wbits: int = 47, stream: bool = False, json_lib: str = ""):
+        """"""
+        super(ZlibJsonDecoder, self).__init__(json_lib)
+        self.wbits = wbits
+        self.stream = stream
+        self._decompressor = None
+        self.reset()
+
+    def reset(self):
+        """"""
+        if self.stream:
+            self._decompressor = zlib.decompressobj(self.wbits)
+
+    def decode(self, data):
+        """"""
+        if self.stream:
+            return self.loads(self._decompressor.decompress(data))
+        return self.loads(zlib.decompress(data, self.wbits))
+
+
+class GzipJsonDecoder(ZlibJsonDecoder):
+    """
+    Huobi frames: one gzip member each.
+    """
+
+    def __init__(self, json_lib: str = ""):
+        """"""
+        super(GzipJsonDecoder, self).__init__(47, False, json_lib)
+
+
+class DeflateJsonDecoder(ZlibJsonDecoder):
+    """
+    OKEX frames: one raw deflate stream each.
+    """
+
+    def __init__(self, json_lib: str = ""):
+        """"""
+        super(DeflateJsonDecoder, self).__init__(-zlib.MAX_WBITS, False, json_lib)
@@ -1,15 +1,27 @@
 # encoding: UTF-8
 
 import json
+import random
 import ssl
 import sys
 import traceback
 from datetime import datetime
-from threading import Lock, Thread
-from time import sleep
+from enum import Enum
+from threading import Event, Lock, Thread
+from time import monotonic, time
 
 import websocket
 
+from .decoder import JsonDecoder
+
+
+class ConnectionState(Enum):
+    disconnected = 0
+    connecting = 1
+    connected = 2
+    backoff = 3  # Waiting before next connect attempt
+    stopped = 4
+
 
 class WebsocketClient(object):
     """
@@ -21,7 +33,9 @@ class WebsocketClient(object):
     Use stop to stop threads and disconnect websocket before destroying the client
     object (especially when exiting the programme).
 
-    Default serialization format is json.
+    Default serialization format is json. Received frames are decoded by a
+    pluggable decoder (see decoder.py), use set_decoder to change it, e.g.
+    GzipJsonDecoder for compressed frames.
 
     Callbacks to reimplement:
     * on_connected
@@ -30,8 +44,26 @@ class WebsocketClient(object):
     * on_error
 
     After start() is called, the ping thread will ping server every 60 seconds.
+
+    Connection lifecycle (see ConnectionState):
+    * The worker thread connects, receives until the connection is lost,
+      calls on_disconnected and reconnects after a jittered exponential
+      backoff, so an exchange outage does not spin in a tight loop.
+    * Subscriptions added by add_subscription are replayed in one go after
+      every (re)connect, or by calling replay_subscriptions() if the
+      protocol needs a login first (set replay_on_connect to False).
+    * If stale_timeout is set, a watchdog reconnects when a watched channel
+      has not received data for stale_timeout seconds. get_channel() maps a
+      received packet to its channel.
+    * get_metrics() returns reconnect count and downtime.
     """
 
+    replay_on_connect = True
+
+    backoff_base = 1.0
+    backoff_max = 60.0
+    backoff_reset = 30.0  # Connection lasting this long resets backoff
+
     def __init__(self):
         """Constructor"""
         self.host = None
@@ -46,6 +78,31 @@ class WebsocketClient(object):
         self.proxy_host = None
         self.proxy_port = None
 
+        self.decoder = JsonDecoder()
+
+        self.state = ConnectionState.disconnected
+        self._stop_event = Event()
+        self._watchdog_thread = None
+        self._attempts = 0
+
+        self._subscriptions = {}  # key: packet
+        self._watched = {}  # channel: keys of subscriptions watching it
+        self._channel_times = {}  # channel: last receive time
+        self._replayed = False  # Subscriptions sent on current connection
+        self.stale_timeout = 0
+
+        # Connection quality
+        self.connect_count = 0
+        self.reconnect_count = 0
+        self.stale_count = 0
+        self.connected_time = 0
+        self.disconnected_time = monotonic()
+        self.total_downtime = 0
+
+        # Time (seconds since epoch) last frame was received and decoded
+        self.receive_time = 0
+        self.decode_time = 0
+
         # For debugging
         self._last_sent_text = None
         self._last_received_text = None
@@ -58,6 +115,12 @@ class WebsocketClient(object):
             self.proxy_host = proxy_host
             self.proxy_port = proxy_port
 
+    def set_decoder(self, decoder):
+        """
+        Set decoder used to unpack received frames.
+        """
+        self.decoder = decoder
+
     def start(self):
         """
         Start the client and on_connected function is called after webscoket
@@ -67,6 +130,7 @@ class WebsocketClient(object):
         """
 
         self._active = True
+        self._stop_event.clear()
         self._worker_thread = Thread(target=self._run)
         self._worker_thread.start()
 
@@ -80,8 +144,80 @@ class WebsocketClient(object):
         This function cannot be called from worker thread or callback function.
         """
         self._active = False
+        self._stop_event.set()
         self._disconnect()
 
+    def set_stale_timeout(self, seconds: float):
+        """
+        Reconnect when a watched channel gets no data for seconds, 0 to disable.
+        """
+        self.stale_timeout = seconds
+
+    def add_subscription(self, key: str, packet: dict, watch: list = None):
+        """
+        Remember subscription packet and send it if connected.
+        watch: channels expected to stream continuously, checked by watchdog.
+        """
+        self._subscriptions[key] = packet
+        now = monotonic()
+        for channel in watch or []:
+            self._watched.setdefault(channel, set()).add(key)
+            self._channel_times.setdefault(channel, now)
+
+        # Otherwise it is sent by the replay of current connection
+        if self.state == ConnectionState.connected and self._replayed:
+            self.send_packet(packet)
+
+    def remove_subscription(self, key: str):
+        """"""
+        self._subscriptions.pop(key, None)
+        for channel, keys in list(self._watched.items()):
+            keys.discard(key)
+            if not keys:
+                self._watched.pop(channel)
+                self._channel_times.pop(channel, None)
+
+    def replay_subscriptions(self):
+        """
+        Send all subscriptions, merged by batch_subscriptions.
+        """
+        now = monotonic()
+        for channel in list(self._watched):
+            self._channel_times[channel] = now
+
+        self._replayed = True
+        for packet in self.batch_subscriptions(list(self._subscriptions.values())):
+            self.send_packet(packet)
+
+    def batch_subscriptions(self, packets: list):
+        """
+        Merge subscription packets into as few packets as protocol allows.
+        Reimplement this for protocols accepting several channels in one packet.
+        """
+        return packets
+
+    def get_channel(self, packet):
+        """
+        Get channel of a received data packet, used for staleness detection.
+        """
+        return None
+
+    def get_metrics(self):
+        """
+        Connection quality metrics, times in seconds.
+        """
+        downtime = self.total_downtime
+        if self.state != ConnectionState.connected:
+            downtime += monotonic() - self.disconnected_time
+        return {
+            "state": self.state.name,
+            "connect_count": self.connect_count,
+            "reconnect_count": self.reconnect_count,
+            "stale_count": self.stale_count,
+            "downtime": downtime,
+            "uptime": monotonic() - self.connected_time if self.state == ConnectionState.connected else 0,
+        }
+
     def join(self):
         """
         Wait till all threads finish.
@@ -111,10 +247,11 @@ class WebsocketClient(object):
         return self._get_ws().send_binary(data)
 
     def _reconnect(self):
-        """"""
+        """
+        Drop current connection, worker thread will connect again.
+        """
         if self._active:
             self._disconnect()
-            self._connect()
 
     def _create_connection(self, *args, **kwargs):
         """"""
@@ -128,7 +265,11 @@ class WebsocketClient(object):
             http_proxy_host=self.proxy_host,
             http_proxy_port=self.proxy_port,
         )
+        self.decoder.reset()
+        self._on_connection_up()
         self.on_connected()
+        if self.replay_on_connect:
+            self.replay_subscriptions()
 
     def _disconnect(self):
         """
@@ -145,54 +286,145 @@ class WebsocketClient(object):
 
     def _run(self):
         """
-        Keep running till stop is called.
+        Keep connecting and receiving till stop is called.
         """
-        try:
-            self._connect()
+        if self.stale_timeout:
+            self._watchdog_thread = Thread(target=self._run_watchdog)
+            self._watchdog_thread.daemon = True
+            self._watchdog_thread.start()
+
+        while self._active:
+            self.state = ConnectionState.connecting
+            try:
+                self._connect()
+            except:  # noqa
+                et, ev, tb = sys.exc_info()
+                self.on_error(et, ev, tb)
+                if self.state == ConnectionState.connected:
+                    self._on_connection_down()
+                else:
+                    self._disconnect()
+                self._wait_backoff()
+                continue
+
+            self._receive()
+            self._on_connection_down()
+
+            if self._active:
+                self._wait_backoff()
+
+        self.state = ConnectionState.stopped
+
+    def _receive(self):
+        """
+        Receive and handle packets till connection is lost.
+        """
+        while self._active:
+            try:
+                ws = self._get_ws()
+                if not ws:
+                    return
+                text = ws.recv()
+
+                # ws object is closed when recv function is blocking
+                if not text:
+                    return
+
+                self.receive_time = time()
+                self._record_last_received_text(text)
 
-            # todo: onDisconnect
-            while self._active:
                 try:
-                    ws = self._get_ws()
-                    if ws:
-                        text = ws.recv()
-
-                        # ws object is closed when recv function is blocking
-                        if not text:
-                            self._reconnect()
-                            continue
-
-                        self._record_last_received_text(text)
-
-                        try:
-                            data = self.unpack_data(text)
-                        except ValueError as e:
-                            print("websocket unable to parse data: " + text)
-                            raise e
-                        # print('data:', data)
-                        self.on_packet(data)
-                # ws is closed before recv function is called
-                except websocket.WebSocketConnectionClosedException:
-                    self._reconnect()
-
-                # other internal exception raised in on_packet
-                except:  # noqa
-                    et, ev, tb = sys.exc_info()
-                    self.on_error(et, ev, tb)
-                    self._reconnect()
-        except:  # noqa
-            et, ev, tb = sys.exc_info()
-            self.on_error(et, ev, tb)
-            self._reconnect()
+                    data = self.unpack_data(text)
+                except ValueError as e:
+                    print("websocket unable to parse data: {}".format(text))
+                    raise e
+                self.decode_time = time()
+
+                if self._watched:
+                    channel = self.get_channel(data)
+                    if channel:
+                        self._channel_times[channel] = monotonic()
+
+                self.on_packet(data)
+            # ws is closed before recv function is called
+            except websocket.WebSocketConnectionClosedException:
+                return
+
+            # other internal exception raised in on_packet
+            except:  # noqa
+                et, ev, tb = sys.exc_info()
+                self.on_error(et, ev, tb)
+                return
 
-    @staticmethod
-    def unpack_data(data: str):
+    def _on_connection_up(self):
+        """"""
+        now = monotonic()
+        self._replayed = False
+        self.total_downtime += now - self.disconnected_time
+        self.connected_time = now
+        self.connect_count += 1
+        if self.connect_count > 1:
+            self.reconnect_count += 1
+        self.state = ConnectionState.connected
+
+    def _on_connection_down(self):
+        """"""
+        self._disconnect()
+
+        now = monotonic()
+        self.disconnected_time = now
+        if now - self.connected_time >= self.backoff_reset:
+            self._attempts = 0
+        self.state = ConnectionState.disconnected
+
+        if self._active:
+            self.on_disconnected()
+
+    def _get_backoff(self):
+        """
+        Exponential backoff with jitter: a random delay in [50%, 100%] of
+        min(backoff_max, backoff_base * 2 ^ attempts).
+        """
+        delay = min(self.backoff_max, self.backoff_base * 2 ** self._attempts)
+        self._attempts += 1
+        return delay * random.uniform(0.5, 1.0)
+
+    def _wait_backoff(self):
+        """"""
+        self.state = ConnectionState.backoff
+        self._stop_event.wait(self._get_backoff())
+
+    def _run_watchdog(self):
         """
-        Default serialization format is json.
+        Drop connection if a watched channel is stale.
+        """
+        while self._active:
+            self._stop_event.wait(1)
+            if self.state != ConnectionState.connected or not self.stale_timeout:
+                continue
+
+            now = monotonic()
+            for channel in list(self._watched):
+                last = max(self._channel_times.get(channel, now), self.connected_time)
+                if now - last >= self.stale_timeout:
+                    self.stale_count += 1
+                    self.on_stale(channel, now - last)
+                    self._disconnect()
+                    break
+
+    def on_stale(self, channel: str, seconds: float):
+        """
+        Callback before reconnecting because channel is stale.
+        """
+        pass
+
+    def unpack_data(self, data):
+        """
+        Decode received frame with decoder.
 
         Reimplement this method if you want to use other serialization format.
         """
-        return json.loads(data)
+        return self.decoder.decode(data)
 
     def _run_ping(self):
         """"""
@@ -203,10 +435,7 @@ class WebsocketClient(object):
                 et, ev, tb = sys.exc_info()
                 self.on_error(et, ev, tb)
                 self._reconnect()
-            for i in range(60):
-                if not self._active:
-                    break
-                sleep(1)
+            self._stop_event.wait(60)
 
     def _ping(self):
         """"""
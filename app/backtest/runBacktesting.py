@@ -2,20 +2,65 @@
 
 """
 展示如何执行策略回测。
+
+python -m app.backtest.runBacktesting [--engine=event] [--search=grid] [--root=目录] [--processes=N] [--checkpoint=目录] [--no-cache]
+
+默认使用快速回测(VectorBacktester)：各周行情先从列式行情库计算一次并保存为.npy，
+各进程以内存映射方式打开，所有参数共用同一份数据。--engine=event使用逐tick事件回测。
+快速回测的逐日盈亏和成交保存在结果缓存中，只修改统计和报表代码后重新运行不必重新回测。
+参数优化使用全部CPU，结果完成一个返回一个并写入断点文件，中断后重新运行会跳过已完成的参数。
+每个回测区间一个断点文件，文件名包含行情分区、回测和统计代码、合约文件、价差设置和回测参数的版本，
+其中任何一项改变后使用新的断点文件。事件回测从MongoDB读取行情，行情不在版本中。
+
+--search选择参数搜索方式：
+    grid     全部参数组合（默认）
+    random   随机抽取--count个参数组合
+    ga       遗传算法，每代--count个参数组合，共--generations代
+    halving  逐次减半，先用第一周行情回测全部组合，每轮保留前1/3并把回测周数乘以3，直到全部区间
 """
 
 # from __future__ import division
 from os import sys
 from datetime import datetime
+from functools import partial
+from pathlib import Path
 from time import time
 from pandas import DataFrame
 from trader.backtest_engine import BacktestMainEngine, OptimizationSetting
-import multiprocessing
-import gc
+from trader.sweep import run_sweep
+from trader.utility import get_temp_path
+from trader.result_cache import ResultCache, get_code_version, get_data_version, get_file_version
+from app.backtest.runVectorBacktest import (
+    CODE_MODULES, CONTRACT_FILE, ST_SETTING_FILE,
+    load_st_setting, get_pricetick, new_vector_backtester, run_vector_cached,
+)
+
+# 除快速回测外，决定断点中统计结果的代码
+CHECKPOINT_MODULES = CODE_MODULES + (
+    'trader.backtest_engine',
+    'app.spreadTrading.stAlgo',
+    'app.spreadTrading.stBase',
+)
+
+backtester = None  # 快速回测进程内的回测引擎
+st_setting = None
+cache = None
+
+
+def get_statistics(backtest_me: BacktestMainEngine, setting: dict, capital: int):
+    """"""
+    statistics = backtest_me.calculate_statistics()
+    for k, v in setting.items():
+        statistics[k] = v
+    statistics['capital'] = capital
+    if statistics['max_ddpercent']:
+        statistics['收益回撤比'] = statistics['total_return'] / statistics['max_ddpercent']
+    if statistics['profit_days'] + statistics['loss_days']:
+        statistics['胜率'] = statistics['profit_days'] / (statistics['profit_days'] + statistics['loss_days'])
+    return statistics
 
 
 def optimize(
-        target_name: str,
         setting: dict,
         start: datetime,
         end: datetime,
@@ -42,25 +87,67 @@ def optimize(
     backtest_me.engines['St'].start()
     # 显示回测结果
     df = backtest_me.calculate_result()
-    statistics = backtest_me.calculate_statistics()
+    statistics = get_statistics(backtest_me, setting, capital)
     backtest_me.save_chart(setting)
-    for k, v in setting.items():
-        statistics[k] = v
-    # statistics['start'] = start.date()
-    # statistics['end'] = end.date()
-    # statistics['rate'] = rate
-    # statistics['slippage'] = slippage
-    # statistics['size'] = size
-    # statistics['pricetick'] = pricetick
-    statistics['capital'] = capital
-    statistics['capital'] = capital
-    if statistics['max_ddpercent']:
-        statistics['收益回撤比'] = statistics['total_return'] / statistics['max_ddpercent']
-    if statistics['profit_days'] + statistics['loss_days']:
-        statistics['胜率'] = statistics['profit_days'] / (statistics['profit_days'] + statistics['loss_days'])
     return statistics
 
 
+def init_vector_worker(week_path: str, setting: dict, pricetick: float, root: str, use_cache: bool):
+    """进程初始化：以内存映射方式打开已保存的各周行情"""
+    global backtester, st_setting, cache
+    st_setting = setting
+    backtester = new_vector_backtester(setting, root, week_path, pricetick)
+    cache = ResultCache() if use_cache else None
+
+
+def optimize_vector(
+        setting: dict,
+        start: datetime,
+        end: datetime,
+        rate: float,
+        slippage: float,
+        size: float,
+        pricetick: float,
+        capital: int,
+):
+    """
+    Function for running in multiprocessing.pool with init_vector_worker
+    """
+    daily = run_vector_cached(backtester, st_setting, setting, start, end, cache)['daily']
+
+    backtest_me = BacktestMainEngine()
+    backtest_me.set_parameters(
+        start=start,
+        end=end,
+        rate=rate,
+        slippage=slippage,
+        size=size,
+        pricetick=pricetick,
+        capital=capital)
+    if len(daily['date']):
+        backtest_me.daily_df = DataFrame(daily).set_index('date')
+    return get_statistics(backtest_me, setting, capital)
+
+
+def get_checkpoint_version(engine: str, parameters: dict, loader=None):
+    """
+    断点文件的版本：与结果缓存的键使用相同的输入，另加本文件（统计代码）。
+    loader为快速回测引擎时包含回测区间的行情分区。
+    """
+    parts = dict(
+        engine=engine,
+        code=get_code_version(CHECKPOINT_MODULES),
+        script=get_file_version(__file__),
+        contract=get_file_version(CONTRACT_FILE),
+        st_setting=get_file_version(ST_SETTING_FILE),
+        parameters=parameters,
+    )
+    if loader:
+        parts['data'] = get_data_version(
+            loader.tick_store, loader.vt_symbols, parameters['start'], parameters['end'])
+    return ResultCache.get_key(**parts)
+
+
 if __name__ == '__main__':
     # 创建回测引擎
     # ee = engine.EventEngine()
@@ -85,37 +172,74 @@ if __name__ == '__main__':
     # # 退出
     # sys.exit()
 
-    # Use multiprocessing pool for running backtesting with different setting
-    # pool = multiprocessing.Pool(multiprocessing.cpu_count())
-    pool = multiprocessing.Pool(2)
+    options = dict(arg[2:].split('=', 1) for arg in sys.argv[1:] if arg.startswith('--') and '=' in arg)
+    engine = options.get('engine', 'vector')
+    start = datetime(2019, 1, 20)
+    end = datetime(2019, 3, 14)
+    # end = datetime(2019, 2, 5)  # 测试
+    parameters = dict(start=start, end=end, rate=3 / 10000, slippage=0, size=100, pricetick=0.01, capital=1)
+
     optimization_setting = OptimizationSetting()
     optimization_setting.add_parameter(name="buy_percent", start=0.006, end=0.01, step=0.002)
     # optimization_setting.add_parameter(name="buy_percent", start=0.025, end=0.056, step=0.005)
-    optimization_setting.target_name = 'sharpe_ratio'
-    settings = optimization_setting.generate_setting()
-    target_name = optimization_setting.target_name
-
-    results = []
-    for setting in settings:
-        result = (pool.apply_async(optimize, (target_name,
-                                              setting,
-                                              datetime(2019, 1, 20),
-                                              # datetime(2019, 2, 5),  # 测试
-                                              datetime(2019, 3, 14),
-                                              3 / 10000,
-                                              0,
-                                              100,
-                                              0.01,
-                                              1)))
-        gc.collect()
-        results.append(result)
-
-    pool.close()
-    pool.join()
-    # Sort results and output
-    result_values = [result.get() for result in results]
+    optimization_setting.set_target('sharpe_ratio')
+    target_name = optimization_setting.target
 
-    result_df = DataFrame(result_values).T
+    if engine == 'event':
+        func = optimize
+        initializer = None
+        initargs = ()
+        loader = None
+    else:
+        # 各周行情只计算一次，保存后由各进程内存映射打开
+        st_setting = load_st_setting()
+        pricetick = get_pricetick(st_setting['name'].split('+')[0])
+        week_path = str(get_temp_path('sweep_weeks').joinpath(st_setting['name']))
+        loader = new_vector_backtester(st_setting, options.get('root', ''), week_path, pricetick)
+        t = time()
+        week_count = loader.save_weeks(start, end)
+        print('已保存{}周行情，耗时{:.1f}秒'.format(week_count, time() - t))
+
+        func = optimize_vector
+        initializer = init_vector_worker
+        initargs = (week_path, st_setting, pricetick, options.get('root', ''), '--no-cache' not in sys.argv)
+
+    processes = int(options.get('processes', 0))
+    checkpoint_path = Path(options.get('checkpoint', '') or get_temp_path('sweep_checkpoint'))
+    checkpoint_path.mkdir(parents=True, exist_ok=True)
+
+    def evaluate(settings: list, window_start: datetime, window_end: datetime):
+        """回测一批参数，每个回测区间使用单独的断点文件"""
+        window_parameters = dict(parameters, start=window_start, end=window_end)
+        checkpoint_file = checkpoint_path.joinpath('{}_{}_{}_{}.jsonl'.format(
+            engine, window_start.strftime('%Y%m%d%H%M'), window_end.strftime('%Y%m%d%H%M'),
+            get_checkpoint_version(engine, window_parameters, loader)[:12]))
+
+        window_results = []
+        for setting, statistics in run_sweep(
+                partial(func, **window_parameters), settings, processes, str(checkpoint_file), initializer, initargs):
+            window_results.append((setting, statistics))
+            print('{}-{} 完成{}/{}：{}，{}={}'.format(
+                window_start.date(), window_end.date(), len(window_results), len(settings),
+                setting, target_name, statistics.get(target_name)))
+        return window_results
+
+    search = options.get('search', 'grid')
+    count = int(options.get('count', 20))
+    if search == 'random':
+        ranked = optimization_setting.rank(
+            evaluate(optimization_setting.generate_random_setting(count), start, end))
+    elif search == 'ga':
+        ranked = optimization_setting.run_ga_optimization(
+            evaluate, start, end, population_size=count, generations=int(options.get('generations', 10)))
+    elif search == 'halving':
+        ranked = optimization_setting.run_successive_halving(evaluate, start, end)
+    else:
+        ranked = optimization_setting.rank(evaluate(optimization_setting.generate_setting(), start, end))
+    results = [statistics for setting, statistics in ranked]
+
+    # Sort results and output
+    result_df = DataFrame(results).T
     result_df.to_excel(r'F:\backtest_result\{}.xlsx'.format(time()))
     # 退出
     sys.exit()
@@ -0,0 +1,46 @@
+# encoding: UTF-8
+
+"""
+把MongoDB行情库(VnTrader_Tick_Db)中的tick转换为回测用的列式行情库(TickStore)。
+
+python -m app.backtest.runConvertTicks BTC_CQ.OKEX BTC_CW.OKEX [--start=20190120] [--end=20190314] [--root=目录] [--verify]
+
+不指定合约时转换全部合约；不指定--root时使用~/.vntrader/tick_store。
+"""
+
+import sys
+from datetime import datetime, timedelta
+from time import time
+
+import pymongo
+
+from trader.tick_store import TICK_DB_NAME, TickStore, convert_mongo_ticks
+
+
+def main():
+    """"""
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    options = dict(arg[2:].split('=', 1) for arg in sys.argv[1:] if arg.startswith('--') and '=' in arg)
+
+    start = datetime.strptime(options['start'], '%Y%m%d') if 'start' in options else None
+    end = None
+    if 'end' in options:
+        end = datetime.strptime(options['end'], '%Y%m%d') + timedelta(days=1) - timedelta(microseconds=1)
+
+    store = TickStore(options.get('root', ''))
+    db_client = pymongo.MongoClient('localhost', 27017)
+    vt_symbols = args or db_client[TICK_DB_NAME].list_collection_names()
+
+    for vt_symbol in vt_symbols:
+        t = time()
+        count = convert_mongo_ticks(store, vt_symbol, start, end, db_client)
+        print('%s: %d条tick，%d天，耗时%.1f秒' % (
+            vt_symbol, count, len(store.get_days(vt_symbol, start, end)), time() - t))
+
+        if '--verify' in sys.argv:
+            bad = store.verify(vt_symbol)
+            print('%s: 校验%s' % (vt_symbol, '通过' if not bad else '失败：' + ','.join(bad)))
+
+
+if __name__ == '__main__':
+    main()
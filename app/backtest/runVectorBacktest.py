@@ -0,0 +1,223 @@
+# encoding: UTF-8
+
+"""
+用列式行情库(TickStore)快速回测SniperAlgo价差，并可与逐tick事件回测引擎比对结果。
+
+python -m app.backtest.runVectorBacktest --buy_percent=0.006 [--start=20190120] [--end=20190314] [--root=目录] [--validate]
+
+价差设置读取当前目录的backtest_st_setting.json，合约读取OKEXF_backtest_contract.csv，与事件回测相同。
+--validate同时运行BacktestMainEngine，逐笔比较成交和逐日盈亏，以及因未完成换仓
+（包括数据中断、最后一周数据不完整）而结束回测的周。
+
+回测结果（逐日盈亏和成交）保存在结果缓存中，行情分区、回测代码、合约文件和参数都不变时直接读取，
+--no-cache不使用缓存。
+"""
+
+import json
+import sys
+from datetime import datetime
+from time import time
+
+from pandas import DataFrame
+
+from trader.backtest_engine import BacktestMainEngine
+from trader.result_cache import ResultCache, get_code_version, get_data_version, get_file_version
+from trader.tick_store import TickStore
+from trader.vector_backtest import VectorBacktester, get_sniper_setting
+
+RATE = 3 / 10000
+SLIPPAGE = 0
+SIZE = 100
+PRICETICK = 0.01
+CAPITAL = 1
+
+CONTRACT_FILE = 'OKEXF_backtest_contract.csv'
+ST_SETTING_FILE = 'backtest_st_setting.json'
+# 决定快速回测结果的代码
+CODE_MODULES = ('trader.vector_backtest', 'trader.tick_store', 'trader.utility', 'trader.constant')
+
+# 比对时允许的浮点误差
+PRICE_TOLERANCE = 1e-9
+PNL_TOLERANCE = 1e-9
+
+
+def new_backtest_engine(setting: dict, start: datetime, end: datetime):
+    """"""
+    backtest_me = BacktestMainEngine()
+    backtest_me.set_parameters(
+        start=start,
+        end=end,
+        rate=RATE,
+        slippage=SLIPPAGE,
+        size=SIZE,
+        pricetick=PRICETICK,
+        capital=CAPITAL)
+    backtest_me.setting = setting
+    return backtest_me
+
+
+def load_st_setting():
+    """读取价差设置，与事件回测一样只使用第一个价差"""
+    with open(ST_SETTING_FILE) as f:
+        return json.load(f)[0]
+
+
+def get_pricetick(vt_symbol: str):
+    """价格精度与事件回测发单时使用的合约一致"""
+    st_engine = BacktestMainEngine().engines['St']
+    st_engine.load_contracts()
+    return float(st_engine.get_contract(vt_symbol).pricetick)
+
+
+def new_vector_backtester(st_setting: dict, root: str = '', week_path: str = '', pricetick: float = 0):
+    """"""
+    active_vt_symbol, passive_vt_symbol = st_setting['name'].split('+')
+    return VectorBacktester(
+        TickStore(root), active_vt_symbol, passive_vt_symbol,
+        pricetick or get_pricetick(active_vt_symbol), SIZE, RATE, SLIPPAGE, week_path)
+
+
+def get_result_key(backtester: VectorBacktester, st_setting: dict, setting: dict, start: datetime, end: datetime):
+    """结果缓存的键：行情分区、代码版本、合约文件和全部参数"""
+    return ResultCache.get_key(
+        data=get_data_version(backtester.tick_store, backtester.vt_symbols, start, end),
+        code=get_code_version(CODE_MODULES),
+        contract=get_file_version(CONTRACT_FILE),
+        st_setting=st_setting,
+        setting=setting,
+        start=start,
+        end=end,
+        rate=backtester.rate,
+        slippage=backtester.slippage,
+        size=backtester.size,
+        pricetick=backtester.pricetick,
+    )
+
+
+def run_vector_cached(
+        backtester: VectorBacktester,
+        st_setting: dict,
+        setting: dict,
+        start: datetime,
+        end: datetime,
+        cache: ResultCache = None,
+):
+    """
+    @:return {'daily': 逐日盈亏, 'trades': 成交列表}，缓存中有时不再回测
+    """
+    key = get_result_key(backtester, st_setting, setting, start, end) if cache else None
+    result = cache.get(key) if cache else None
+    if result is None:
+        backtester.set_setting(get_sniper_setting(st_setting, setting))
+        backtester.run_backtesting(start, end)
+        result = {'daily': backtester.calculate_result(), 'trades': backtester.get_trades()}
+        if cache:
+            cache.put(key, result)
+    return result
+
+
+def run_event(setting: dict, start: datetime, end: datetime, root: str = ''):
+    """
+    @:return BacktestMainEngine after replay
+    """
+    backtest_me = new_backtest_engine(setting, start, end)
+    backtest_me.set_tick_store(root)
+    backtest_me.engines['St'].start()
+    backtest_me.calculate_daily_results()
+    return backtest_me
+
+
+def compare_trades(vector_trades: list, event_trades: list):
+    """
+    @:return list of differences
+    """
+    diffs = []
+    if len(vector_trades) != len(event_trades):
+        diffs.append('成交笔数不同：快速回测{}，事件回测{}'.format(len(vector_trades), len(event_trades)))
+
+    for n, (v, e) in enumerate(zip(vector_trades, event_trades)):
+        if v[:4] != e[:4] or abs(v[4] - e[4]) > PRICE_TOLERANCE or abs(v[5] - e[5]) > PRICE_TOLERANCE:
+            diffs.append('第{}笔成交不同：快速回测{}，事件回测{}'.format(n + 1, v, e))
+            break
+    return diffs
+
+
+def compare_stopped_week(vector_week: datetime, event_week: datetime):
+    """
+    @:return list of differences
+    """
+    if vector_week != event_week:
+        return ['结束回测的周不同：快速回测{}，事件回测{}'.format(vector_week, event_week)]
+    return []
+
+
+def compare_daily(daily: dict, daily_results: list):
+    """
+    @:return list of differences
+    """
+    diffs = []
+    dates = [daily_result.date for daily_result in daily_results]
+    if list(daily['date']) != dates:
+        diffs.append('交易日不同：快速回测{}天，事件回测{}天'.format(len(daily['date']), len(dates)))
+        return diffs
+
+    for n, daily_result in enumerate(daily_results):
+        for name in ['trade_count', 'commission', 'trading_pnl', 'holding_pnl', 'net_pnl']:
+            value = getattr(daily_result, name)
+            if abs(daily[name][n] - value) > PNL_TOLERANCE * max(1, abs(value)):
+                diffs.append('{} {}不同：快速回测{}，事件回测{}'.format(
+                    daily_result.date, name, daily[name][n], value))
+    return diffs
+
+
+def main():
+    """"""
+    options = dict(arg[2:].split('=', 1) for arg in sys.argv[1:] if arg.startswith('--') and '=' in arg)
+    start = datetime.strptime(options.get('start', '20190120'), '%Y%m%d')
+    end = datetime.strptime(options.get('end', '20190314'), '%Y%m%d')
+    root = options.get('root', '')
+    setting = {'buy_percent': float(options.get('buy_percent', 0.006))}
+
+    # 比对时重新回测，不使用缓存
+    cache = None if '--no-cache' in sys.argv or '--validate' in sys.argv else ResultCache()
+    st_setting = load_st_setting()
+    backtester = new_vector_backtester(st_setting, root)
+
+    t = time()
+    result = run_vector_cached(backtester, st_setting, setting, start, end, cache)
+    daily = result['daily']
+    vector_time = time() - t
+    print('快速回测耗时%.2f秒，成交%d笔%s' % (
+        vector_time, len(result['trades']), '（缓存）' if cache and cache.hits else ''))
+
+    backtest_me = new_backtest_engine(setting, start, end)
+    df = DataFrame(daily).set_index('date') if len(daily['date']) else None
+    backtest_me.calculate_statistics(df)
+
+    if '--validate' not in sys.argv:
+        return
+
+    t = time()
+    event_me = run_event(setting, start, end, root)
+    event_time = time() - t
+    print('事件回测耗时%.2f秒，成交%d笔，快速回测加速%.1f倍' % (
+        event_time, len(event_me.trades), event_time / max(vector_time, 1e-6)))
+
+    event_trades = [
+        (trade.datetime, trade.vt_symbol, trade.direction, trade.offset, trade.price, trade.volume)
+        for trade in event_me.trades.values()
+    ]
+    diffs = compare_trades(result['trades'], event_trades)
+    diffs += compare_daily(daily, list(event_me.daily_results.values()))
+    diffs += compare_stopped_week(backtester.stopped_week, event_me.engines['St'].stopped_week)
+
+    if diffs:
+        print('比对失败：')
+        for diff in diffs:
+            print(diff)
+        sys.exit(1)
+    print('比对通过：成交和逐日盈亏一致')
+
+
+if __name__ == '__main__':
+    main()
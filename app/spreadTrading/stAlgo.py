@@ -1,6 +1,7 @@
 from collections import defaultdict
 from trader.constant import (Direction, Offset, Status, StOrderType, ORDER_ST2VT, ORDER_HEDGE)
 from datetime import datetime
+from trader.latency import tracer
 
 
 class SniperAlgo():
@@ -24,6 +25,7 @@ class SniperAlgo():
 
         self.legOrderDict = {self.activeVtSymbol: [], self.passiveVtSymbol: []}  # vtSymbol: list of vt_client_oid
         self.orderTradedDict = defaultdict(int)  # vt_client_oid: tradedVolume
+        self.trace = None  # 最新行情的延迟跟踪，未开启时为None
 
     # ----------------------------------------------------------------------
     def start(self):
@@ -117,7 +119,8 @@ class SniperAlgo():
             return
         (direction, offset) = ORDER_ST2VT[order_type]
         payup = spread.allLegs[self.activeVtSymbol].payup
-        vt_client_oid = self.stEngine.sendOrder(self.activeVtSymbol, direction, offset, price, volume, payup,self.spread.name)
+        trace_id = tracer.on_decision(self.trace) if self.trace else ''
+        vt_client_oid = self.stEngine.sendOrder(self.activeVtSymbol, direction, offset, price, volume, payup,self.spread.name, trace_id)
         self.stEngine.write_log('{}发出新的主动腿{}狙击单，方向{},{}，数量{}'.format(self.spread.name,self.activeVtSymbol, direction, offset, volume))
 
         # 保存到字典中,vt_client_oid为set类型，避免重复添加
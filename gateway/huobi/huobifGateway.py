@@ -9,14 +9,14 @@ import hashlib
 import hmac
 import json
 import sys
-import zlib
+import time
 from copy import copy
 from datetime import datetime
 from threading import Lock, Thread
 import pandas as pd
 from requests import ConnectionError
-from api.rest import Request, RestClient
-from api.websocket import WebsocketClient
+from api.rest import Request, RequestPriority, RestClient
+from api.websocket import WebsocketClient, GzipJsonDecoder
 from trader.constant import (
     Direction,
     Offset,
@@ -27,7 +27,6 @@ from trader.constant import (
 )
 from trader.gateway import BaseGateway
 from trader.object import (
-    TickData,
     OrderData,
     TradeData,
     PositionData,
@@ -38,14 +37,43 @@ from trader.object import (
     SubscribeRequest,
     LogData,
 )
-from urllib import parse
 from trader.utility import DBEngine
+from .huobifSigner import HuobiSigner, _encode
+from .huobifLedger import OrderLedger
+from .huobifShard import SymbolSharder
+from trader.orderid import OrderIdAllocator
+from trader.depth import DepthBook, OrderBook
+from trader.feed_arbiter import FeedArbiter
+from trader.latency import TraceStage, tracer
 from trader.constant import *
 
 REST_HOST = 'https://api.hbdm.com'
 WEBSOCKET_HOST = 'wss://www.hbdm.com/ws'
 WEBSOCKET_HOST_TRADE = 'wss://api.hbdm.com/notification'
 
+# 增量深度行情的档位数（20或150）
+INCREMENTAL_DEPTH_SIZE = 20
+# 心跳作为一个频道由watchdog检查
+HEARTBEAT_CHANNEL = 'ping'
+
+# REST请求表头，各请求共用
+REST_HEADERS = {
+    "Accept": "application/json",
+    'Content-Type': 'application/json',
+    'User-Agent': 'Mozilla/5.0 (Windows NT 6.1; WOW64; rv:53.0) Gecko/20100101 Firefox/53.0'
+}
+
+# REST接口限频：(路径正则, 次数, 秒)
+RATE_LIMITS = [
+    (r'/api/v1/contract_(order|batchorder|cancel)', 30, 3),
+    (r'/api/v1/contract_contract_info', 20, 1),
+]
+
+# 批量下单、撤单：窗口期内的请求合并发送
+BATCH_WINDOW = 0.002
+BATCH_ORDER_SIZE = 10
+BATCH_CANCEL_SIZE = 10
+
 # 委托状态类型映射
 STATUS_OKEX2VT = {}
 STATUS_OKEX2VT[0] = Status.NOTTRADED
@@ -74,24 +102,48 @@ class HuobifGateway(BaseGateway):
     # xxx账号
     default_setting = {
         "key": "xxxxx",
-        "secret": "xxxxx"
+        "secret": "xxxxx",
+        "incremental_depth": False,
+        "stale_timeout": 30,
+        "market_connections": 1,
+        "shard_policy": "underlying",
+        "redundant_feed": False,
+        "tick_filter_levels": 0,
+        "tick_filter_mode": "price_size"
     }
 
     def __init__(self, event_engine):
         """Constructor"""
         super(HuobifGateway, self).__init__(event_engine,"HUOBIF")
 
+        self.ledger = OrderLedger(DBEngine())
         self.rest_api = HuobifRestApi(self)
-        self.ws_api = HuobifWebsocketApi(self)
+        self.ws_api = HuobifMarketApi(self)
         self.ws_api_trade = HuobiTradeWebsocketApi(self)
 
     def connect(self, setting: dict):
         """"""
         key = setting["key"]
         secret = setting["secret"]
+        # 盘口前N档不变的tick不推送，0为不过滤
+        self.set_tick_filter(
+            setting.get("tick_filter_levels", 0),
+            setting.get("tick_filter_mode", "price_size"),
+        )
+
+        self.ledger.load(key)
 
         self.rest_api.connect(key, secret)
-        self.ws_api.connect(key, secret)
+        self.ws_api.connect(
+            key,
+            secret,
+            setting.get("incremental_depth", False),
+            setting.get("stale_timeout", 30),
+            setting.get("market_connections", 1),
+            setting.get("shard_policy", "underlying"),
+            setting.get("shard_map", None),
+            setting.get("redundant_feed", False),
+        )
         self.ws_api_trade.connect(key, secret)
 
     def subscribe(self, req: SubscribeRequest):
@@ -117,11 +169,20 @@ class HuobifGateway(BaseGateway):
         """"""
         self.rest_api.query_position(strategy_name,symbol)
 
+    def get_market_metrics(self):
+        """行情连接的合约分配、重连和延迟统计"""
+        return self.ws_api.get_metrics()
+
+    def get_feed_stats(self):
+        """冗余行情连接的领先次数统计"""
+        return self.ws_api.get_feed_stats()
+
     def close(self):
         """"""
         self.rest_api.stop()
         self.ws_api.stop()
         self.ws_api_trade.stop()
+        self.ledger.stop()
 
 
 class HuobifRestApi(RestClient):
@@ -139,34 +200,42 @@ class HuobifRestApi(RestClient):
         self.key = ""
         self.secret = ""
         self.passphrase = ""
+        self.signer = None
+        self.allocator = None
         self.order_count = 0
         self.connect_time = 0
         self.orders = {}
+        for pattern, capacity, interval in RATE_LIMITS:
+            self.add_rate_limit(pattern, capacity, interval)
+        self.add_batch_rule(
+            '/api/v1/contract_order',
+            '/api/v1/contract_batchorder',
+            merge=merge_batch_order,
+            split=split_batch_order,
+            max_size=BATCH_ORDER_SIZE,
+            window=BATCH_WINDOW,
+        )
+        self.add_batch_rule(
+            '/api/v1/contract_cancel',
+            '/api/v1/contract_cancel',
+            merge=merge_batch_cancel,
+            split=split_batch_cancel,
+            group=lambda request: request.data['symbol'],
+            max_size=BATCH_CANCEL_SIZE,
+            window=BATCH_WINDOW,
+        )
         self.query_contract()
-        self.dbEngine = DBEngine()
 
     def sign(self, request):
         """
-        Generate OKEX signature.
+        Generate Huobi signature.
         """
         # Sign
-        timestamp = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S')
-        params_to_sign = {'AccessKeyId': self.key,
-                          'SignatureMethod': 'HmacSHA256',
-                          'SignatureVersion': '2',
-                          'Timestamp': timestamp}
-
-        params_to_sign['Signature'] = createSign(params_to_sign, request.method,'api.hbdm.com', request.path, self.secret)
         request.data = json.dumps(request.data)
-
-        request.path = request.path + '?' + parse.urlencode(params_to_sign)
+        request.path = request.path + '?' + self.signer.sign(request.method, request.path)
 
         # 添加表头
-        request.headers = {
-            "Accept": "application/json",
-            'Content-Type': 'application/json',
-            'User-Agent':'Mozilla/5.0 (Windows NT 6.1; WOW64; rv:53.0) Gecko/20100101 Firefox/53.0'
-        }
+        request.headers = REST_HEADERS
         return request
 
     def connect(
@@ -179,17 +248,14 @@ class HuobifRestApi(RestClient):
         """
         self.key = key
         self.secret = secret
+        self.signer = HuobiSigner(key, secret)
 
         self.init(REST_HOST)
 
         self.start()
-        try:
-            d = {'apikey':self.key}
-            list = self.dbEngine.dbQuery(DB_NAME,DB_ORDERID,d)
-            if list[0]:
-                self.order_count = list[0]['order_count']
-        except:
-            self.writeLog('查询MongoDB失败{}'.format(d))
+        # 委托编号按块从数据库租用，连接时在后台租用第一块，下单时不再写数据库
+        self.allocator = OrderIdAllocator.get(self.key)
+        self.allocator.start()
         self.gateway.write_log("REST API启动成功")
 
 
@@ -205,24 +271,8 @@ class HuobifRestApi(RestClient):
         self.writeLog(u'火币合约信息查询成功')
 
     def query_position(self,strategy_name,symbol):
-        # 初始化默认持仓为0
-        long_qty = 0
-        short_qty = 0
-        flt = {
-            'strategy_name': strategy_name,
-            'vt_symbol':symbol
-        }
-        list = self.dbEngine.dbQuery(DB_NAME, DB_ORDER_STRATEGY, flt)
-        for item in list:
-            if item['status'] not in ('已撤单', '挂单中'):
-                if item['direction'] == 'buy' and item['offset'] == 'open':  # 开多
-                    long_qty += int(item['trade_volume'])
-                if item['direction'] == 'sell' and item['offset'] == 'close':  # 平多
-                    long_qty -= int(item['trade_volume'])
-                if item['direction'] == 'sell' and item['offset'] == 'open':  # 开空
-                    short_qty += int(item['trade_volume'])
-                if item['direction'] == 'buy' and item['offset'] == 'close':  # 平空
-                    short_qty -= int(item['trade_volume'])
+        # 持仓由账本的成交日志恢复
+        long_qty, short_qty = self.gateway.ledger.get_position(strategy_name, symbol)
         position = PositionData(
             symbol=symbol[:6],
             strategy_name=strategy_name,
@@ -240,13 +290,21 @@ class HuobifRestApi(RestClient):
 
     def send_order(self, req: OrderRequest):
         """"""
-        self.order_count += 1
+        try:
+            order_count = self.allocator.next()
+        except Exception as e:  # noqa
+            # 无法从MongoDB租用委托号时不发单，不中断策略线程
+            self.writeLog('获取委托号失败，委托未发出：{}'.format(e))
+            return ""
+        self.order_count = order_count
+        if req.trace_id:
+            tracer.bind_order(order_count, req.trace_id)
         contract = req.contract
         data = {
             "symbol": contract.underlying_index,
             "contract_type": contract.alias,
             # "contract_code": req.symbol,
-            "client_order_id": self.order_count,
+            "client_order_id": order_count,
             "price": req.price,
             "volume": str(int(req.volume)),
             "direction": typemap[req.direction],
@@ -255,7 +313,7 @@ class HuobifRestApi(RestClient):
             "order_price_type": 'limit'
         }
 
-        order = req.create_order_data(self.order_count,req.strategy_name, self.gateway_name)
+        order = req.create_order_data(order_count,req.strategy_name, self.gateway_name)
         self.add_request(
             "POST",
             "/api/v1/contract_order",
@@ -264,14 +322,10 @@ class HuobifRestApi(RestClient):
             extra=order,
             on_failed=self.on_send_order_failed,
             on_error=self.on_send_order_error,
+            priority=RequestPriority.order,
+            key=str(order_count),
         )
-        condition = {'apikey':self.key}
-        new = {'apikey':self.key,'order_count':self.order_count}
-        try:
-            self.dbEngine.dbUpdate(DB_NAME,DB_ORDERID,new,condition,upsert=True)
-        except:
-            self.writeLog('更新MongoDB失败{}'.format(new))
-        return str(self.order_count)
+        return str(order_count)
 
     def cancel_order(self, req: CancelRequest):
         """"""
@@ -282,6 +336,8 @@ class HuobifRestApi(RestClient):
             data=data,
             callback=self.on_cancel_order,
             on_error=self.on_cancel_order_error,
+            priority=RequestPriority.cancel,
+            key=str(req.vt_client_oid),
         )
 
     def on_send_order_failed(self, status_code: str, request: Request):
@@ -291,6 +347,8 @@ class HuobifRestApi(RestClient):
         order = request.extra
         order.status = Status.REJECTED
         self.gateway.on_order(order)
+        if tracer.enabled:
+            tracer.finish_order(order.vt_client_oid)
 
         msg = f"委托失败，状态码：{status_code}，信息：{request.response.text}"
         self.gateway.write_log(msg)
@@ -304,6 +362,8 @@ class HuobifRestApi(RestClient):
         order = request.extra
         order.status = Status.REJECTED
         self.gateway.on_order(order)
+        if tracer.enabled:
+            tracer.finish_order(order.vt_client_oid)
 
         # Record exception if not ConnectionError
         if not issubclass(exception_type, ConnectionError):
@@ -311,10 +371,16 @@ class HuobifRestApi(RestClient):
 
     def on_send_order(self, result, request):
         """"""
+        if tracer.enabled:
+            order_count = request.extra.vt_client_oid
+            tracer.mark_order(order_count, TraceStage.REST_SEND, request.sent_time)
+            tracer.mark_order(order_count, TraceStage.ACK)
+            if result['status'] != 'ok':
+                tracer.finish_order(order_count)
         if result['status'] == 'ok':
             self.writeLog('下单成功{}'.format(result))
             order = request.extra
-            data = eval(request.data)
+            data = get_request_data(request)
             time = datetime.fromtimestamp(result['ts'] / 1000)
             d = {
                 'apikey': self.key,
@@ -331,10 +397,7 @@ class HuobifRestApi(RestClient):
                 'time':time,
                 'trade_avg_price':0
             }
-            try:
-                self.dbEngine.dbInsert(DB_NAME, DB_ORDER_STRATEGY, d)
-            except:
-                self.writeLog('插入成交数据到MongoDB失败')
+            self.gateway.ledger.add_order(d)
         else:
             self.writeLog('下单失败{}'.format(result))
             order = request.extra
@@ -342,7 +405,7 @@ class HuobifRestApi(RestClient):
             order.status = Status.REJECTED
             order.vt_client_oid = str(order.vt_client_oid)
             self.gateway.on_order(copy(order))
-            data = eval(request.data)
+            data = get_request_data(request)
             time = datetime.fromtimestamp(result['ts'] / 1000)
             d = {
                 'apikey': self.key,
@@ -359,10 +422,7 @@ class HuobifRestApi(RestClient):
                 'time':time,
                 'trade_avg_price':0
             }
-            try:
-                self.dbEngine.dbInsert(DB_NAME, DB_ORDER_STRATEGY, d)
-            except:
-                self.writeLog('插入成交数据到MongoDB失败')
+            self.gateway.ledger.add_order(d)
 
     def on_cancel_order_error(
             self, exception_type: type, exception_value: Exception, tb, request: Request
@@ -380,19 +440,8 @@ class HuobifRestApi(RestClient):
             d = result['data']
             if d['successes']:
                 self.writeLog('撤单成功{}'.format(result))
-                data = eval(request.data)
-                flt ={
-                    'apikey': self.key,
-                    'order_count': int(data['client_order_id'])
-                }
-                try:
-                    list = self.dbEngine.dbQuery(DB_NAME,DB_ORDER_STRATEGY,flt)
-                    if list[0]:
-                        d = list[0]
-                        d['status'] = '已撤单'
-                    self.dbEngine.dbUpdate(DB_NAME, DB_ORDER_STRATEGY, d,flt)
-                except:
-                    self.writeLog('更新撤单数据到MongoDB失败')
+                data = get_request_data(request)
+                self.gateway.ledger.update_order(int(data['client_order_id']), status='已撤单')
             else:
                 self.writeLog('撤单失败{}'.format(result))
 
@@ -417,30 +466,118 @@ class HuobifRestApi(RestClient):
         )
 
 
+class HuobifMarketApi(object):
+    """
+    火币合约行情：按分片策略把合约分到多条websocket连接。
+
+    每条连接有自己的接收解析线程，某个合约的突发行情不会阻塞其他连接上合约
+    的深度推送；各连接解析出的tick都经gateway.on_tick放入同一个EventEngine。
+    同一合约固定在一条连接上，因此单个合约的tick仍然按交易所顺序推送。
+
+    redundant为True时每个分片开两条连接订阅相同频道，由FeedArbiter按交易所ts
+    去重，先到的推送，某条连接卡顿时由另一条补上。
+    """
+
+    def __init__(self, gateway):
+        """"""
+        self.gateway = gateway
+        self.sharder = SymbolSharder()
+        self.connections = [HuobifWebsocketApi(gateway)]
+        self.replicas = 1
+        self.arbiter = None
+
+    def connect(
+        self,
+        key: str,
+        secret: str,
+        incremental: bool = False,
+        stale_timeout: float = 30,
+        count: int = 1,
+        policy: str = "underlying",
+        shard_map: dict = None,
+        redundant: bool = False,
+    ):
+        """"""
+        self.sharder = SymbolSharder(count, policy, shard_map)
+        self.replicas = 2 if redundant else 1
+        self.arbiter = FeedArbiter() if redundant else None
+        self.connections = [
+            HuobifWebsocketApi(self.gateway, n, replica, self.arbiter)
+            for n in range(self.sharder.count)
+            for replica in range(self.replicas)
+        ]
+        for api in self.connections:
+            api.connect(key, secret, incremental, stale_timeout)
+
+    def subscribe(self, req: SubscribeRequest):
+        """"""
+        index = self.sharder.assign(req.symbol) * self.replicas
+        for api in self.connections[index:index + self.replicas]:
+            api.subscribe(req)
+
+    def get_feed_stats(self):
+        """"""
+        if not self.arbiter:
+            return {}
+        return self.arbiter.get_stats()
+
+    def stop(self):
+        """"""
+        for api in self.connections:
+            api.stop()
+
+    def get_metrics(self):
+        """"""
+        return [
+            dict(
+                api.get_metrics(),
+                shard=api.shard,
+                replica=api.replica,
+                symbols=self.sharder.get_symbols(api.shard),
+            )
+            for api in self.connections
+        ]
+
+
 class HuobifWebsocketApi(WebsocketClient):
     """火币合约行情订阅websocket接口"""
 
-    def __init__(self, gateway):
+    def __init__(self, gateway, shard: int = 0, replica: int = 0, arbiter: FeedArbiter = None):
         """"""
         super(HuobifWebsocketApi, self).__init__()
+        self.set_decoder(GzipJsonDecoder())
 
         self.gateway = gateway
         self.gateway_name = gateway.gateway_name
+        self.shard = shard  # 行情连接序号
+        self.replica = replica  # 冗余连接序号
+        self.name = "{}-{}".format(shard, replica)
+        self.arbiter = arbiter  # 冗余连接间去重，None为单连接
+
+        # 推送延迟统计（本地接收时间 - 交易所ts，毫秒，含两地时钟差）
+        self.lag_count = 0
+        self.lag_total = 0
+        self.lag_max = 0
+        self.lag_last = 0
 
         self.key = ""
         self.secret = ""
 
-        self.ticks = {}
+        self.ticks = {}  # symbol: DepthBook
+        self.channels = {}  # depth channel: DepthBook
 
-    # ----------------------------------------------------------------------
-    def unpack_data(self, data):
-        """重载"""
-        return json.loads(zlib.decompress(data, 47).decode('utf-8'))
+        # 增量深度行情
+        self.incremental = False
+        self.order_books = {}  # depth channel: OrderBook
+        self.gap_count = 0
 
-    def connect(self, key: str, secret: str):
+    def connect(self, key: str, secret: str, incremental: bool = False, stale_timeout: float = 30):
         """"""
         self.key = key
         self.secret = secret
+        self.incremental = incremental
+        # 订阅的深度频道超过stale_timeout秒无推送时重连
+        self.set_stale_timeout(stale_timeout)
         self.init(WEBSOCKET_HOST)
         self.start()
 
@@ -454,43 +591,93 @@ class HuobifWebsocketApi(WebsocketClient):
         """
         Subscribe to tick data upate.
         """
+        if self.incremental:
+            channel = "market.{}.depth.size_{}.high_freq".format(req.symbol, INCREMENTAL_DEPTH_SIZE)
+        else:
+            channel = "market.{}.depth.step0".format(req.symbol)
+        self.sub_channel(channel)
+
+        if req.symbol not in self.ticks:
+            book = DepthBook(req.symbol, req.exchange, self.gateway_name)
+            self.ticks[req.symbol] = book
+            self.channels[channel] = book
+            if self.incremental:
+                self.order_books[channel] = OrderBook()
+
+    def sub_channel(self, channel: str):
+        """
+        订阅频道，增量深度频道订阅后先推送一次全量快照，重连后自动重新订阅。
+        增量深度只在盘口变化时推送，不活跃的合约可能长时间没有数据，
+        由心跳判断连接是否失效。
+        """
+        watch = HEARTBEAT_CHANNEL if channel.endswith('high_freq') else channel
+        self.add_subscription(channel, self.get_sub_packet(channel), [watch])
+
+    def get_sub_packet(self, channel: str):
+        """"""
         subscribeReq = {
-            "sub": "market.{}.depth.step0".format(req.symbol),
+            "sub": channel,
             "id": "id1"
         }
-        self.send_packet(subscribeReq)
-
-        tick = TickData(
-            symbol=req.symbol,
-            exchange=req.exchange,
-            name=req.symbol,
-            datetime=datetime.now(),
-            gateway_name=self.gateway_name,
-        )
-        self.ticks[req.symbol] = tick
+        if channel.endswith('high_freq'):
+            subscribeReq["data_type"] = "incremental"
+        return subscribeReq
+
+    def resubscribe(self, channel: str):
+        """增量深度序号不连续时，重新订阅以获取新的快照"""
+        self.send_packet({"unsub": channel, "id": "id1"})
+        self.send_packet(self.get_sub_packet(channel))
+
+    def get_channel(self, packet: dict):
+        """"""
+        if 'ping' in packet:
+            return HEARTBEAT_CHANNEL
+        return packet.get('ch', None)
+
+    def get_metrics(self):
+        """"""
+        metrics = super(HuobifWebsocketApi, self).get_metrics()
+        metrics.update({
+            "lag_count": self.lag_count,
+            "lag_avg": self.lag_total / self.lag_count if self.lag_count else 0,
+            "lag_max": self.lag_max,
+            "lag_last": self.lag_last,
+        })
+        return metrics
 
     def on_connected(self):
         """"""
-        self.gateway.write_log("火币合约行情Websocket API连接成功")
-        for symbol in self.ticks:
-            req = SubscribeRequest(
-                symbol=symbol,
-                exchange=Exchange.HUOBI.value
-            )
-            self.subscribe(req)
+        self.gateway.write_log("火币合约行情Websocket API[{}]连接成功".format(self.name))
+        # 重连后等待新的快照，订阅由WebsocketClient统一重发
+        for order_book in self.order_books.values():
+            order_book.clear()
+
+    def on_stale(self, channel: str, seconds: float):
+        """"""
+        self.gateway.write_log("{}已{:.0f}秒无推送，重新连接".format(channel, seconds))
 
     def on_disconnected(self):
         """"""
-        self.gateway.write_log("Websocket API连接断开")
+        self.gateway.write_log("火币合约行情Websocket API[{}]连接断开".format(self.name))
 
     def on_packet(self, packet: dict):
         """"""
         if 'ping' in packet:
             self.pong(packet)
         if 'ch' in packet:
+            lag = time.time() * 1000 - packet['ts']
+            self.lag_count += 1
+            self.lag_total += lag
+            self.lag_last = lag
+            if lag > self.lag_max:
+                self.lag_max = lag
+
             if 'depth' in packet['ch']:
                 try:
-                    self.on_depth(packet)
+                    if packet['ch'] in self.order_books:
+                        self.on_depth_diff(packet)
+                    else:
+                        self.on_depth(packet)
                 except:
                     pass
 
@@ -510,25 +697,62 @@ class HuobifWebsocketApi(WebsocketClient):
 
     def on_depth(self, d):
         """"""
-        symbol = d['ch'].split('.')[1]
-        tick = self.ticks.get(symbol, None)
-        if not tick:
+        book = self.channels.get(d['ch'], None)
+        if not book:
             return
 
-        bids = d['tick']['bids']
-        for n in range(5):
-            l = bids[n]
-            tick.__setattr__('bid_price_' + str(n + 1), float(l[0]))
-            tick.__setattr__('bid_volume_' + str(n + 1), float(l[1]))
+        tick = d['tick']
+        bids = tick['bids']
+        asks = tick['asks']
+        # 档位不足时丢弃
+        if len(bids) < book.levels or len(asks) < book.levels:
+            return
+        book.update_bids(bids, float)
+        book.update_asks(asks, float)
+        book.datetime = datetime.fromtimestamp(d['ts'] / 1000)
+        if self.arbiter:
+            self.arbiter.forward(d['ch'], d['ts'], self.name, self.publish, book, d['ts'])
+        else:
+            self.publish(book, d['ts'])
 
-        asks = d['tick']['asks']
-        for n in range(5):
-            l = asks[n]
-            tick.__setattr__('ask_price_' + str(n + 1), float(l[0]))
-            tick.__setattr__('ask_volume_' + str(n + 1), float(l[1]))
+    def publish(self, book: DepthBook, ts: int):
+        """"""
+        tick = book.to_tick()
+        if tracer.enabled:
+            tick.trace = tracer.new_tick_trace(ts, self.receive_time, self.decode_time)
+        self.gateway.on_tick(tick)
+
+    def on_depth_diff(self, d):
+        """增量深度行情：维护完整盘口，只在前几档变化时推送tick"""
+        channel = d['ch']
+        order_book = self.order_books[channel]
+        tick = d['tick']
+        version = tick['version']
+
+        if tick['event'] == 'snapshot':
+            order_book.apply_snapshot(tick['bids'], tick['asks'], version)
+        elif order_book.version is None:
+            # 等待快照
+            return
+        elif version != order_book.version + 1:
+            self.gap_count += 1
+            self.gateway.write_log("{}深度序号不连续：{} -> {}，重新订阅".format(
+                channel, order_book.version, version))
+            order_book.clear()
+            self.resubscribe(channel)
+            return
+        else:
+            order_book.apply_update(tick['bids'], tick['asks'], version)
 
-        tick.datetime = datetime.fromtimestamp(d['ts'] / 1000)
-        self.gateway.on_tick(copy(tick))
+        book = self.channels[channel]
+        if not order_book.fill(book):
+            return
+        book.datetime = datetime.fromtimestamp(d['ts'] / 1000)
+        if self.arbiter:
+            # 增量深度以version去重，每条连接各自维护完整盘口
+            self.arbiter.forward(channel, version, self.name, self.publish, book, d['ts'])
+        else:
+            self.publish(book, d['ts'])
 
 #-----------------------------------------
 #交易相关的websocket接口,订单账户授权等
@@ -538,6 +762,7 @@ class HuobiTradeWebsocketApi(WebsocketClient):
     def __init__(self, gateway):
         """"""
         super(HuobiTradeWebsocketApi, self).__init__()
+        self.set_decoder(GzipJsonDecoder())
 
         self.gateway = gateway
         self.gateway_name = gateway.gateway_name
@@ -545,7 +770,6 @@ class HuobiTradeWebsocketApi(WebsocketClient):
         self.key = ""
         self.secret = ""
         self.orders = {}
-        self.dbEngine = DBEngine()
 
     def connect(self, key: str, secret: str):
         """"""
@@ -612,13 +836,15 @@ class HuobiTradeWebsocketApi(WebsocketClient):
             d = packet
             # 接收时名称也修改为vt_client_oid
             vt_client_oid = d['client_order_id']
-            flt = {
-                'apikey': self.key,
-                'order_count': int(vt_client_oid)
-            }
-            list = self.dbEngine.dbQuery(DB_NAME, DB_ORDER_STRATEGY, flt)
-            if list and list[0]:
-                record = list[0]
+            if vt_client_oid is None:
+                return
+            record, pos = self.gateway.ledger.on_order_notify(
+                vt_client_oid, d["status"], d.get("trade_volume", 0), d['trade_avg_price'])
+            if tracer.enabled and (d.get("trade_volume", 0) or d["status"] in (5, 6, 7)):
+                if d.get("trade_volume", 0):
+                    tracer.mark_order(vt_client_oid, TraceStage.FILL)
+                tracer.finish_order(vt_client_oid)
+            if record:
                 order = self.orders.get(vt_client_oid, None)
                 if not order:
                     dic = {"quarter": "_CQ", "next_week": "_NW", "this_week": "_CW"}
@@ -637,35 +863,10 @@ class HuobiTradeWebsocketApi(WebsocketClient):
                     )
                     self.orders[vt_client_oid] = order
 
-                order.traded = int(d.get("trade_volume", order.traded))
+                order.traded = record['trade_volume']
                 order.status = STATUS_OKEX2VT.get(d["status"], order.status)
 
-                status_dict = {3:'挂单中',4:'部分成交',5:'部分成交已撤单',6:'全部成交',7:'已撤单'}
-                record['status'] = status_dict[d["status"]]
-                record['trade_avg_price'] = d['trade_avg_price']
-                record['trade_volume'] = order.traded
-                self.dbEngine.dbUpdate(DB_NAME, DB_ORDER_STRATEGY, record, flt)
-
-                # 初始化默认持仓为0
-                long_qty = 0
-                short_qty = 0
-                flt = {
-                    'apikey': self.key,
-                    'strategy_name': order.strategy_name,
-                    'vt_symbol': order.vt_symbol
-                }
-                list = self.dbEngine.dbQuery(DB_NAME, DB_ORDER_STRATEGY, flt)
-                for item in list:
-                    if item['status'] not in ('已撤单', '挂单中'):
-                        # print('item:{}'.format(item))
-                        if item['direction'] == 'buy' and item['offset'] == 'open': #开多
-                            long_qty += int(item['trade_volume'])
-                        if item['direction'] == 'sell' and item['offset'] == 'close': #平多
-                            long_qty -= int(item['trade_volume'])
-                        if item['direction'] == 'sell' and item['offset'] == 'open':  #开空
-                            short_qty += int(item['trade_volume'])
-                        if item['direction'] == 'buy' and item['offset'] == 'close':  # 平空
-                            short_qty -= int(item['trade_volume'])
+                long_qty, short_qty = pos
                 position = PositionData(
                     symbol=order.symbol,
                     strategy_name=order.strategy_name,
@@ -674,7 +875,6 @@ class HuobiTradeWebsocketApi(WebsocketClient):
                     long_qty=long_qty,
                     short_qty=short_qty,
                     gateway_name=self.gateway_name)
-                # print('position:{}'.format(position.__dict__))
                 self.gateway.on_position(position)
                 self.gateway.on_order(copy(order))
 
@@ -695,11 +895,6 @@ class HuobiTradeWebsocketApi(WebsocketClient):
         req = {'pong': data['ts']}
         self.send_packet(req)
 
-    # ----------------------------------------------------------------------
-    def unpack_data(self, data):
-        """重载"""
-        return json.loads(zlib.decompress(data, 47).decode('utf-8'))
-
 # ----------------------------------------------------------------------
 def generateSignature(param=None, _accessKeySecret=None):
     # 签名参数:
@@ -724,22 +919,67 @@ def generateSignature(param=None, _accessKeySecret=None):
     # 进行base64编码
     return base64.b64encode(dig).decode()
 
+
 # ----------------------------------------------------------------------
-#进行编码
-def _encode(s):
-    # return urllib.pathname2url(s)
-    return parse.quote(s, safe='')
-
-#对火币http请求进行签名
-def createSign(pParams, method, host_url, request_path, secret_key):
-    sorted_params = sorted(pParams.items(), key=lambda d: d[0], reverse=False)
-    encode_params = parse.urlencode(sorted_params)
-    payload = [method, host_url, request_path, encode_params]
-    payload = '\n'.join(payload)
-    payload = payload.encode(encoding='UTF8')
-    secret_key = secret_key.encode(encoding='UTF8')
-    digest = hmac.new(secret_key, payload, digestmod=hashlib.sha256).digest()
-    signature = base64.b64encode(digest)
-    signature = signature.decode()
-    return signature
+def get_request_data(request):
+    """签名后request.data为json字符串，批量拆分回的请求仍为dict"""
+    if isinstance(request.data, dict):
+        return request.data
+    return json.loads(request.data)
+
+
+def merge_batch_order(requests):
+    """多个下单请求合并为contract_batchorder请求"""
+    return {'orders_data': [request.data for request in requests]}
+
+
+def split_batch_order(data, requests):
+    """批量下单结果按index拆分为单个下单的返回格式"""
+    if data['status'] != 'ok':
+        return [data] * len(requests)
+
+    ts = data['ts']
+    results = [None] * len(requests)
+    for d in data['data'].get('success', []):
+        results[d['index'] - 1] = {
+            'status': 'ok',
+            'data': {'order_id': d['order_id'], 'client_order_id': d.get('client_order_id')},
+            'ts': ts
+        }
+    for d in data['data'].get('errors', []):
+        results[d['index'] - 1] = {
+            'status': 'error',
+            'err_code': d['err_code'],
+            'err_msg': d['err_msg'],
+            'ts': ts
+        }
+    for n, result in enumerate(results):
+        if result is None:
+            results[n] = {'status': 'error', 'err_code': 0, 'err_msg': '批量下单无返回', 'ts': ts}
+    return results
+
 
+def merge_batch_cancel(requests):
+    """同一品种的撤单请求合并，client_order_id以逗号分隔"""
+    return {
+        'client_order_id': ','.join([request.data['client_order_id'] for request in requests]),
+        'symbol': requests[0].data['symbol']
+    }
+
+
+def split_batch_cancel(data, requests):
+    """批量撤单结果拆分为单个撤单的返回格式"""
+    if data['status'] != 'ok':
+        return [data] * len(requests)
+
+    successes = set(str(data['data']['successes']).split(','))
+    errors = {str(d['order_id']): d for d in data['data']['errors']}
+    results = []
+    for request in requests:
+        client_order_id = request.data['client_order_id']
+        if client_order_id in successes:
+            d = {'errors': [], 'successes': client_order_id}
+        else:
+            d = {'errors': [errors[client_order_id]] if client_order_id in errors else [], 'successes': ''}
+        results.append({'status': 'ok', 'data': d, 'ts': data['ts']})
+    return results
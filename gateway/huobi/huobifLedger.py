@@ -0,0 +1,205 @@
+# encoding: UTF-8
+"""
+火币合约委托/持仓内存账本
+"""
+
+from collections import defaultdict
+from threading import Lock
+
+from trader.constant import HuobiDB
+from trader.journal import FillJournal
+from trader.utility import get_temp_path
+
+DB_NAME = HuobiDB.DB_NAME.value
+DB_ORDER_STRATEGY = HuobiDB.DB_ORDER_STRATEGY.value
+
+# 成交对持仓的影响：(direction, offset): (long_qty变化, short_qty变化)
+POSITION_DELTA = {
+    ('buy', 'open'): (1, 0),  # 开多
+    ('sell', 'close'): (-1, 0),  # 平多
+    ('sell', 'open'): (0, 1),  # 开空
+    ('buy', 'close'): (0, -1),  # 平空
+}
+
+STATUS_NAME = {3: '挂单中', 4: '部分成交', 5: '部分成交已撤单', 6: '全部成交', 7: '已撤单'}
+# 还可能收到成交推送的委托状态
+ACTIVE_STATUS = ['挂单中', '部分成交']
+# 交易所推送的最终状态，之后不会再有成交
+FINISHED_STATUS = (5, 6, 7)
+
+
+class OrderLedger(object):
+    """
+    按client_order_id(order_count)保存委托记录，并按策略和合约维护持仓。
+
+    * 启动时从MongoDB的order_strategy表加载一次未完成的委托，之后只在内存中读写
+    * 持仓按成交量的增量更新，不再每次重新汇总全部委托
+    * 每次持仓变化写入成交日志(FillJournal)，启动时由快照和快照后的成交恢复持仓，
+      未完成委托的累计成交量也以成交日志为准，不使用数据库中可能未写入的trade_volume
+    * 记录变化后交给DBEngine的写队列写回MongoDB，不阻塞行情/交易线程。
+      order_strategy表每个委托一条记录，按order_count覆盖写入，成交的追加记录
+      在成交日志中
+    * 收到最终状态(部分成交已撤单/全部成交/已撤单)的推送后，委托从内存和成交日志
+      的成交量中移除
+    """
+
+    def __init__(self, db_engine):
+        """"""
+        self.dbEngine = db_engine
+        self.apikey = ""
+
+        self._lock = Lock()
+        self._records = {}  # order_count: record
+        self._positions = defaultdict(lambda: [0, 0])  # (strategy_name, vt_symbol): [long_qty, short_qty]
+        self.journal = None
+
+    def load(self, apikey: str, journal_path=None):
+        """从成交日志和数据库重建账本，启动时调用一次"""
+        self.apikey = apikey
+        if not journal_path:
+            journal_path = get_temp_path('huobif_journal').joinpath(apikey)
+        self.journal = FillJournal(journal_path)
+        positions = self.journal.open()
+
+        flt = {'apikey': apikey, 'status': {'$in': ACTIVE_STATUS}}
+        records = self.dbEngine.dbQuery(DB_NAME, DB_ORDER_STRATEGY, flt)
+
+        if self.journal.is_new:
+            # 首次使用成交日志，由数据库汇总全部委托的持仓和未完成委托的成交量
+            positions = self.query_positions(apikey)
+            self.journal.reset(positions, {
+                int(record['order_count']): int(record['trade_volume']) for record in records
+            })
+        volumes = self.journal.get_volumes()
+
+        with self._lock:
+            self._records.clear()
+            self._positions.clear()
+            self._positions.update(positions)
+            for record in records:
+                order_count = int(record['order_count'])
+                trade_volume = int(record['trade_volume'])
+                if order_count in volumes:
+                    # 成交日志和数据库不一致时（崩溃时其中一个未写入），以成交日志为准
+                    record['trade_volume'] = volumes[order_count]
+                    if record['trade_volume'] != trade_volume:
+                        self._save(record)
+                else:
+                    record['trade_volume'] = trade_volume
+                self._records[order_count] = record
+
+    def query_positions(self, apikey: str):
+        """
+        用聚合管道在数据库端按策略、合约、方向和开平汇总成交量，再换算为持仓。
+        @:return {(strategy_name, vt_symbol): [long_qty, short_qty]}
+        """
+        pipeline = [
+            {'$match': {'apikey': apikey, 'trade_volume': {'$nin': [0, '0']}}},
+            {'$group': {
+                '_id': {
+                    'strategy_name': '$strategy_name',
+                    'vt_symbol': '$vt_symbol',
+                    'direction': '$direction',
+                    'offset': '$offset',
+                },
+                # 旧记录的trade_volume可能是字符串，$sum会忽略，先转为整数
+                'volume': {'$sum': {'$toInt': '$trade_volume'}},
+            }},
+        ]
+
+        positions = defaultdict(lambda: [0, 0])
+        for d in self.dbEngine.dbAggregate(DB_NAME, DB_ORDER_STRATEGY, pipeline):
+            key = d['_id']
+            delta = POSITION_DELTA.get((key['direction'], key['offset']), None)
+            if not delta:
+                continue
+            position = positions[(key['strategy_name'], key['vt_symbol'])]
+            position[0] += delta[0] * int(d['volume'])
+            position[1] += delta[1] * int(d['volume'])
+        return dict(positions)
+
+    def stop(self):
+        """关闭成交日志"""
+        if self.journal:
+            self.journal.close()
+
+    def add_order(self, record: dict):
+        """新增委托记录"""
+        with self._lock:
+            record['trade_volume'] = int(record['trade_volume'])
+            self._records[int(record['order_count'])] = record
+            self._save(record)
+
+    def update_order(self, order_count: int, **kwargs):
+        """
+        更新委托记录的字段（不含成交量）。
+        撤单成功后仍可能收到撤单前的成交推送，记录等最终状态推送到达后再移除
+        """
+        with self._lock:
+            record = self._records.get(int(order_count), None)
+            if not record:
+                return None
+            record.update(kwargs)
+            self._save(record)
+            return dict(record)
+
+    def on_order_notify(self, order_count: int, status: int, trade_volume: int, trade_avg_price: float):
+        """
+        根据委托推送更新记录和持仓。
+        @:return (记录副本, 持仓(long_qty, short_qty))，没有该委托时返回(None, None)
+        """
+        with self._lock:
+            record = self._records.get(int(order_count), None)
+            if not record:
+                return None, None
+
+            delta = int(trade_volume) - record['trade_volume']
+            if delta:
+                record['trade_volume'] += delta
+                self._apply_fill(record, delta)
+
+            record['status'] = STATUS_NAME[status]
+            record['trade_avg_price'] = trade_avg_price
+            self._save(record)
+            if status in FINISHED_STATUS:
+                self._records.pop(int(order_count))
+                self.journal.finish(order_count)
+
+            key = (record['strategy_name'], record['vt_symbol'])
+            return dict(record), tuple(self._positions[key])
+
+    def get_order(self, order_count: int):
+        """"""
+        with self._lock:
+            record = self._records.get(int(order_count), None)
+            return dict(record) if record else None
+
+    def get_position(self, strategy_name: str, vt_symbol: str):
+        """@:return (long_qty, short_qty)"""
+        with self._lock:
+            return tuple(self._positions.get((strategy_name, vt_symbol), (0, 0)))
+
+    def _apply_fill(self, record: dict, volume: int):
+        """"""
+        delta = POSITION_DELTA.get((record['direction'], record['offset']), None)
+        if not delta or not volume:
+            return
+        long_qty = delta[0] * volume
+        short_qty = delta[1] * volume
+
+        position = self._positions[(record['strategy_name'], record['vt_symbol'])]
+        position[0] += long_qty
+        position[1] += short_qty
+
+        self.journal.append(
+            record['strategy_name'],
+            record['vt_symbol'],
+            long_qty,
+            short_qty,
+            order_count=int(record['order_count']),
+        )
+
+    def _save(self, record: dict):
+        """"""
+        flt = {'apikey': record['apikey'], 'order_count': record['order_count']}
+        self.dbEngine.dbUpdate(DB_NAME, DB_ORDER_STRATEGY, record, flt, upsert=True)
@@ -0,0 +1,62 @@
+# encoding: UTF-8
+"""
+行情订阅分片：把合约分配到多条websocket连接
+"""
+
+import zlib
+
+# 分片策略
+SHARD_HASH = 'hash'  # 按合约代码哈希，分配结果与订阅顺序无关
+SHARD_UNDERLYING = 'underlying'  # 同一币种的各交割合约在同一连接，价差两腿的行情顺序一致
+SHARD_BALANCED = 'balanced'  # 分配到当前合约数最少的连接
+
+SHARD_POLICIES = [SHARD_HASH, SHARD_UNDERLYING, SHARD_BALANCED]
+
+
+class SymbolSharder(object):
+    """
+    按策略为合约选择连接序号，同一合约始终分配到同一连接。
+
+    shard_map可以手工指定部分合约的连接，如{'BTC_CQ': 0}，优先于策略。
+    """
+
+    def __init__(self, count: int = 1, policy: str = SHARD_HASH, shard_map: dict = None):
+        """"""
+        if policy not in SHARD_POLICIES:
+            raise ValueError('未知的分片策略：{}，可选{}'.format(policy, SHARD_POLICIES))
+
+        self.count = max(1, count)
+        self.policy = policy
+        self.shard_map = shard_map or {}
+
+        self.assignments = {}  # symbol: index
+        self.loads = [0] * self.count  # 每条连接的合约数
+
+    def assign(self, symbol: str):
+        """
+        获取合约所在的连接序号
+        """
+        index = self.assignments.get(symbol, None)
+        if index is not None:
+            return index
+
+        if symbol in self.shard_map:
+            index = self.shard_map[symbol] % self.count
+        elif self.policy == SHARD_BALANCED:
+            index = self.loads.index(min(self.loads))
+        elif self.policy == SHARD_UNDERLYING:
+            index = self._hash(symbol.split('_')[0])
+        else:
+            index = self._hash(symbol)
+
+        self.assignments[symbol] = index
+        self.loads[index] += 1
+        return index
+
+    def _hash(self, key: str):
+        """crc32保证进程重启后分配结果不变（内置hash对str随机化）"""
+        return zlib.crc32(key.encode('utf-8')) % self.count
+
+    def get_symbols(self, index: int):
+        """"""
+        return [symbol for symbol, n in self.assignments.items() if n == index]
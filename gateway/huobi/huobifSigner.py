@@ -0,0 +1,87 @@
+# encoding: UTF-8
+"""
+火币合约REST请求签名
+"""
+
+import base64
+import hashlib
+import hmac
+import time
+from urllib import parse
+
+HUOBIF_HOST = 'api.hbdm.com'
+
+
+class HuobiSigner(object):
+    """
+    每个API Key一个签名器。
+
+    * HMAC用secret预先初始化，每次签名只copy一份再update
+    * AccessKeyId等固定参数只编码一次，时间戳字符串每秒只生成一次
+    * 火币签名只与method、path和时间戳有关，同一秒内同一路径的签名直接复用
+    """
+
+    def __init__(self, key: str, secret: str, host: str = HUOBIF_HOST):
+        """"""
+        self.key = key
+        self.host = host
+
+        self._hmac = hmac.new(secret.encode('UTF8'), digestmod=hashlib.sha256)
+        # 参数按名称排序：AccessKeyId, SignatureMethod, SignatureVersion, Timestamp
+        self._static_params = parse.urlencode([
+            ('AccessKeyId', key),
+            ('SignatureMethod', 'HmacSHA256'),
+            ('SignatureVersion', '2'),
+        ])
+
+        # 当前秒的状态(秒, 已编码参数, {(method, path): 签名后的query string})，
+        # 每秒整体替换一次，多个线程同时签名时不会读到上一秒的签名
+        self._state = (0, '', {})
+
+    def get_state(self):
+        """获取当前秒的状态"""
+        now = int(time.time())
+        state = self._state
+        if state[0] != now:
+            timestamp = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(now))
+            params = self._static_params + '&' + parse.urlencode({'Timestamp': timestamp})
+            state = (now, params, {})
+            self._state = state
+        return state
+
+    def get_params(self):
+        """获取当前秒的已编码参数（不含Signature）"""
+        return self.get_state()[1]
+
+    def sign(self, method: str, path: str):
+        """返回带签名的query string"""
+        _, params, signed = self.get_state()
+        query = signed.get((method, path), None)
+        if query is None:
+            payload = '\n'.join([method, self.host, path, params]).encode('UTF8')
+            mac = self._hmac.copy()
+            mac.update(payload)
+            signature = base64.b64encode(mac.digest()).decode()
+            query = params + '&' + parse.urlencode({'Signature': signature})
+            signed[(method, path)] = query
+        return query
+
+
+# ----------------------------------------------------------------------
+#进行编码
+def _encode(s):
+    # return urllib.pathname2url(s)
+    return parse.quote(s, safe='')
+
+#对火币http请求进行签名
+def createSign(pParams, method, host_url, request_path, secret_key):
+    sorted_params = sorted(pParams.items(), key=lambda d: d[0], reverse=False)
+    encode_params = parse.urlencode(sorted_params)
+    payload = [method, host_url, request_path, encode_params]
+    payload = '\n'.join(payload)
+    payload = payload.encode(encoding='UTF8')
+    secret_key = secret_key.encode(encoding='UTF8')
+    digest = hmac.new(secret_key, payload, digestmod=hashlib.sha256).digest()
+    signature = base64.b64encode(digest)
+    signature = signature.decode()
+    return signature
@@ -0,0 +1,32 @@
+# encoding: UTF-8
+
+"""
+压缩火币合约成交日志：已被快照覆盖的旧日志段移入archive目录（或直接删除）。
+
+python -m gateway.huobi.runCompactJournal [apikey] [--delete]
+"""
+
+import sys
+
+from trader.journal import compact
+from trader.utility import get_temp_path
+
+
+def main():
+    """"""
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    archive = '--delete' not in sys.argv
+
+    root = get_temp_path('huobif_journal')
+    if args:
+        paths = [root.joinpath(apikey) for apikey in args]
+    else:
+        paths = [p for p in root.iterdir() if p.is_dir()]
+
+    for path in paths:
+        removed = compact(path, archive)
+        print('%s: %d个日志段已%s' % (path, len(removed), '归档' if archive else '删除'))
+
+
+if __name__ == '__main__':
+    main()
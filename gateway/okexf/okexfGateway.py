@@ -4,23 +4,18 @@
 
 from __future__ import print_function
 
-import base64
 import hashlib
-import hmac
 import json
 import sys
 import time
-import zlib
 from copy import copy
 from datetime import datetime
 from urllib.parse import urlencode
 
 import pandas as pd
-import requests
 from requests import ConnectionError
-import dateutil.parser as dp
-from api.rest import Request, RestClient
-from api.websocket import WebsocketClient
+from api.rest import Request, RequestPriority, RestClient
+from api.websocket import WebsocketClient, DeflateJsonDecoder
 from trader.constant import (
     Direction,
     Offset,
@@ -31,7 +26,6 @@ from trader.constant import (
 )
 from trader.gateway import BaseGateway
 from trader.object import (
-    TickData,
     OrderData,
     TradeData,
     PositionData,
@@ -42,16 +36,31 @@ from trader.object import (
     SubscribeRequest,
     LogData,
 )
+from .okexfSigner import OkexSigner, generateSignature, server_timestamp
+from trader.depth import DepthBook
+from trader.feed_arbiter import FeedArbiter
+from trader.latency import TraceStage, tracer
 
 REST_HOST = 'https://www.okex.com'
 WEBSOCKET_HOST = 'wss://real.okex.com:10442/ws/v3'
 
+# 单个订阅请求最多携带的频道数
+SUBSCRIBE_BATCH_SIZE = 50
+
 # REST_HOST = 'https://47.75.99.233'
 # WEBSOCKET_HOST = 'https://149.129.81.70'
 
 # REST_HOST = '47.75.99.233 www.okex.com'
 # WEBSOCKET_HOST = '149.129.81.70 real.okex.com'
 
+# REST接口限频：(路径正则, 次数, 秒)
+RATE_LIMITS = [
+    (r'/api/futures/v3/order$', 40, 2),
+    (r'/api/futures/v3/cancel_order/', 40, 2),
+    (r'/api/futures/v3/[^/]+/position', 20, 2),
+    (r'/api/futures/v3/instruments', 20, 2),
+]
+
 # 委托状态类型映射
 STATUS_OKEX2VT = {}
 STATUS_OKEX2VT['0'] = Status.NOTTRADED
@@ -82,7 +91,11 @@ class OkexfGateway(BaseGateway):
         "secret": "xxx",
         "passphrase": "xxx",
         "session": 3,
-        "server": "REAL"
+        "server": "REAL",
+        "stale_timeout": 30,
+        "redundant_feed": False,
+        "tick_filter_levels": 0,
+        "tick_filter_mode": "price_size"
     }
 
     def __init__(self, event_engine):
@@ -91,6 +104,8 @@ class OkexfGateway(BaseGateway):
 
         self.rest_api = OkexfRestApi(self)
         self.ws_api = OkexfWebsocketApi(self)
+        self.ws_api_backup = None  # 只订阅深度的冗余行情连接
+        self.arbiter = None
 
     def connect(self, setting: dict):
         """"""
@@ -99,17 +114,34 @@ class OkexfGateway(BaseGateway):
         passphrase = setting["passphrase"]
         session = setting["session"]
         server = setting["server"]
+        # 盘口前N档不变的tick不推送，0为不过滤
+        self.set_tick_filter(
+            setting.get("tick_filter_levels", 0),
+            setting.get("tick_filter_mode", "price_size"),
+        )
 
         self.rest_api.connect(key, secret, passphrase, session, server)
 
-        self.ws_api.connect(key, secret, passphrase, server)
+        stale_timeout = setting.get("stale_timeout", 30)
+        # 冗余行情：另开一条只订阅depth5的连接，按交易所时间戳去重，先到的推送
+        if setting.get("redundant_feed", False):
+            self.arbiter = FeedArbiter()
+            self.ws_api.arbiter = self.arbiter
+            self.ws_api_backup = OkexfWebsocketApi(self, depth_only=True, arbiter=self.arbiter)
+            self.ws_api_backup.connect(key, secret, passphrase, server, stale_timeout)
+
+        self.ws_api.connect(key, secret, passphrase, server, stale_timeout)
 
     def subscribe(self, req: SubscribeRequest):
         """"""
         self.ws_api.subscribe(req)
+        if self.ws_api_backup:
+            self.ws_api_backup.subscribe(req)
 
     def un_subscribe(self, req: SubscribeRequest):
         self.ws_api.un_subscribe(req)
+        if self.ws_api_backup:
+            self.ws_api_backup.un_subscribe(req)
 
     def send_order(self, req: OrderRequest):
         """"""
@@ -130,10 +162,18 @@ class OkexfGateway(BaseGateway):
         """"""
         self.rest_api.query_position(symbol)
 
+    def get_feed_stats(self):
+        """冗余行情连接的领先次数统计"""
+        if not self.arbiter:
+            return {}
+        return self.arbiter.get_stats()
+
     def close(self):
         """"""
         self.rest_api.stop()
         self.ws_api.stop()
+        if self.ws_api_backup:
+            self.ws_api_backup.stop()
 
 
 class OkexfRestApi(RestClient):
@@ -151,8 +191,11 @@ class OkexfRestApi(RestClient):
         self.key = ""
         self.secret = ""
         self.passphrase = ""
+        self.signer = None
         self.order_count = 1_000_000
         self.connect_time = 0
+        for pattern, capacity, interval in RATE_LIMITS:
+            self.add_rate_limit(pattern, capacity, interval)
         self.query_contract()
 
     def sign(self, request):
@@ -160,7 +203,6 @@ class OkexfRestApi(RestClient):
         Generate OKEX signature.
         """
         # Sign
-        timestamp = str(server_timestamp())
         request.data = json.dumps(request.data)
 
         if request.params:
@@ -168,17 +210,8 @@ class OkexfRestApi(RestClient):
         else:
             path = request.path
 
-        msg = timestamp + request.method + path + request.data
-        signature = generateSignature(msg, self.secret)
-
         # 添加表头
-        request.headers = {
-            'OK-ACCESS-KEY': self.key,
-            'OK-ACCESS-SIGN': signature,
-            'OK-ACCESS-TIMESTAMP': timestamp,
-            'OK-ACCESS-PASSPHRASE': self.passphrase,
-            'Content-Type': 'application/json'
-        }
+        request.headers = self.signer.sign(request.method, path, request.data)
         return request
 
     def connect(
@@ -195,6 +228,8 @@ class OkexfRestApi(RestClient):
         self.key = key
         self.secret = secret
         self.passphrase = passphrase
+        self.signer = OkexSigner(key, secret, passphrase)
+        self.signer.start()
         self.connect_time = (
                 int(datetime.now().strftime("%y%m%d%H%M%S")) * self.order_count
         )
@@ -205,6 +240,12 @@ class OkexfRestApi(RestClient):
 
         self.gateway.write_log("REST API启动成功")
 
+    def stop(self):
+        """"""
+        if self.signer:
+            self.signer.stop()
+        super(OkexfRestApi, self).stop()
+
     def query_contract(self):
         """"""
         self.add_request('GET', '/api/futures/v3/instruments',
@@ -249,6 +290,8 @@ class OkexfRestApi(RestClient):
         """"""
         self.order_count += 1
         vt_client_oid = self.gateway_name + str(self.connect_time + self.order_count)
+        if req.trace_id:
+            tracer.bind_order(vt_client_oid, req.trace_id)
 
         data = {
             "client_oid": vt_client_oid,
@@ -269,6 +312,8 @@ class OkexfRestApi(RestClient):
             extra=order,
             on_failed=self.on_send_order_failed,
             on_error=self.on_send_order_error,
+            priority=RequestPriority.order,
+            key=vt_client_oid,
         )
         return order.vt_client_oid
 
@@ -279,6 +324,8 @@ class OkexfRestApi(RestClient):
             "/api/futures/v3/cancel_order/{}/{}".format(req.symbol, req.vt_client_oid),
             callback=self.on_cancel_order,
             on_error=self.on_cancel_order_error,
+            priority=RequestPriority.cancel,
+            key=req.vt_client_oid,
         )
 
     def on_send_order_failed(self, status_code: str, request: Request):
@@ -288,6 +335,8 @@ class OkexfRestApi(RestClient):
         order = request.extra
         order.status = Status.REJECTED
         self.gateway.on_order(order)
+        if tracer.enabled:
+            tracer.finish_order(order.vt_client_oid)
 
         msg = f"委托失败，状态码：{status_code}，信息：{request.response.text}"
         self.gateway.write_log(msg)
@@ -301,6 +350,8 @@ class OkexfRestApi(RestClient):
         order = request.extra
         order.status = Status.REJECTED
         self.gateway.on_order(order)
+        if tracer.enabled:
+            tracer.finish_order(order.vt_client_oid)
 
         # Record exception if not ConnectionError
         if not issubclass(exception_type, ConnectionError):
@@ -308,7 +359,10 @@ class OkexfRestApi(RestClient):
 
     def on_send_order(self, data, request):
         """"""
-        pass
+        if tracer.enabled:
+            vt_client_oid = request.extra.vt_client_oid
+            tracer.mark_order(vt_client_oid, TraceStage.REST_SEND, request.sent_time)
+            tracer.mark_order(vt_client_oid, TraceStage.ACK)
 
     def on_cancel_order_error(
             self, exception_type: type, exception_value: Exception, tb, request: Request
@@ -348,13 +402,23 @@ class OkexfRestApi(RestClient):
 class OkexfWebsocketApi(WebsocketClient):
     """"""
 
-    def __init__(self, gateway):
+    # 私有频道需登录后订阅，登录成功后再重发订阅
+    replay_on_connect = False
+
+    def __init__(self, gateway, depth_only: bool = False, arbiter: FeedArbiter = None):
         """"""
         super(OkexfWebsocketApi, self).__init__()
+        self.set_decoder(DeflateJsonDecoder())
 
         self.gateway = gateway
         self.gateway_name = gateway.gateway_name
 
+        # 冗余行情连接只订阅公共的depth5频道，不需要登录
+        self.depth_only = depth_only
+        self.replay_on_connect = depth_only
+        self.name = "backup" if depth_only else "main"
+        self.arbiter = arbiter
+
         self.key = ""
         self.secret = ""
         self.passphrase = ""
@@ -374,16 +438,13 @@ class OkexfWebsocketApi(WebsocketClient):
         self.orders = {}
         self.trades = set()
 
-    # ----------------------------------------------------------------------
-    def unpack_data(self, data):
-        """重载"""
-        return json.loads(zlib.decompress(data, -zlib.MAX_WBITS))
-
-    def connect(self, key: str, secret: str, passphrase: str, server: str):
+    def connect(self, key: str, secret: str, passphrase: str, server: str, stale_timeout: float = 30):
         """"""
         self.key = key
         self.secret = secret
         self.passphrase = passphrase
+        # depth5频道超过stale_timeout秒无推送时重连
+        self.set_stale_timeout(stale_timeout)
         self.init(WEBSOCKET_HOST)
         self.start()
 
@@ -393,24 +454,24 @@ class OkexfWebsocketApi(WebsocketClient):
         """
         subscribeReq = {
             "op": "subscribe",
-            "args": [
-                # "futures/trade:{}".format(req.symbol),
-                "futures/depth5:{}".format(req.symbol),
-                "futures/order:{}".format(req.symbol),
-                "futures/position:{}".format(req.symbol),
-                "futures/account:{}".format(req.symbol[:3])
-            ],
+            "args": self.get_args(req.symbol),
         }
-        self.send_packet(subscribeReq)
-
-        tick = TickData(
-            symbol=req.symbol,
-            exchange=req.exchange,
-            name=req.symbol,
-            datetime=datetime.now(),
-            gateway_name=self.gateway_name,
-        )
-        self.ticks[req.symbol] = tick
+        self.add_subscription(req.symbol, subscribeReq, ["futures/depth5:{}".format(req.symbol)])
+
+        if req.symbol not in self.ticks:
+            self.ticks[req.symbol] = DepthBook(req.symbol, req.exchange, self.gateway_name)
+
+    def get_args(self, symbol: str):
+        """"""
+        if self.depth_only:
+            return ["futures/depth5:{}".format(symbol)]
+        return [
+            # "futures/trade:{}".format(symbol),
+            "futures/depth5:{}".format(symbol),
+            "futures/order:{}".format(symbol),
+            "futures/position:{}".format(symbol),
+            "futures/account:{}".format(symbol[:3])
+        ]
 
     def un_subscribe(self, req: SubscribeRequest):
         """
@@ -418,24 +479,48 @@ class OkexfWebsocketApi(WebsocketClient):
         """
         un_subscribeReq = {
             "op": "unsubscribe",
-            "args": [
-                # "futures/trade:{}".format(req.symbol),
-                "futures/depth5:{}".format(req.symbol),
-                "futures/order:{}".format(req.symbol),
-                "futures/position:{}".format(req.symbol),
-                "futures/account:{}".format(req.symbol[:3])
-            ],
+            "args": self.get_args(req.symbol),
         }
+        self.remove_subscription(req.symbol)
         self.send_packet(un_subscribeReq)
 
+    def batch_subscriptions(self, packets: list):
+        """
+        重连后把各合约的订阅合并为少量请求
+        """
+        args = []
+        for packet in packets:
+            for arg in packet["args"]:
+                if arg not in args:
+                    args.append(arg)
+
+        return [
+            {"op": "subscribe", "args": args[i:i + SUBSCRIBE_BATCH_SIZE]}
+            for i in range(0, len(args), SUBSCRIBE_BATCH_SIZE)
+        ]
+
+    def get_channel(self, packet: dict):
+        """"""
+        if "table" in packet and packet["data"]:
+            data = packet["data"]
+            if isinstance(data, list):
+                data = data[0]
+            return "{}:{}".format(packet["table"], data.get("instrument_id", ""))
+        return None
+
+    def on_stale(self, channel: str, seconds: float):
+        """"""
+        self.gateway.write_log("{}已{:.0f}秒无推送，重新连接".format(channel, seconds))
+
     def on_connected(self):
         """"""
-        self.gateway.write_log("Websocket API连接成功")
-        self.authenticate()
+        self.gateway.write_log("Websocket API[{}]连接成功".format(self.name))
+        if not self.depth_only:
+            self.authenticate()
 
     def on_disconnected(self):
         """"""
-        self.gateway.write_log("Websocket API连接断开")
+        self.gateway.write_log("Websocket API[{}]连接断开".format(self.name))
 
     def on_packet(self, packet: dict):
         """"""
@@ -453,11 +538,7 @@ class OkexfWebsocketApi(WebsocketClient):
                     callback = self.callbacks[req]
                     callback(packet)
                     self.gateway.write_log("Websocket API验证授权成功")
-                    for symbol in self.ticks:
-                        req = SubscribeRequest(
-                            symbol=symbol,
-                            exchange=Exchange.OKEX.value)
-                        self.subscribe(req)
+                    self.replay_subscriptions()
 
         elif "table" in packet:
             name = packet["table"]
@@ -497,35 +578,36 @@ class OkexfWebsocketApi(WebsocketClient):
     def on_tick(self, d):
         """"""
         symbol = d["instrument_id"]
-        tick = self.ticks.get(symbol, None)
-        if not tick:
+        book = self.ticks.get(symbol, None)
+        if not book:
             return
 
-        tick.last_price = d["price"]
-        tick.datetime = datetime.strptime(
-            d["timestamp"], "%Y-%m-%dT%H:%M:%S.%fZ")
-        self.gateway.on_tick(copy(tick))
+        book.last_price = d["price"]
+        book.datetime = parse_timestamp(d["timestamp"])
+        self.gateway.on_tick(book.to_tick())
 
     def on_depth(self, d):
         """"""
         symbol = d["instrument_id"]
-        tick = self.ticks.get(symbol, None)
-        if not tick:
+        book = self.ticks.get(symbol, None)
+        if not book:
             return
 
-        for n, buf in enumerate(d["bids"][:5]):
-            price, volume = buf[:2]
-            tick.__setattr__("bid_price_%s" % (n + 1), price)
-            tick.__setattr__("bid_volume_%s" % (n + 1), volume)
-
-        for n, buf in enumerate(d["asks"][:5]):
-            price, volume = buf[:2]
-            tick.__setattr__("ask_price_%s" % (n + 1), price)
-            tick.__setattr__("ask_volume_%s" % (n + 1), volume)
+        book.update_bids(d["bids"])
+        book.update_asks(d["asks"])
+        book.datetime = parse_timestamp(d["timestamp"])
+        if self.arbiter:
+            self.arbiter.forward(symbol, book.datetime, self.name, self.publish, book)
+        else:
+            self.publish(book)
 
-        tick.datetime = datetime.strptime(
-            d["timestamp"], "%Y-%m-%dT%H:%M:%S.%fZ")
-        self.gateway.on_tick(copy(tick))
+    def publish(self, book: DepthBook):
+        """"""
+        tick = book.to_tick()
+        if tracer.enabled:
+            ts = (book.datetime - EPOCH).total_seconds() * 1000
+            tick.trace = tracer.new_tick_trace(ts, self.receive_time, self.decode_time)
+        self.gateway.on_tick(tick)
 
     def on_trade(self, d):
         """"""
@@ -555,6 +637,10 @@ class OkexfWebsocketApi(WebsocketClient):
 
         order.traded = int(d.get("filled_qty", order.traded))
         order.status = STATUS_OKEX2VT.get(d["status"], order.status)
+        if tracer.enabled and (order.traded or not order.is_active()):
+            if order.traded:
+                tracer.mark_order(vt_client_oid, TraceStage.FILL)
+            tracer.finish_order(vt_client_oid)
 
         self.gateway.on_order(copy(order))
 
@@ -612,26 +698,10 @@ class OkexfWebsocketApi(WebsocketClient):
 
 
 # ----------------------------------------------------------------------
-def generateSignature(msg, apiSecret):
-    """签名V3"""
-    mac = hmac.new(bytes(apiSecret, encoding='utf8'), bytes(msg, encoding='utf-8'), digestmod='sha256')
-    d = mac.digest()
-    sign = base64.b64encode(d)
-    return sign
-
-
-def server_timestamp():
-    server_time = get_server_time()
-    # print('server_time: ', server_time)
-    parsed_t = dp.parse(server_time)
-    timestamp = parsed_t.timestamp()
-    return timestamp
-
-
-def get_server_time():
-    url = "http://www.okex.com/api/general/v3/time"
-    response = requests.get(url)
-    if response.status_code == 200:
-        return response.json()['iso']
-    else:
-        return ""
+# OKEX时间戳为UTC
+EPOCH = datetime(1970, 1, 1)
+
+
+def parse_timestamp(timestamp: str):
+    """解析'2019-03-29T04:30:18.283Z'格式的UTC时间，比strptime快"""
+    return datetime.fromisoformat(timestamp[:-1])
@@ -0,0 +1,106 @@
+# encoding: UTF-8
+"""
+OKEX V3 REST请求签名
+"""
+
+import base64
+import hmac
+import time
+from threading import Event, Thread
+
+import requests
+import dateutil.parser as dp
+
+
+class OkexSigner(object):
+    """
+    每个API Key一个签名器。
+
+    * HMAC用secret预先初始化，每次签名只copy一份再update
+    * 固定表头只生成一次
+    * 服务器时间由后台线程在启动和每sync_interval秒同步一次，记录与本地时钟
+      的差值，签名时只读取差值，发单路径上没有网络请求
+    """
+
+    def __init__(self, key: str, secret: str, passphrase: str, sync_interval: float = 300):
+        """"""
+        self.key = key
+        self.passphrase = passphrase
+        self.sync_interval = sync_interval
+
+        self._hmac = hmac.new(secret.encode('utf-8'), digestmod='sha256')
+        self._headers = {
+            'OK-ACCESS-KEY': key,
+            'OK-ACCESS-PASSPHRASE': passphrase,
+            'Content-Type': 'application/json'
+        }
+
+        self.offset = 0.0  # 服务器时间 - 本地时间
+        self._stop = Event()
+        self._thread = None
+
+    def start(self):
+        """先同步一次服务器时间，再启动后台定时同步线程"""
+        self.sync_time()
+        self._stop.clear()
+        self._thread = Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """"""
+        self._stop.set()
+
+    def run(self):
+        """"""
+        while not self._stop.wait(self.sync_interval):
+            self.sync_time()
+
+    def sync_time(self):
+        """同步服务器时间，失败时沿用上次的差值"""
+        try:
+            local_time = time.time()
+            self.offset = server_timestamp() - local_time
+        except Exception:  # noqa
+            pass
+
+    def get_timestamp(self):
+        """"""
+        return '%.3f' % (time.time() + self.offset)
+
+    def sign(self, method: str, path: str, body: str):
+        """返回签名后的表头"""
+        timestamp = self.get_timestamp()
+        mac = self._hmac.copy()
+        mac.update((timestamp + method + path + body).encode('utf-8'))
+
+        headers = dict(self._headers)
+        headers['OK-ACCESS-SIGN'] = base64.b64encode(mac.digest()).decode()
+        headers['OK-ACCESS-TIMESTAMP'] = timestamp
+        return headers
+
+
+# ----------------------------------------------------------------------
+def generateSignature(msg, apiSecret):
+    """签名V3"""
+    mac = hmac.new(bytes(apiSecret, encoding='utf8'), bytes(msg, encoding='utf-8'), digestmod='sha256')
+    d = mac.digest()
+    sign = base64.b64encode(d)
+    return sign
+
+
+def server_timestamp():
+    server_time = get_server_time()
+    # print('server_time: ', server_time)
+    parsed_t = dp.parse(server_time)
+    timestamp = parsed_t.timestamp()
+    return timestamp
+
+
+def get_server_time(timeout: float = 5):
+    url = "http://www.okex.com/api/general/v3/time"
+    response = requests.get(url, timeout=timeout)
+    if response.status_code == 200:
+        return response.json()['iso']
+    else:
+        return ""
@@ -0,0 +1,68 @@
+# encoding: UTF-8
+
+"""
+火币websocket消息解压和json解析性能测试，输出每秒处理帧数。
+
+python -m gateway.runDecodeBenchmark [录制的行情文件.txt ...]
+
+行情文件每行一条火币推送的json消息（与tick_record录制格式相同），按火币推送的
+方式逐条gzip压缩成帧后测试；不指定文件时使用随机生成的150档深度消息。
+"""
+
+import gzip
+import json
+import sys
+import time
+import zlib
+
+from api.websocket.decoder import GzipJsonDecoder, orjson, ujson
+from gateway.runDepthBenchmark import generate_messages
+
+
+def load_frames(paths):
+    """"""
+    frames = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            for line in f:
+                frames.append(gzip.compress(line.strip()))
+    return frames
+
+
+def legacy_decode(data):
+    """原HuobifWebsocketApi.unpack_data"""
+    return json.loads(zlib.decompress(data, 47).decode('utf-8'))
+
+
+def benchmark(name, decode, frames, rounds=3):
+    """"""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for data in frames:
+            decode(data)
+    rate = len(frames) * rounds / (time.perf_counter() - start)
+    print('%-16s %12.0f frames/sec' % (name, rate))
+    return rate
+
+
+def main():
+    """"""
+    if len(sys.argv) > 1:
+        frames = load_frames(sys.argv[1:])
+    else:
+        frames = [gzip.compress(json.dumps(d).encode()) for d in generate_messages(5000)]
+    print('%d帧，平均%d字节' % (len(frames), sum(map(len, frames)) / len(frames)))
+
+    base = benchmark('legacy', legacy_decode, frames)
+    for json_lib, module in [('json', json), ('ujson', ujson), ('orjson', orjson)]:
+        if not module:
+            print('%-16s 未安装' % json_lib)
+            continue
+        decoder = GzipJsonDecoder(json_lib)
+        assert decoder.decode(frames[0]) == legacy_decode(frames[0])
+        rate = benchmark('decoder/' + json_lib, decoder.decode, frames)
+        print('%-16s %12.1fx' % ('speedup', rate / base))
+
+
+if __name__ == '__main__':
+    main()
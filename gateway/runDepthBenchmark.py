@@ -0,0 +1,148 @@
+# encoding: UTF-8
+
+"""
+火币深度行情解析性能测试，输出每秒处理消息数。
+
+python -m gateway.runDepthBenchmark [录制的行情文件.txt ...]
+
+行情文件每行一条market.$symbol.depth.step0消息（与tick_record录制格式相同），
+不指定文件时使用随机生成的150档消息。
+"""
+
+import json
+import random
+import sys
+import time
+from copy import copy
+from datetime import datetime
+
+from trader.depth import DepthBook
+from trader.object import TickData
+
+
+def load_messages(paths):
+    """"""
+    messages = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                d = json.loads(line)
+                if 'depth' in d.get('ch', ''):
+                    messages.append(d)
+    return messages
+
+
+def generate_messages(count=20000, symbol='BTC_CQ'):
+    """"""
+    messages = []
+    price = 4000.0
+    for i in range(count):
+        price += random.choice((-0.5, 0, 0.5))
+        messages.append({
+            'ch': 'market.{}.depth.step0'.format(symbol),
+            'ts': 1553833818283 + i * 100,
+            'tick': {
+                'bids': [[price - n * 0.5, random.randint(1, 500)] for n in range(150)],
+                'asks': [[price + 0.5 + n * 0.5, random.randint(1, 500)] for n in range(150)],
+            }
+        })
+    return messages
+
+
+class LegacyDecoder(object):
+    """原HuobifWebsocketApi.on_depth的解析过程"""
+
+    def __init__(self, symbols):
+        """"""
+        self.ticks = {
+            symbol: TickData(symbol=symbol, exchange='HUOBI', name=symbol,
+                             datetime=datetime.now(), gateway_name='HUOBIF')
+            for symbol in symbols
+        }
+
+    def on_depth(self, d):
+        """"""
+        symbol = d['ch'].split('.')[1]
+        tick = self.ticks.get(symbol, None)
+        if not tick:
+            return
+
+        bids = d['tick']['bids']
+        for n in range(5):
+            l = bids[n]
+            tick.__setattr__('bid_price_' + str(n + 1), float(l[0]))
+            tick.__setattr__('bid_volume_' + str(n + 1), float(l[1]))
+
+        asks = d['tick']['asks']
+        for n in range(5):
+            l = asks[n]
+            tick.__setattr__('ask_price_' + str(n + 1), float(l[0]))
+            tick.__setattr__('ask_volume_' + str(n + 1), float(l[1]))
+
+        tick.datetime = datetime.fromtimestamp(d['ts'] / 1000)
+        return copy(tick)
+
+
+class BookDecoder(object):
+    """使用DepthBook的解析过程"""
+
+    def __init__(self, symbols):
+        """"""
+        self.channels = {
+            'market.{}.depth.step0'.format(symbol): DepthBook(symbol, 'HUOBI', 'HUOBIF')
+            for symbol in symbols
+        }
+
+    def on_depth(self, d):
+        """"""
+        book = self.channels.get(d['ch'], None)
+        if not book:
+            return
+
+        tick = d['tick']
+        bids = tick['bids']
+        asks = tick['asks']
+        if len(bids) < book.levels or len(asks) < book.levels:
+            return
+        book.update_bids(bids, float)
+        book.update_asks(asks, float)
+        book.datetime = datetime.fromtimestamp(d['ts'] / 1000)
+        return book.to_tick()
+
+
+def benchmark(name, decoder, messages, rounds=5):
+    """"""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for d in messages:
+            decoder.on_depth(d)
+    rate = len(messages) * rounds / (time.perf_counter() - start)
+    print('%-12s %12.0f msgs/sec' % (name, rate))
+    return rate
+
+
+def main():
+    """"""
+    if len(sys.argv) > 1:
+        messages = load_messages(sys.argv[1:])
+    else:
+        messages = generate_messages()
+    symbols = {d['ch'].split('.')[1] for d in messages}
+    print('%d条消息，%d个合约' % (len(messages), len(symbols)))
+
+    legacy = LegacyDecoder(symbols)
+    book = BookDecoder(symbols)
+
+    # 两种解析结果应一致
+    for d in messages[:100]:
+        a = legacy.on_depth(d)
+        b = book.on_depth(d)
+        assert a == b, (a, b)
+
+    base = benchmark('legacy', legacy, messages)
+    rate = benchmark('depth book', book, messages)
+    print('%-12s %12.1fx' % ('speedup', rate / base))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+# encoding: UTF-8
+
+"""
+REST请求签名性能测试，输出每秒签名次数。
+
+python -m gateway.runSignBenchmark
+"""
+
+import json
+import time
+from datetime import datetime
+from urllib import parse
+
+from gateway.huobi.huobifSigner import HuobiSigner, createSign, HUOBIF_HOST
+from gateway.okexf.okexfSigner import OkexSigner, generateSignature
+
+KEY = 'a1b2c3d4-e5f6a7b8-c9d0e1f2-a3b4c'
+SECRET = '0123456789abcdef0123456789abcdef'
+PASSPHRASE = 'passphrase'
+
+HUOBI_PATH = '/api/v1/contract_order'
+OKEX_PATH = '/api/futures/v3/order'
+ORDER_DATA = {
+    'client_oid': 'a1000001',
+    'instrument_id': 'BTC-USD-190628',
+    'type': '1',
+    'price': '4000.5',
+    'size': '1',
+    'match_price': '0',
+    'leverage': '20',
+}
+
+
+def huobi_legacy():
+    """原HuobifRestApi.sign的签名过程"""
+    timestamp = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S')
+    params_to_sign = {'AccessKeyId': KEY,
+                      'SignatureMethod': 'HmacSHA256',
+                      'SignatureVersion': '2',
+                      'Timestamp': timestamp}
+    params_to_sign['Signature'] = createSign(params_to_sign, 'POST', HUOBIF_HOST, HUOBI_PATH, SECRET)
+    return HUOBI_PATH + '?' + parse.urlencode(params_to_sign)
+
+
+def okex_legacy():
+    """原OkexfRestApi.sign的签名过程，不含每次请求服务器时间的网络耗时"""
+    timestamp = str(time.time())
+    body = json.dumps(ORDER_DATA)
+    msg = timestamp + 'POST' + OKEX_PATH + body
+    return generateSignature(msg, SECRET)
+
+
+def benchmark(name, func, seconds=2.0):
+    """"""
+    count = 0
+    start = time.perf_counter()
+    end = start + seconds
+    while True:
+        for _ in range(1000):
+            func()
+        count += 1000
+        now = time.perf_counter()
+        if now >= end:
+            break
+
+    rate = count / (now - start)
+    print('%-24s %12.0f signs/sec' % (name, rate))
+    return rate
+
+
+def main():
+    """"""
+    huobi_signer = HuobiSigner(KEY, SECRET)
+    okex_signer = OkexSigner(KEY, SECRET, PASSPHRASE)
+    okex_signer.sync_time = lambda: None  # 测试时不访问网络
+
+    # 新旧签名结果应一致
+    assert huobi_legacy() == HUOBI_PATH + '?' + huobi_signer.sign('POST', HUOBI_PATH)
+
+    base = benchmark('huobi legacy', huobi_legacy)
+    rate = benchmark('huobi signer', lambda: huobi_signer.sign('POST', HUOBI_PATH))
+    print('%-24s %12.1fx' % ('huobi speedup', rate / base))
+
+    base = benchmark('okex legacy', okex_legacy)
+    rate = benchmark('okex signer', lambda: okex_signer.sign('POST', OKEX_PATH, json.dumps(ORDER_DATA)))
+    print('%-24s %12.1fx' % ('okex speedup', rate / base))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,11 @@
-from itertools import product
+import heapq
+import math
+import operator
+import random
+from concurrent.futures import ThreadPoolExecutor
+from functools import reduce
+from itertools import chain, product
+from threading import Event
 import pymongo
 import numpy as np
 import matplotlib.pyplot as plt
@@ -6,10 +13,13 @@ import seaborn as sns
 from pandas import DataFrame
 from trader.constant import Status
 from trader.object import TradeData, DbTickData, BacktestTickData
+from trader.tick_store import TickStore
+from trader.vector_backtest import get_weeks
+from trader.sweep import get_setting_key
 
 from abc import ABC
 from collections import defaultdict
-from datetime import datetime, timedelta, date
+from datetime import datetime, date
 from typing import Any
 import pandas as pd
 from time import time
@@ -21,7 +31,6 @@ from app.spreadTrading.stAlgo import SniperAlgo
 from trader.constant import (Direction, Offset, Exchange, PriceType, Product)
 from trader.object import ContractData
 from app.backtest.base import EngineType
-import gc
 
 sns.set_style("whitegrid")
 
@@ -29,6 +38,12 @@ sns.set_style("whitegrid")
 class OptimizationSetting:
     """
     Setting for runnning optimization.
+
+    Besides the full grid of generate_setting, settings can be searched by
+    random sampling, a genetic algorithm or successive halving. The search
+    methods take evaluate(settings, start, end), which backtests a batch of
+    settings (e.g. in parallel) and returns a list of (setting, statistics),
+    and rank settings by statistics[target].
     """
 
     def __init__(self):
@@ -78,6 +93,126 @@ class OptimizationSetting:
 
         return settings
 
+    def get_count(self):
+        """Number of settings in the full grid"""
+        return reduce(operator.mul, [len(values) for values in self.params.values()], 1)
+
+    def get_setting(self, index: int):
+        """Setting at index of the full grid, in generate_setting order"""
+        setting = {}
+        for name in reversed(list(self.params)):
+            values = self.params[name]
+            index, n = divmod(index, len(values))
+            setting[name] = values[n]
+        return {name: setting[name] for name in self.params}
+
+    def generate_random_setting(self, count: int, seed=None):
+        """
+        Sample count different settings from the grid without building it.
+        """
+        rng = random.Random(seed)
+        total = self.get_count()
+        return [self.get_setting(index) for index in rng.sample(range(total), min(count, total))]
+
+    def get_target_value(self, result: dict):
+        """"""
+        value = result.get(self.target, None) if result else None
+        if value is None or value != value:  # NaN
+            return -math.inf
+        return value
+
+    def rank(self, results: list):
+        """Sort (setting, result) by target, best first"""
+        return sorted(results, key=lambda item: self.get_target_value(item[1]), reverse=True)
+
+    def run_ga_optimization(
+            self,
+            evaluate,
+            start: datetime,
+            end: datetime,
+            population_size: int = 20,
+            generations: int = 10,
+            mutation_rate: float = 0.2,
+            elite_size: int = 2,
+            seed=None,
+    ):
+        """
+        Genetic search: each generation keeps the elite, breeds the rest by
+        tournament selection, uniform crossover and mutating parameters to
+        random grid values. A setting is evaluated only once.
+        @:return all evaluated (setting, result), best first
+        """
+        rng = random.Random(seed)
+        names = list(self.params)
+        results = {}  # setting key: (setting, result)
+
+        def evaluate_new(settings):
+            new = {}
+            for setting in settings:
+                key = get_setting_key(setting)
+                if key not in results:
+                    new[key] = setting
+            if new:
+                for setting, result in evaluate(list(new.values()), start, end):
+                    results[get_setting_key(setting)] = (setting, result)
+
+        def select(ranked):
+            a, b = rng.choice(ranked), rng.choice(ranked)
+            return a if self.get_target_value(a[1]) >= self.get_target_value(b[1]) else b
+
+        population = self.generate_random_setting(population_size, rng.random())
+        for generation in range(generations):
+            evaluate_new(population)
+            if len(results) >= self.get_count():
+                break
+
+            ranked = self.rank([results[get_setting_key(setting)] for setting in population])
+            population = [setting for setting, _ in ranked[:elite_size]]
+            while len(population) < population_size:
+                a, b = select(ranked)[0], select(ranked)[0]
+                child = {name: rng.choice((a[name], b[name])) for name in names}
+                for name in names:
+                    if rng.random() < mutation_rate:
+                        child[name] = rng.choice(self.params[name])
+                population.append(child)
+
+        evaluate_new(population)
+        return self.rank(list(results.values()))
+
+    def run_successive_halving(
+            self,
+            evaluate,
+            start: datetime,
+            end: datetime,
+            settings: list = None,
+            eta: int = 3,
+            min_weeks: int = 1,
+    ):
+        """
+        Evaluate all settings on the first min_weeks weeks, keep the best
+        1/eta and evaluate them on eta times more weeks, until the survivors
+        are run on the whole range.
+        @:return (setting, result) of the last round, best first
+        """
+        if settings is None:
+            settings = self.generate_setting()
+        weeks = list(get_weeks(start, end))
+        week_count = max(1, min_weeks)
+
+        while True:
+            if week_count >= len(weeks) or len(settings) <= 1:
+                window_end = end
+            else:
+                week_end = weeks[week_count - 1][1]
+                window_end = datetime(week_end.year, week_end.month, week_end.day)
+
+            ranked = self.rank(evaluate(settings, start, window_end))
+            if window_end is end:
+                return ranked
+
+            settings = [setting for setting, _ in ranked[:max(1, math.ceil(len(ranked) / eta))]]
+            week_count *= eta
+
 
 class BacktestMainEngine:
     """
@@ -115,6 +250,11 @@ class BacktestMainEngine:
         self.days = 0
         self.callback = None
         self.history_data = []
+        self.tick_store = None  # 设置后从列式行情库载入，否则从MongoDB载入
+        self.prefetch_executor = None
+        self.prefetch_stop = None  # 停止当前预读线程
+        self.prefetch_size = 100000  # 每周预读的tick数量
+        self.prefetched = {}  # (vt_symbols, start, end): Future
 
         self.limit_order_count = 0
         self.limit_orders = {}
@@ -169,59 +309,130 @@ class BacktestMainEngine:
         if end:
             self.end = end
 
-    def load_mongodb_his_data(self, active_vt_symbol, passive_vt_symbol, start, end):
-        """载入历史数据"""
-        db_client = pymongo.MongoClient('localhost', 27017)
-        collection1 = db_client['VnTrader_Tick_Db'][active_vt_symbol]
-        collection2 = db_client['VnTrader_Tick_Db'][passive_vt_symbol]
+    def set_tick_store(self, root: str = ""):
+        """
+        使用列式行情库(TickStore)回测，root为空时使用默认目录
+        """
+        self.tick_store = TickStore(root)
 
-        self.output(u'开始载入数据')
+    def load_history_data(self, vt_symbols: list, start, end):
+        """
+        准备所有价差两腿历史数据的回放数据源，vt_symbols为[(主动腿, 被动腿)]，
+        已预读的使用预读结果，价差或区间不同的预读结果不再使用，一并丢弃。
+        """
+        future = self.prefetched.pop((tuple(vt_symbols), start, end), None)
+        for stale in self.prefetched.values():
+            stale.cancel()
+        self.prefetched.clear()
+        if future:
+            head, source = future.result()
+            self.history_data = chain(head, source)
+        else:
+            self.history_data = self.merge_history_data(vt_symbols, start, end)
+        self.output("策略初始化完成")
 
-        # 载入回测数据
-        flt = {'datetime': {'$gte': start, '$lte': end}}
-        backtest_cursor1 = collection1.find(flt).sort('datetime')
-        backtest_cursor2 = collection2.find(flt).sort('datetime')
-        # 将回测数据从查询指针中读取出，并生成列表
-        for d in backtest_cursor1:
-            data = BacktestTickData(gateway_name='OKEXF',
-                                    symbol=active_vt_symbol.split('.')[0],
-                                    exchange='.OKEX',
-                                    vt_symbol=active_vt_symbol,
-                                    datetime=d['datetime'],
-                                    date=d['date'],
-                                    time=d['time'],
-                                    bid_price_1=d['bid_price_1'],
-                                    ask_price_1=d['ask_price_1'],
-                                    bid_volume_1=d['bid_volume_1'],
-                                    ask_volume_1=d['ask_volume_1'])
-            self.history_data.append(data)
-
-        for d in backtest_cursor2:
-            data = BacktestTickData(gateway_name='OKEXF',
-                                    symbol=passive_vt_symbol.split('.')[0],
-                                    exchange='.OKEX',
-                                    vt_symbol=passive_vt_symbol,
-                                    datetime=d['datetime'],
-                                    date=d['date'],
-                                    time=d['time'],
-                                    bid_price_1=d['bid_price_1'],
-                                    ask_price_1=d['ask_price_1'],
-                                    bid_volume_1=d['bid_volume_1'],
-                                    ask_volume_1=d['ask_volume_1'])
-            self.history_data.append(data)
-
-        self.history_data.sort(key=sort_datetime)
-
-        self.output(u'载入完成: ')
-        self.output(u'回测数据量： {}'.format(len(self.history_data)))
+    def merge_history_data(self, vt_symbols: list, start, end):
+        """
+        每条腿的数据已按时间排序，用heapq.merge把所有价差的腿逐条归并为一个生成器，
+        回放时才从MongoDB游标或列式行情库中读取，内存占用与回测区间长度无关。
+        """
+        if self.tick_store:
+            load_leg = self.load_tick_store_leg
+        else:
+            load_leg = self.load_mongodb_leg
 
-        self.output("策略初始化完成")
+        # 多个价差共用的腿只读取一次
+        leg_symbols = []
+        for pair in vt_symbols:
+            for vt_symbol in pair:
+                if vt_symbol not in leg_symbols:
+                    leg_symbols.append(vt_symbol)
+
+        legs = [load_leg(vt_symbol, start, end) for vt_symbol in leg_symbols]
+        # 时间相同时按价差顺序、主动腿在前，与原先合并后稳定排序的顺序一致
+        return heapq.merge(*legs, key=sort_datetime)
+
+    def prefetch_history_data(self, vt_symbols: list, start, end):
+        """
+        在后台线程中预读下一周开头的prefetch_size条数据，与本周回放同时进行。
+        其余数据在回放时继续从同一个数据源逐条读取，预读占用的内存有上限。
+        """
+        if not self.prefetch_executor:
+            self.prefetch_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+            self.prefetch_stop = Event()
+        source = self.merge_history_data(vt_symbols, start, end)
+        self.prefetched[(tuple(vt_symbols), start, end)] = self.prefetch_executor.submit(
+            read_ahead, source, self.prefetch_size, self.prefetch_stop)
+
+    def stop_prefetch(self):
+        """停止预读，不等待正在进行的读取"""
+        for future in self.prefetched.values():
+            future.cancel()
+        self.prefetched.clear()
+        if self.prefetch_executor:
+            self.prefetch_stop.set()
+            self.prefetch_executor.shutdown(wait=False)
+            self.prefetch_executor = None
+
+    def load_tick_store_leg(self, vt_symbol, start, end):
+        """从列式行情库逐日读取一条腿的数据，只读取回测用到的一档行情列"""
+        symbol = vt_symbol.split('.')[0]
+        fields = ['datetime', 'bid_price_1', 'ask_price_1', 'bid_volume_1', 'ask_volume_1']
+        for day, columns in self.tick_store.iter_days(vt_symbol, start, end, fields):
+            dts = columns['datetime'].view('datetime64[ns]').astype('datetime64[us]').tolist()
+            for dt, bid_price, ask_price, bid_volume, ask_volume in zip(
+                dts,
+                columns['bid_price_1'].tolist(),
+                columns['ask_price_1'].tolist(),
+                columns['bid_volume_1'].tolist(),
+                columns['ask_volume_1'].tolist(),
+            ):
+                yield BacktestTickData(
+                    'OKEXF', symbol, '.OKEX', vt_symbol, dt, dt, dt,
+                    bid_price_1=bid_price,
+                    ask_price_1=ask_price,
+                    bid_volume_1=bid_volume,
+                    ask_volume_1=ask_volume,
+                )
+
+    def load_mongodb_leg(self, vt_symbol, start, end):
+        """从MongoDB游标逐条读取一条腿的数据"""
+        db_client = pymongo.MongoClient('localhost', 27017)
+        collection = db_client['VnTrader_Tick_Db'][vt_symbol]
+        symbol = vt_symbol.split('.')[0]
+
+        flt = {'datetime': {'$gte': start, '$lte': end}}
+        projection = ['datetime', 'date', 'time', 'bid_price_1', 'ask_price_1', 'bid_volume_1', 'ask_volume_1']
+        for d in collection.find(flt, projection).sort('datetime'):
+            yield BacktestTickData(gateway_name='OKEXF',
+                                   symbol=symbol,
+                                   exchange='.OKEX',
+                                   vt_symbol=vt_symbol,
+                                   datetime=d['datetime'],
+                                   date=d['date'],
+                                   time=d['time'],
+                                   bid_price_1=d['bid_price_1'],
+                                   ask_price_1=d['ask_price_1'],
+                                   bid_volume_1=d['bid_volume_1'],
+                                   ask_volume_1=d['ask_volume_1'])
+
+    def clear_history_data(self):
+        """停止当前数据源"""
+        self.history_data = []
 
     def run_backtesting(self):
+        """回放本周数据，换仓完成或数据结束时返回"""
         self.output("开始回放历史数据")
-        for data in self.history_data:
+        source = self.history_data
+        count = 0
+        for data in source:
             self.new_tick(data)
-        self.output("历史数据回放结束")
+            count += 1
+            # 换仓完成后清空了数据源，本周不再继续
+            if self.history_data is not source:
+                break
+        self.history_data = []
+        self.output("历史数据回放结束，回放数据量：{}".format(count))
 
     def new_tick(self, tick: DbTickData):
         """"""
@@ -229,8 +440,8 @@ class BacktestMainEngine:
         self.datetime = tick.datetime
         self.cross_limit_order()
         self.engines['St'].processTickEvent(tick)
-        self.engines['St'].change_position()
         self.update_daily_close()
+        self.engines['St'].change_position()
 
     def cross_limit_order(self):
         """
@@ -361,6 +572,22 @@ class BacktestMainEngine:
         if not self.trades:
             self.output("成交记录为空，无法计算")
             return
+        self.calculate_daily_results()
+
+        # Generate dataframe
+        results = defaultdict(list)
+        for daily_result in self.daily_results.values():
+            for key, value in daily_result.__dict__.items():
+                results[key].append(value)
+        self.daily_df = DataFrame.from_dict(results).set_index("date")
+        self.daily_df.to_csv(r'F:\backtest_result\{}_daily_df.csv'.format(time()))
+        self.output("逐日盯市盈亏计算完成")
+        return self.daily_df
+
+    def calculate_daily_results(self):
+        """
+        Add trades into daily results and calculate daily pnl.
+        """
         # Add trade data into daily reuslt.
         for trade in self.trades.values():
             d = trade.datetime.date()
@@ -377,21 +604,12 @@ class BacktestMainEngine:
 
             pre_close = daily_result.close_price
             start_pos = daily_result.end_pos
-        # Generate dataframe
-        results = defaultdict(list)
-        for daily_result in self.daily_results.values():
-            for key, value in daily_result.__dict__.items():
-                results[key].append(value)
-        self.daily_df = DataFrame.from_dict(results).set_index("date")
-        self.daily_df.to_csv(r'F:\backtest_result\{}_daily_df.csv'.format(time()))
-        self.output("逐日盯市盈亏计算完成")
-        return self.daily_df
 
     def calculate_statistics(self, df: DataFrame = None):
         """"""
         self.output("开始计算策略统计指标")
 
-        if not df:
+        if df is None:
             df = self.daily_df
 
         if df is None:
@@ -531,7 +749,7 @@ class BacktestMainEngine:
 
     def save_chart(self, setting, df: DataFrame = None):
         """"""
-        if not df:
+        if df is None:
             df = self.daily_df
 
         if df is None:
@@ -608,23 +826,46 @@ class StEngine(BaseEngine):
         self.orders = {}  # 保存所有订单信息
         self.week_dic = {}
         self.change_position_time = False
+        self.vt_symbols = []  # 回放数据的各价差两腿代码[(主动腿, 被动腿)]
+        self.stopped_week = None  # 未完成换仓而结束回测的周
         self.add_function()
 
     # ----------------------------------------------------------------------
     def start(self):
-        """开始交易"""
+        """开始交易，逐周回测直到结束日期"""
+        engine = self.backtest_main_engine
+        weeks = list(get_weeks(engine.start, engine.end))
+        self.stopped_week = None
+        try:
+            for n, (week_start, week_end) in enumerate(weeks):
+                self.start_week(week_start, week_end)
+
+                # 回放本周的同时预读下一周
+                if n + 1 < len(weeks) and self.vt_symbols:
+                    engine.prefetch_history_data(self.vt_symbols, *weeks[n + 1])
+
+                engine.run_backtesting()
+
+                # 数据结束时仍未完成换仓，结束回测
+                if self.algodict:
+                    self.write_log('{}未完成换仓，回测结束'.format(week_end))
+                    self.stopped_week = week_end
+                    break
+        finally:
+            engine.stop_prefetch()
+
+    def start_week(self, start: datetime, end: datetime):
+        """开始一周的交易"""
         # 清空合约信息
         self.close_all_contracts()
         # 创建合约、创建价差、订阅行情
-        # 价差引擎初始化，同时change_position_time = False
+        self.change_position_time = False
         self.load_contracts()
-        self.create_spread_algo()
+        self.create_spread_algo(start, end)
         # 启动价差引擎开始交易
         for name in self.algodict:
             self.startAlgo(name)
 
-        self.backtest_main_engine.run_backtesting()
-
     def add_function(self):
         """Add query function to main engine."""
         self.write_log = self.backtest_main_engine.output
@@ -651,26 +892,17 @@ class StEngine(BaseEngine):
             )
             self.contracts[contract.vt_symbol] = contract
 
-    @staticmethod
-    def get_end_datetime(start_date: datetime):
-        while start_date.weekday() != 4:
-            start_date += timedelta(days=1)
-        start_date = start_date + timedelta(17 / 24)
-        end_datetime = start_date + timedelta(7 - 1 / 24)
-        # start_date = end_datetime - timedelta(1 / 24)  # 测试
-        return start_date, end_datetime
-
     # ----------------------------------------------------------------------
-    def create_spread_algo(self):
+    def create_spread_algo(self, start: datetime, end: datetime):
         """创建价差"""
-        start = self.backtest_main_engine.start
         f = open('backtest_st_setting.json')
         l = json.load(f)
+        vt_symbols = []
         for setting in l:
             # 检查价差重名
             if setting['name'] in self.algodict:
                 self.write_log('{}价差存在重名'.format(setting['name']))
-                return
+                break
 
             # 创建价差
             spread = StSpread()
@@ -710,12 +942,13 @@ class StEngine(BaseEngine):
             algo.spread.initSpread()
 
             # 订阅行情,即下载历史数据
-            start, end = self.get_end_datetime(self.backtest_main_engine.start)
-            # 设置下次开始交易时间
-            self.backtest_main_engine.start = datetime(end.year, end.month, end.day)
             self.write_log('{}价差创建成功'.format(algo.spread.name))
             print('start: ', start, 'end: ', end)
-            self.backtest_main_engine.load_mongodb_his_data(active_vt_symbol, passive_vt_symbol, start, end)
+            vt_symbols.append((active_vt_symbol, passive_vt_symbol))
+
+        # 所有价差的腿归并为一个数据源回放
+        self.vt_symbols = vt_symbols
+        self.backtest_main_engine.load_history_data(vt_symbols, start, end)
 
     # ----------------------------------------------------------------------
     def processTickEvent(self, tick):
@@ -778,22 +1011,17 @@ class StEngine(BaseEngine):
     def change_position(self):
         """"""
         if not len(self.algodict):
-            # 换仓完成
+            # 换仓完成，结束本周回放，由start开始下一周
             self.change_position_time = False
-            self.backtest_main_engine.history_data.clear()
-            gc.collect()
-            if self.backtest_main_engine.start < self.backtest_main_engine.end:
-                self.start()
-            # if len(self.orders) < 15:
-            #     self.start()
+            self.backtest_main_engine.clear_history_data()
 
     def pop_spread_name(self, name: str):
         # 从algodict中删除该价差交易算法
         self.algodict.pop(name)
 
     # ----------------------------------------------------------------------
-    def sendOrder(self, vt_symbol, direction, offset, price, volume, payup=0):
-        """发单"""
+    def get_contract(self, vt_symbol):
+        """获取合约，合约文件中没有时使用同一币种的合约"""
         if vt_symbol in self.contracts:
             contract = self.contracts[vt_symbol]
         else:
@@ -804,8 +1032,16 @@ class StEngine(BaseEngine):
                     contract.symbol = contract.vt_symbol.split('.')[0]
                     contract.name = contract.symbol
                     break
+        return contract
+
+    # ----------------------------------------------------------------------
+    def sendOrder(self, vt_symbol, direction, offset, price, volume, payup=0, name='', trace_id=''):
+        """发单"""
+        contract = self.get_contract(vt_symbol)
         req = OrderRequest(
             symbol=contract.symbol,
+            contract=contract,
+            strategy_name=name,
             exchange=contract.exchange,
             direction=direction,
             price_type=PriceType.LIMIT,
@@ -977,3 +1213,16 @@ class DailyResult:
 
 def sort_datetime(elem):
     return elem.datetime
+
+
+def read_ahead(source, size: int, stop: Event):
+    """
+    读取source的前size条数据，stop设置后提前返回。
+    @:return (已读取的数据, source)，source从下一条继续
+    """
+    head = []
+    for data in source:
+        head.append(data)
+        if len(head) >= size or stop.is_set():
+            break
+    return head, source
@@ -148,6 +148,22 @@ class HuobiDB(Enum):
     DB_ORDER_STRATEGY = 'order_strategy'
     DB_STRATEGY_POSITION = 'strategy_position'
 
+# 各集合的复合索引，连接数据库时创建：(库名, 集合名): [[(字段, 方向), ...], ...]
+DB_INDEXES = {
+    (HuobiDB.DB_NAME.value, HuobiDB.DB_ORDERID.value): [
+        [('apikey', 1)],
+    ],
+    (HuobiDB.DB_NAME.value, HuobiDB.DB_ORDER_STRATEGY.value): [
+        [('apikey', 1), ('order_count', 1)],
+        [('apikey', 1), ('status', 1)],
+        [('apikey', 1), ('strategy_name', 1), ('vt_symbol', 1)],
+        [('strategy_name', 1), ('vt_symbol', 1)],
+    ],
+    (HuobiDB.DB_NAME.value, HuobiDB.DB_STRATEGY_POSITION.value): [
+        [('strategy_name', 1)],
+    ],
+}
+
 # 默认空值
 EMPTY_STRING = ''
 EMPTY_INT = 0
@@ -0,0 +1,208 @@
+"""
+Order book structures used by gateways to decode depth messages.
+"""
+
+from bisect import bisect_left
+from datetime import datetime
+
+from .object import TickData
+
+
+class DepthBook:
+    """
+    Top levels of one symbol's order book, updated in place for every depth
+    message. to_tick() publishes a new TickData built in one constructor
+    call, so the book itself is never shared with other threads.
+    """
+
+    __slots__ = (
+        "symbol",
+        "exchange",
+        "name",
+        "gateway_name",
+        "levels",
+        "datetime",
+        "last_price",
+        "bid_prices",
+        "bid_volumes",
+        "ask_prices",
+        "ask_volumes",
+    )
+
+    def __init__(
+        self,
+        symbol: str,
+        exchange: str,
+        gateway_name: str,
+        name: str = "",
+        levels: int = 5,
+    ):
+        """"""
+        self.symbol = symbol
+        self.exchange = exchange
+        self.name = name or symbol
+        self.gateway_name = gateway_name
+        self.levels = levels
+        self.datetime = datetime.now()
+        self.last_price = 0
+
+        self.bid_prices = [0] * levels
+        self.bid_volumes = [0] * levels
+        self.ask_prices = [0] * levels
+        self.ask_volumes = [0] * levels
+
+    def update_bids(self, bids: list, convert=None):
+        """
+        Fill bid levels from [[price, volume, ...], ...], levels missing in
+        bids keep their last value.
+        """
+        prices = self.bid_prices
+        volumes = self.bid_volumes
+        for n, level in enumerate(bids[:self.levels]):
+            if convert:
+                prices[n] = convert(level[0])
+                volumes[n] = convert(level[1])
+            else:
+                prices[n] = level[0]
+                volumes[n] = level[1]
+
+    def update_asks(self, asks: list, convert=None):
+        """"""
+        prices = self.ask_prices
+        volumes = self.ask_volumes
+        for n, level in enumerate(asks[:self.levels]):
+            if convert:
+                prices[n] = convert(level[0])
+                volumes[n] = convert(level[1])
+            else:
+                prices[n] = level[0]
+                volumes[n] = level[1]
+
+    def to_tick(self):
+        """
+        Create TickData of current book, only the first 5 levels are kept.
+        """
+        bp = self.bid_prices + [0] * (5 - self.levels)
+        bv = self.bid_volumes + [0] * (5 - self.levels)
+        ap = self.ask_prices + [0] * (5 - self.levels)
+        av = self.ask_volumes + [0] * (5 - self.levels)
+        return TickData(
+            self.gateway_name,
+            self.symbol,
+            self.exchange,
+            self.datetime,
+            self.name,
+            0, self.last_price, 0, 0, 0,
+            0, 0, 0, 0,
+            bp[0], bp[1], bp[2], bp[3], bp[4],
+            ap[0], ap[1], ap[2], ap[3], ap[4],
+            bv[0], bv[1], bv[2], bv[3], bv[4],
+            av[0], av[1], av[2], av[3], av[4],
+        )
+
+
+class OrderBook:
+    """
+    Full order book kept in sorted arrays and updated in place by depth diffs.
+
+    Prices of each side are stored in ascending order of their sort key
+    (price for asks, -price for bids) with volumes in a parallel list, so an
+    update is a bisect plus an insert/replace/delete. A level with volume 0
+    in a diff removes the price.
+    """
+
+    __slots__ = (
+        "bid_keys",
+        "bid_volumes",
+        "ask_keys",
+        "ask_volumes",
+        "version",
+    )
+
+    def __init__(self):
+        """"""
+        self.bid_keys = []  # -price
+        self.bid_volumes = []
+        self.ask_keys = []  # price
+        self.ask_volumes = []
+        self.version = None
+
+    def clear(self):
+        """"""
+        self.bid_keys.clear()
+        self.bid_volumes.clear()
+        self.ask_keys.clear()
+        self.ask_volumes.clear()
+        self.version = None
+
+    def apply_snapshot(self, bids: list, asks: list, version=None):
+        """
+        Replace whole book, bids/asks are [[price, volume], ...] in any order.
+        """
+        self.clear()
+        for price, volume in sorted(bids, key=lambda level: -level[0]):
+            if volume:
+                self.bid_keys.append(-price)
+                self.bid_volumes.append(volume)
+        for price, volume in sorted(asks, key=lambda level: level[0]):
+            if volume:
+                self.ask_keys.append(price)
+                self.ask_volumes.append(volume)
+        self.version = version
+
+    def apply_update(self, bids: list, asks: list, version=None):
+        """
+        Apply changed levels, volume 0 means the level is removed.
+        """
+        for price, volume in bids:
+            self._update_level(self.bid_keys, self.bid_volumes, -price, volume)
+        for price, volume in asks:
+            self._update_level(self.ask_keys, self.ask_volumes, price, volume)
+        self.version = version
+
+    @staticmethod
+    def _update_level(keys: list, volumes: list, key: float, volume: float):
+        """"""
+        i = bisect_left(keys, key)
+        found = i < len(keys) and keys[i] == key
+        if volume:
+            if found:
+                volumes[i] = volume
+            else:
+                keys.insert(i, key)
+                volumes.insert(i, volume)
+        elif found:
+            del keys[i]
+            del volumes[i]
+
+    def get_top(self, n: int):
+        """
+        Get top n levels as (bid_prices, bid_volumes, ask_prices, ask_volumes).
+        """
+        return (
+            [-key for key in self.bid_keys[:n]],
+            self.bid_volumes[:n],
+            self.ask_keys[:n],
+            self.ask_volumes[:n],
+        )
+
+    def fill(self, book: DepthBook):
+        """
+        Copy top levels into DepthBook.
+        @:return True if any of the top levels changed
+        """
+        bid_prices, bid_volumes, ask_prices, ask_volumes = self.get_top(book.levels)
+        changed = False
+        for prices, volumes, book_prices, book_volumes in (
+            (bid_prices, bid_volumes, book.bid_prices, book.bid_volumes),
+            (ask_prices, ask_volumes, book.ask_prices, book.ask_volumes),
+        ):
+            missing = book.levels - len(prices)
+            if missing:
+                prices = prices + [0] * missing
+                volumes = volumes + [0] * missing
+            if prices != book_prices or volumes != book_volumes:
+                book_prices[:] = prices
+                book_volumes[:] = volumes
+                changed = True
+        return changed
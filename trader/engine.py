@@ -18,6 +18,7 @@ from .gateway import BaseGateway
 from .object import CancelRequest, StLogData, OrderRequest, SubscribeRequest
 from .setting import SETTINGS
 from .utility import Singleton, get_temp_path
+from .latency import tracer
 
 import json
 from trader.utility import round_to_pricetick
@@ -204,6 +205,10 @@ class MainEngine:
         for gateway in self.gateways.values():
             gateway.close()
 
+        # Write data left in database queue
+        if DBEngine in Singleton._instances:
+            DBEngine().close()
+
 
 class BaseEngine(ABC):
     """
@@ -559,6 +564,11 @@ class StEngine(BaseEngine):
         self.register_event()
         self.add_function()
         self.dbEngine = DBEngine()
+        self.dbEngine.write_log = self.write_log
+
+        # 行情到下单各环节延迟统计
+        if SETTINGS["latency.trace"]:
+            tracer.enable(SETTINGS["latency.report_interval"])
 
     # ----------------------------------------------------------------------
     def start(self):
@@ -695,10 +705,14 @@ class StEngine(BaseEngine):
         """处理行情推送"""
         # 检查行情是否需要处理
         tick = event.data
+        trace = tick.trace
+        if trace:
+            tracer.on_dispatch(trace)
         # print(tick.__dict__)
         for algo in list(self.algodict.values()):
             spread = algo.spread
             if tick.vt_symbol in spread.allLegs.keys():
+                algo.trace = trace
                 leg = spread.allLegs[tick.vt_symbol]
                 leg.bidPrice = tick.bid_price_1
                 leg.askPrice = tick.ask_price_1
@@ -765,6 +779,9 @@ class StEngine(BaseEngine):
         for algo in list(self.algodict.values()):
             algo.updateTimer()
 
+        if tracer.enabled:
+            tracer.report_if_due(self.write_log)
+
         if self.change_position_time and not len(self.algodict):
             dt = datetime.today()
             # if dt.weekday() == 4 and dt.hour == 20 and dt.minute >= 40:
@@ -791,8 +808,8 @@ class StEngine(BaseEngine):
         self.algodict.pop(name)
 
     # ----------------------------------------------------------------------
-    def sendOrder(self, vt_symbol, direction, offset, price, volume, payup=0,name=''):
-        """发单"""
+    def sendOrder(self, vt_symbol, direction, offset, price, volume, payup=0,name='', trace_id=''):
+        """发单，trace_id为触发下单的tick的延迟跟踪编号"""
         contract = self.contracts[vt_symbol]
         if not contract:
             return ''
@@ -806,6 +823,7 @@ class StEngine(BaseEngine):
             volume=volume,
             price=price,
             offset=offset,
+            trace_id=trace_id,
         )
 
         if direction == Direction.LONG:
@@ -0,0 +1,83 @@
+"""
+Arbitration between redundant market data connections.
+"""
+
+from threading import Lock
+from time import perf_counter
+
+
+class FeedArbiter:
+    """
+    Forward each update of a key (channel/symbol) once, from whichever
+    connection delivers it first.
+
+    Updates are identified by an increasing sequence per key, normally the
+    exchange timestamp. An update is forwarded if its sequence is newer than
+    the last one forwarded; the copy from the other connection is dropped.
+    A connection delivering several updates with the same timestamp keeps
+    them all as long as it is the one that won that timestamp.
+
+    Forwarding runs under the arbiter's lock so that updates of one key never
+    leave out of order when both connections race.
+
+    Per source statistics:
+    * wins/losses: updates forwarded from/dropped by this connection
+    * lead: how long (seconds) the winner was ahead of the other copy
+    """
+
+    def __init__(self):
+        """"""
+        self._lock = Lock()
+        self._last = {}  # key: (seq, source, arrival time)
+
+        self.wins = {}  # source: count
+        self.losses = {}  # source: count
+        self.lead_total = {}  # source: seconds
+        self.lead_count = {}  # source: count
+
+    def forward(self, key, seq, source, func, *args):
+        """
+        Call func(*args) if this is the first arrival of seq for key.
+        @:return True if forwarded
+        """
+        with self._lock:
+            last = self._last.get(key, None)
+            if last is not None:
+                last_seq, last_source, arrival = last
+                if seq < last_seq or (seq == last_seq and source != last_source):
+                    self.losses[source] = self.losses.get(source, 0) + 1
+                    if seq == last_seq:
+                        lead = perf_counter() - arrival
+                        self.lead_total[last_source] = self.lead_total.get(last_source, 0) + lead
+                        self.lead_count[last_source] = self.lead_count.get(last_source, 0) + 1
+                    return False
+
+            self._last[key] = (seq, source, perf_counter())
+            self.wins[source] = self.wins.get(source, 0) + 1
+            func(*args)
+            return True
+
+    def reset(self, key=None):
+        """
+        Forget last sequence, e.g. after a resubscribe restarts the sequence.
+        """
+        with self._lock:
+            if key is None:
+                self._last.clear()
+            else:
+                self._last.pop(key, None)
+
+    def get_stats(self):
+        """"""
+        stats = {}
+        for source in set(self.wins) | set(self.losses):
+            wins = self.wins.get(source, 0)
+            losses = self.losses.get(source, 0)
+            lead_count = self.lead_count.get(source, 0)
+            stats[source] = {
+                "wins": wins,
+                "losses": losses,
+                "win_rate": wins / (wins + losses) if wins + losses else 0,
+                "lead_avg": self.lead_total.get(source, 0) / lead_count if lead_count else 0,
+            }
+        return stats
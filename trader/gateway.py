@@ -27,6 +27,8 @@ from .object import (
     CancelRequest,
     SubscribeRequest,
 )
+from .tick_filter import TickChangeFilter, TickFilterMode
+from .latency import TraceStage
 
 
 class BaseGateway(ABC):
@@ -42,6 +44,17 @@ class BaseGateway(ABC):
         """"""
         self.event_engine = event_engine
         self.gateway_name = gateway_name
+        self.tick_filter = None
+
+    def set_tick_filter(self, levels: int = 0, mode: str = TickFilterMode.PRICE_SIZE.value):
+        """
+        Drop ticks whose first levels did not change before they enter
+        event engine. levels=0 disables the filter.
+        """
+        if levels:
+            self.tick_filter = TickChangeFilter(levels, TickFilterMode(mode))
+        else:
+            self.tick_filter = None
 
     def on_event(self, type: str, data: Any = None):
         """
@@ -55,6 +68,10 @@ class BaseGateway(ABC):
         Tick event push.
         Tick event of a specific vt_symbol is also pushed.
         """
+        if self.tick_filter and not self.tick_filter.accept(tick):
+            return
+        if tick.trace:
+            tick.trace.mark(TraceStage.ENQUEUE)
         self.on_event(EVENT_TICK, tick)
         self.on_event(EVENT_TICK + tick.vt_symbol, tick)
 
@@ -0,0 +1,353 @@
+"""
+Append-only fill journal with position snapshots.
+"""
+
+import json
+import os
+import struct
+from pathlib import Path
+from threading import Condition, Thread
+from time import time
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+SNAPSHOT_NAME = "snapshot.json"
+SEGMENT_SUFFIX = ".seg"
+
+FORMAT_MSGPACK = b"M"
+FORMAT_JSON = b"J"
+
+HEADER = struct.Struct(">I")
+
+
+def encode_entry(entry: dict, fmt: bytes):
+    """"""
+    if fmt == FORMAT_MSGPACK:
+        data = msgpack.packb(entry, use_bin_type=True)
+    else:
+        data = json.dumps(entry, separators=(",", ":")).encode("utf-8")
+    return HEADER.pack(len(data)) + data
+
+
+def decode_entry(data: bytes, fmt: bytes):
+    """"""
+    if fmt == FORMAT_MSGPACK:
+        if msgpack is None:
+            raise ImportError("msgpack is required to read this journal segment")
+        return msgpack.unpackb(data, raw=False)
+    return json.loads(data.decode("utf-8"))
+
+
+def read_segment(path: Path):
+    """
+    Read all complete entries of a segment.
+    @:return (entries, size of complete part)
+    """
+    entries = []
+    with open(path, "rb") as f:
+        buf = f.read()
+
+    if not buf:
+        return entries, 0
+
+    fmt = buf[:1]
+    pos = 1
+    while pos + HEADER.size <= len(buf):
+        size, = HEADER.unpack_from(buf, pos)
+        end = pos + HEADER.size + size
+        if end > len(buf):
+            break
+        entries.append(decode_entry(buf[pos + HEADER.size:end], fmt))
+        pos = end
+    return entries, pos
+
+
+def list_segments(path: Path):
+    """
+    Get segment files sorted by first seq.
+    @:return list of (first seq, path)
+    """
+    segments = []
+    for p in path.glob("*" + SEGMENT_SUFFIX):
+        try:
+            segments.append((int(p.stem), p))
+        except ValueError:
+            continue
+    segments.sort()
+    return segments
+
+
+def load_snapshot(path: Path):
+    """
+    @:return (seq, positions, volumes)
+    """
+    snapshot_path = path.joinpath(SNAPSHOT_NAME)
+    if not snapshot_path.exists():
+        return 0, {}, {}
+
+    with open(snapshot_path) as f:
+        data = json.load(f)
+
+    positions = {
+        (strategy_name, vt_symbol): [long_qty, short_qty]
+        for strategy_name, vt_symbol, long_qty, short_qty in data["positions"]
+    }
+    volumes = {order_count: volume for order_count, volume in data.get("volumes", [])}
+    return data["seq"], positions, volumes
+
+
+class FillJournal:
+    """
+    Journal of position changes caused by fills.
+
+    * Every entry carries a seq, a (strategy_name, vt_symbol) key and
+      long/short deltas. Entries are appended to segment files by a writer
+      thread, which fsyncs once per batch instead of once per entry.
+    * After every snapshot_interval entries, positions are written into a
+      snapshot and a new segment is started. Recovery reads the snapshot and
+      replays only segments written after it.
+    * Segments covered by the snapshot are removed by compact().
+    * Entries carrying an order_count also add up the traded volume of that
+      order, kept in snapshots as well, so the cumulative fill of each order
+      is recovered from the same entries as positions. finish(order_count)
+      drops the volume of an order which will not be filled any more, so
+      snapshots only hold orders still working.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        snapshot_interval: int = 1000,
+        sync_interval: float = 0.05,
+    ):
+        """"""
+        self.path = Path(path)
+        self.snapshot_interval = snapshot_interval
+        self.sync_interval = sync_interval
+        self.format = FORMAT_MSGPACK if msgpack else FORMAT_JSON
+
+        self.seq = 0  # last seq appended
+        self.synced_seq = 0  # last seq written and fsynced
+        self.positions = {}  # (strategy_name, vt_symbol): [long_qty, short_qty]
+        self.volumes = {}  # order_count: traded volume of working orders
+        self.is_new = True
+
+        self._cond = Condition()
+        self._pending = []
+        self._active = False
+        self._thread = None
+        self._file = None
+        self._written_since_snapshot = 0
+
+    def open(self):
+        """
+        Recover positions and start writer thread.
+        @:return positions
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+
+        snapshot_seq, positions, volumes = load_snapshot(self.path)
+        segments = list_segments(self.path)
+        self.is_new = not segments and not self.path.joinpath(SNAPSHOT_NAME).exists()
+
+        seq = snapshot_seq
+        for i, (first_seq, segment_path) in enumerate(segments):
+            # Skip segments fully covered by snapshot
+            if i + 1 < len(segments) and segments[i + 1][0] <= snapshot_seq + 1:
+                continue
+
+            entries, size = read_segment(segment_path)
+            if size < segment_path.stat().st_size:
+                # Drop incomplete entry left by a crash
+                with open(segment_path, "r+b") as f:
+                    f.truncate(size)
+
+            for entry in entries:
+                if entry["seq"] <= seq:
+                    continue
+                self._apply(positions, volumes, entry)
+                seq = entry["seq"]
+
+        self.seq = seq
+        self.synced_seq = seq
+        self.positions = positions
+        self.volumes = volumes
+        self._written_since_snapshot = seq - snapshot_seq
+
+        self._open_segment()
+        self._active = True
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+        return self.get_positions()
+
+    def close(self):
+        """
+        Write pending entries and a final snapshot.
+        """
+        with self._cond:
+            self._active = False
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join()
+
+        self._write_snapshot()
+        self._file.close()
+
+    def append(self, strategy_name: str, vt_symbol: str, long_qty: int, short_qty: int, **kwargs):
+        """
+        Add position change of one fill, extra kwargs are stored as well.
+        """
+        entry = {
+            "strategy_name": strategy_name,
+            "vt_symbol": vt_symbol,
+            "long": long_qty,
+            "short": short_qty,
+            "ts": time(),
+        }
+        entry.update(kwargs)
+        self._append(entry)
+
+    def finish(self, order_count: int):
+        """
+        Drop traded volume of an order once it is finished.
+        """
+        self._append({"finish": int(order_count), "ts": time()})
+
+    def reset(self, positions: dict, volumes: dict = None):
+        """
+        Start journal from given positions and traded volumes of orders, used
+        when migrating from another store.
+        """
+        with self._cond:
+            self.positions = {key: list(pos) for key, pos in positions.items()}
+            self.volumes = dict(volumes or {})
+        self._write_snapshot()
+
+    def get_positions(self):
+        """"""
+        with self._cond:
+            return {key: list(pos) for key, pos in self.positions.items()}
+
+    def get_volumes(self):
+        """
+        @:return {order_count: traded volume} of working orders, as of all
+        fsynced entries
+        """
+        with self._cond:
+            return dict(self.volumes)
+
+    def _append(self, entry: dict):
+        """"""
+        with self._cond:
+            self.seq += 1
+            entry["seq"] = self.seq
+            self._pending.append(entry)
+            self._cond.notify_all()
+
+    @staticmethod
+    def _apply(positions: dict, volumes: dict, entry: dict):
+        """"""
+        if "finish" in entry:
+            volumes.pop(entry["finish"], None)
+            return
+
+        key = (entry["strategy_name"], entry["vt_symbol"])
+        pos = positions.setdefault(key, [0, 0])
+        pos[0] += entry["long"]
+        pos[1] += entry["short"]
+
+        order_count = entry.get("order_count", None)
+        if order_count is not None:
+            order_count = int(order_count)
+            volumes[order_count] = volumes.get(order_count, 0) + abs(entry["long"]) + abs(entry["short"])
+
+    def _open_segment(self):
+        """"""
+        if self._file:
+            self._file.close()
+
+        segment_path = self.path.joinpath("%012d%s" % (self.synced_seq + 1, SEGMENT_SUFFIX))
+        exists = segment_path.exists() and segment_path.stat().st_size
+        self._file = open(segment_path, "ab")
+        if not exists:
+            self._file.write(self.format)
+        else:
+            with open(segment_path, "rb") as f:
+                self.format = f.read(1)
+
+    def _run(self):
+        """"""
+        while True:
+            with self._cond:
+                if not self._pending:
+                    if not self._active:
+                        break
+                    self._cond.wait(self.sync_interval)
+                    continue
+                entries = self._pending
+                self._pending = []
+
+            self._file.write(b"".join([encode_entry(entry, self.format) for entry in entries]))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+            with self._cond:
+                for entry in entries:
+                    self._apply(self.positions, self.volumes, entry)
+                self.synced_seq = entries[-1]["seq"]
+            self._written_since_snapshot += len(entries)
+
+            if self._written_since_snapshot >= self.snapshot_interval:
+                self._write_snapshot()
+                self._open_segment()
+
+    def _write_snapshot(self):
+        """
+        Write positions of all fsynced entries into snapshot file atomically.
+        """
+        with self._cond:
+            seq = self.synced_seq
+            positions = [
+                [strategy_name, vt_symbol, pos[0], pos[1]]
+                for (strategy_name, vt_symbol), pos in self.positions.items()
+            ]
+            volumes = [[order_count, volume] for order_count, volume in self.volumes.items()]
+
+        data = {"seq": seq, "time": time(), "positions": positions, "volumes": volumes}
+        snapshot_path = self.path.joinpath(SNAPSHOT_NAME)
+        tmp_path = self.path.joinpath(SNAPSHOT_NAME + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, snapshot_path)
+        self._written_since_snapshot = 0
+
+
+def compact(path: Path, archive: bool = True):
+    """
+    Remove segments whose entries are all covered by snapshot.
+    Segments are moved into archive folder if archive is True.
+    @:return list of removed segment paths
+    """
+    path = Path(path)
+    snapshot_seq = load_snapshot(path)[0]
+    segments = list_segments(path)
+
+    removed = []
+    for i, (first_seq, segment_path) in enumerate(segments[:-1]):
+        if segments[i + 1][0] > snapshot_seq + 1:
+            break
+        if archive:
+            archive_path = path.joinpath("archive")
+            archive_path.mkdir(exist_ok=True)
+            os.replace(segment_path, archive_path.joinpath(segment_path.name))
+        else:
+            os.remove(segment_path)
+        removed.append(segment_path)
+    return removed
@@ -0,0 +1,276 @@
+"""
+Latency tracing from exchange timestamp to algo decision and order fill.
+"""
+
+from bisect import bisect_left
+from collections import OrderedDict
+from enum import Enum
+from itertools import count
+from threading import Lock
+from time import time
+
+
+class TraceStage(Enum):
+    EXCHANGE = "exchange"  # Exchange timestamp of tick
+    RECEIVE = "receive"  # Frame returned by socket
+    DECODE = "decode"  # Frame decoded
+    ENQUEUE = "enqueue"  # Tick put into event engine
+    DISPATCH = "dispatch"  # Tick handled by engine
+    DECISION = "decision"  # Algo decided to send order
+    SEND = "send"  # Order request reached gateway
+    REST_SEND = "rest_send"  # Http request sent
+    ACK = "ack"  # Order response received
+    FILL = "fill"  # First fill notified
+
+
+# Intervals recorded when a tick is dispatched: (name, from stage, to stage)
+TICK_INTERVALS = [
+    ("network", TraceStage.EXCHANGE, TraceStage.RECEIVE),  # Includes clock offset
+    ("decode", TraceStage.RECEIVE, TraceStage.DECODE),
+    ("gateway", TraceStage.DECODE, TraceStage.ENQUEUE),
+    ("event_queue", TraceStage.ENQUEUE, TraceStage.DISPATCH),
+]
+
+# Intervals recorded when an algo decides on a tick
+DECISION_INTERVALS = [
+    ("algo", TraceStage.DISPATCH, TraceStage.DECISION),
+    ("receive_to_decision", TraceStage.RECEIVE, TraceStage.DECISION),
+    ("exchange_to_decision", TraceStage.EXCHANGE, TraceStage.DECISION),
+]
+
+# Intervals recorded when an order is filled or trace is finished
+ORDER_INTERVALS = [
+    ("engine", TraceStage.DECISION, TraceStage.SEND),
+    ("rest_queue", TraceStage.SEND, TraceStage.REST_SEND),
+    ("ack", TraceStage.REST_SEND, TraceStage.ACK),
+    ("fill", TraceStage.REST_SEND, TraceStage.FILL),
+    ("receive_to_wire", TraceStage.RECEIVE, TraceStage.REST_SEND),
+]
+
+INTERVAL_NAMES = [
+    interval[0] for interval in TICK_INTERVALS + DECISION_INTERVALS + ORDER_INTERVALS
+]
+
+# Histogram bucket upper bounds in milliseconds: 1us to ~100s, 10% apart
+BUCKET_BOUNDS = [0.001 * 1.1 ** n for n in range(194)]
+
+
+class LatencyHistogram:
+    """
+    Log-scale histogram of latencies in milliseconds, percentiles are
+    accurate to 10%.
+    """
+
+    def __init__(self):
+        """"""
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.negative = 0  # Clock offset larger than latency
+
+    def record(self, ms: float):
+        """"""
+        if ms < 0:
+            self.negative += 1
+            ms = 0
+        self.counts[bisect_left(BUCKET_BOUNDS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    def percentile(self, p: float):
+        """"""
+        if not self.count:
+            return 0
+        target = self.count * p / 100
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return min(BUCKET_BOUNDS[i], self.max) if i < len(BUCKET_BOUNDS) else self.max
+        return self.max
+
+    def get_stats(self):
+        """"""
+        return {
+            "count": self.count,
+            "avg": self.total / self.count if self.count else 0,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "max": self.max,
+            "negative": self.negative,
+        }
+
+
+class TickTrace:
+    """
+    Stage times (seconds since epoch) of one tick and the orders it triggered.
+    """
+
+    __slots__ = ("trace_id", "times")
+
+    def __init__(self, trace_id: str, times: dict):
+        """"""
+        self.trace_id = trace_id
+        self.times = times
+
+    def mark(self, stage: TraceStage, t: float = 0):
+        """"""
+        self.times[stage] = t or time()
+
+
+class LatencyTracer:
+    """
+    Stamp ticks at every stage from exchange to algo decision, follow the
+    order sent on the decision through gateway, REST and fill notification,
+    and keep a histogram per interval.
+
+    Tracing is off until enable() is called, then gateways attach a TickTrace
+    to each tick (TickData.trace). Orders carry trace_id of the deciding tick
+    (OrderRequest.trace_id), and gateways mark order stages by vt_client_oid.
+    Use the module level tracer object.
+    """
+
+    def __init__(self, max_orders: int = 10000):
+        """"""
+        self.enabled = False
+        self.report_interval = 60
+        self.last_report = time()
+
+        self._lock = Lock()
+        self._ids = count(1)
+        self.histograms = {name: LatencyHistogram() for name in INTERVAL_NAMES}
+
+        self.max_orders = max_orders
+        self._decisions = OrderedDict()  # trace_id: TickTrace decided but not sent yet
+        self._orders = OrderedDict()  # vt_client_oid: TickTrace
+
+    def enable(self, report_interval: float = 60):
+        """"""
+        self.report_interval = report_interval
+        self.last_report = time()
+        self.enabled = True
+
+    def disable(self):
+        """"""
+        self.enabled = False
+
+    def new_tick_trace(self, exchange_ms: float, receive: float, decode: float):
+        """
+        Create trace of a tick decoded from a frame received at receive.
+        """
+        return TickTrace(
+            str(next(self._ids)),
+            {
+                TraceStage.EXCHANGE: exchange_ms / 1000,
+                TraceStage.RECEIVE: receive,
+                TraceStage.DECODE: decode,
+            },
+        )
+
+    def on_dispatch(self, trace: TickTrace):
+        """
+        Called when tick is handled by engine.
+        """
+        trace.mark(TraceStage.DISPATCH)
+        self._record(trace, TICK_INTERVALS)
+
+    def on_decision(self, trace: TickTrace):
+        """
+        Called when algo sends an order on tick.
+        @:return trace_id to be put into OrderRequest
+        """
+        trace.mark(TraceStage.DECISION)
+        self._record(trace, DECISION_INTERVALS)
+
+        with self._lock:
+            self._decisions[trace.trace_id] = trace
+            self._trim(self._decisions)
+        return trace.trace_id
+
+    def bind_order(self, vt_client_oid: str, trace_id: str):
+        """
+        Called by gateway when order request with trace_id is received.
+        """
+        if not trace_id:
+            return
+        with self._lock:
+            trace = self._decisions.get(trace_id, None)
+            if not trace:
+                return
+            # One tick may trigger several orders
+            trace = TickTrace(trace_id, dict(trace.times))
+            trace.mark(TraceStage.SEND)
+            self._orders[str(vt_client_oid)] = trace
+            self._trim(self._orders)
+
+    def mark_order(self, vt_client_oid: str, stage: TraceStage, t: float = 0):
+        """
+        Mark stage of a traced order, first mark of each stage is kept.
+        """
+        trace = self._orders.get(str(vt_client_oid), None)
+        if trace and stage not in trace.times:
+            trace.mark(stage, t)
+
+    def finish_order(self, vt_client_oid: str):
+        """
+        Record intervals of order and forget it, called on first fill or when
+        order is finished without fill.
+        """
+        with self._lock:
+            trace = self._orders.pop(str(vt_client_oid), None)
+        if trace:
+            self._record(trace, ORDER_INTERVALS)
+
+    def _trim(self, traces: OrderedDict):
+        """"""
+        while len(traces) > self.max_orders:
+            traces.popitem(last=False)
+
+    def _record(self, trace: TickTrace, intervals: list):
+        """"""
+        times = trace.times
+        with self._lock:
+            for name, start, end in intervals:
+                if start in times and end in times:
+                    self.histograms[name].record((times[end] - times[start]) * 1000)
+
+    def get_stats(self):
+        """"""
+        with self._lock:
+            return {name: hist.get_stats() for name, hist in self.histograms.items()}
+
+    def reset(self):
+        """"""
+        with self._lock:
+            self.histograms = {name: LatencyHistogram() for name in INTERVAL_NAMES}
+
+    def report(self):
+        """
+        Format stats of intervals with samples as text table (milliseconds).
+        """
+        lines = ["{:<22}{:>8}{:>10}{:>10}{:>10}{:>10}".format(
+            "interval", "count", "p50", "p90", "p99", "max")]
+        for name, stats in self.get_stats().items():
+            if not stats["count"]:
+                continue
+            lines.append("{:<22}{:>8}{:>10.3f}{:>10.3f}{:>10.3f}{:>10.3f}".format(
+                name, stats["count"], stats["p50"], stats["p90"], stats["p99"], stats["max"]))
+        return "\n".join(lines)
+
+    def report_if_due(self, write_log):
+        """
+        Write report of last report_interval seconds and start a new window.
+        """
+        now = time()
+        if now - self.last_report < self.report_interval:
+            return
+        self.last_report = now
+        write_log("延迟统计(ms)\n" + self.report())
+        self.reset()
+
+
+tracer = LatencyTracer()
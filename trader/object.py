@@ -2,7 +2,7 @@
 Basic data structure used for general trading function in VN Trader.
 """
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
 from logging import INFO
 
@@ -121,6 +121,9 @@ class TickData(BaseData):
     ask_volume_4: float = 0
     ask_volume_5: float = 0
 
+    # TickTrace stamped by gateway when latency tracing is enabled
+    trace: object = field(default=None, compare=False, repr=False)
+
     def __post_init__(self):
         """"""
         self.vt_symbol = f"{self.symbol}.{self.exchange}"
@@ -399,6 +402,7 @@ class OrderRequest:
     volume: float
     price: float = 0
     offset: Offset = Offset.NONE
+    trace_id: str = ""  # Trace of the tick triggering this order
 
     def __post_init__(self):
         """"""
@@ -0,0 +1,144 @@
+"""
+Client order id allocator leasing id blocks from MongoDB.
+"""
+
+from threading import Condition, Lock, Thread
+
+from trader.constant import HuobiDB
+from trader.utility import DBEngine
+
+DB_NAME = HuobiDB.DB_NAME.value
+DB_ORDERID = HuobiDB.DB_ORDERID.value
+
+
+class OrderIdAllocator:
+    """
+    Hand out increasing client order ids from leased blocks.
+
+    * A block of block_size ids is leased with one atomic $inc on the
+      order_count field of the apikey document, so the persisted value is
+      always the highest id that may have been used. After a crash the
+      next lease starts above it and no id is ever reused.
+    * start() leases the first block in background, and the next block is
+      leased in background when the current one is running low, so next()
+      normally never touches the database.
+    * One allocator is shared by every gateway/api using the same name, use
+      OrderIdAllocator.get(name) to obtain it.
+    """
+
+    _allocators = {}
+    _allocators_lock = Lock()
+
+    def __init__(self, name: str, block_size: int = 10000, low_water: float = 0.1):
+        """"""
+        self.name = name
+        self.block_size = block_size
+        self.low_water = int(block_size * low_water)
+
+        self.db_engine = DBEngine()
+
+        self._cond = Condition()
+        self._next_id = 0
+        self._end_id = 0  # exclusive
+        self._next_block = None  # (start, end) leased in advance
+        self._leasing = False
+
+        self.lease_count = 0
+
+    @classmethod
+    def get(cls, name: str, block_size: int = 10000):
+        """
+        Get allocator shared by all users of name.
+        """
+        with cls._allocators_lock:
+            allocator = cls._allocators.get(name, None)
+            if not allocator:
+                allocator = cls(name, block_size)
+                cls._allocators[name] = allocator
+            return allocator
+
+    def start(self):
+        """
+        Lease first block in background, call it when connecting.
+        """
+        with self._cond:
+            if self._next_id < self._end_id or self._next_block or self._leasing:
+                return
+            self._start_prefetch()
+
+    def next(self):
+        """
+        Get next client order id.
+        """
+        with self._cond:
+            if self._next_id >= self._end_id:
+                self._take_next_block()
+
+            order_id = self._next_id
+            self._next_id += 1
+
+            if (
+                self._end_id - self._next_id <= self.low_water
+                and not self._next_block
+                and not self._leasing
+            ):
+                self._start_prefetch()
+
+            return order_id
+
+    @property
+    def last_id(self):
+        """
+        Last id handed out.
+        """
+        return self._next_id - 1
+
+    def _take_next_block(self):
+        """
+        Switch to block leased in advance, or lease one now if the lease in
+        background failed.
+        """
+        while self._leasing:
+            self._cond.wait()
+
+        if not self._next_block:
+            self._next_block = self._lease()
+
+        self._next_id, self._end_id = self._next_block
+        self._next_block = None
+
+    def _start_prefetch(self):
+        """
+        Must be called with self._cond held.
+        """
+        self._leasing = True
+        thread = Thread(target=self._prefetch)
+        thread.daemon = True
+        thread.start()
+
+    def _prefetch(self):
+        """"""
+        try:
+            block = self._lease()
+        except Exception:  # noqa
+            block = None
+
+        with self._cond:
+            self._next_block = block
+            self._leasing = False
+            self._cond.notify_all()
+
+    def _lease(self):
+        """
+        Reserve next block in database.
+        @:return (start, end)
+        """
+        end = self.db_engine.dbIncrement(
+            DB_NAME,
+            DB_ORDERID,
+            {'apikey': self.name},
+            'order_count',
+            self.block_size,
+        )
+        self.lease_count += 1
+        return end - self.block_size + 1, end + 1
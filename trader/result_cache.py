@@ -0,0 +1,152 @@
+"""
+Content addressed cache of backtest results on disk.
+"""
+
+import hashlib
+import importlib
+import json
+import os
+import pickle
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+
+from .tick_store import TickStore, file_checksum
+from .utility import get_temp_path
+from .vector_backtest import get_weeks
+
+DEFAULT_MAX_SIZE = 2 * 1024 ** 3  # bytes
+CACHE_SUFFIX = ".pkl"
+
+
+def get_data_version(tick_store: TickStore, vt_symbols: list, start: datetime, end: datetime):
+    """
+    Checksums of all tick store partitions a backtest from start until end
+    may replay.
+    """
+    weeks = list(get_weeks(start, end))
+    first, last = weeks[0][0], weeks[-1][1]
+    return [
+        [vt_symbol, day, tick_store.get_checksum(vt_symbol, day)]
+        for vt_symbol in vt_symbols
+        for day in tick_store.get_days(vt_symbol, first, last)
+    ]
+
+
+@lru_cache(maxsize=None)
+def get_code_version(module_names: tuple):
+    """
+    Hash of source files of modules, changes whenever the code producing
+    results is edited.
+    """
+    h = hashlib.sha1()
+    for name in module_names:
+        module = importlib.import_module(name)
+        h.update(name.encode())
+        h.update(file_checksum(Path(module.__file__)).encode())
+    return h.hexdigest()
+
+
+def get_file_version(path: str):
+    """"""
+    return file_checksum(Path(path))
+
+
+class ResultCache:
+    """
+    Backtest results stored under the hash of everything they depend on:
+    tick data partitions, code version, contract file and parameters. A key
+    built from the same inputs always finds the same result, and any change
+    of the inputs misses.
+
+    Each entry is one pickle file. Reading an entry refreshes its mtime, and
+    once the total size exceeds max_size the least recently used entries
+    are deleted. Several processes may share the same directory.
+    """
+
+    def __init__(self, root: str = "", max_size: int = DEFAULT_MAX_SIZE):
+        """"""
+        self.root = Path(root) if root else get_temp_path("result_cache")
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.size = self.get_size()
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def get_key(**parts):
+        """"""
+        data = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+        return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+    def get_path(self, key: str):
+        """"""
+        return self.root.joinpath(key[:2], key + CACHE_SUFFIX)
+
+    def get(self, key: str):
+        """
+        @:return cached value or None
+        """
+        path = self.get_path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+            os.utime(path)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return value
+
+    def put(self, key: str, value):
+        """"""
+        path = self.get_path(key)
+        path.parent.mkdir(exist_ok=True)
+        tmp_path = path.with_name("{}.{}.tmp".format(path.name, os.getpid()))
+        with open(tmp_path, "wb") as f:
+            pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+        self.size += tmp_path.stat().st_size
+        os.replace(tmp_path, path)
+
+        if self.size > self.max_size:
+            self.evict()
+
+    def get_entries(self):
+        """
+        @:return [(mtime, size, path)] of all entries
+        """
+        entries = []
+        for path in self.root.glob("*/*" + CACHE_SUFFIX):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def get_size(self):
+        """"""
+        return sum(size for _, size, _ in self.get_entries())
+
+    def evict(self):
+        """
+        Delete least recently used entries until size is within max_size.
+        """
+        entries = sorted(self.get_entries())
+        self.size = sum(size for _, size, _ in entries)
+        for mtime, size, path in entries:
+            if self.size <= self.max_size:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            self.size -= size
+
+    def clear(self):
+        """"""
+        for _, _, path in self.get_entries():
+            path.unlink()
+        self.size = 0
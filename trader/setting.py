@@ -19,4 +19,7 @@ SETTINGS = {
     "email.password": "",
     "email.sender": "",
     "email.receiver": "",
+
+    "latency.trace": False,
+    "latency.report_interval": 60,
 }
@@ -0,0 +1,104 @@
+"""
+Parameter sweep over all cores with checkpointing of finished settings.
+"""
+
+import json
+import multiprocessing
+from functools import partial
+from pathlib import Path
+
+
+def get_setting_key(setting: dict):
+    """"""
+    return json.dumps(setting, sort_keys=True)
+
+
+def to_json(value):
+    """Convert numpy scalars, dates and other values json can not encode"""
+    if hasattr(value, "item"):
+        return value.item()
+    return str(value)
+
+
+class SweepCheckpoint:
+    """
+    Results of finished settings in a json lines file, one line per setting.
+
+    A line is appended and flushed as soon as a setting finishes, so after an
+    interruption only settings still running are lost. A partly written last
+    line is ignored when the file is read again.
+    """
+
+    def __init__(self, path: str):
+        """"""
+        self.path = Path(path)
+        self.results = {}  # setting key: result
+
+        if self.path.exists():
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        d = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.results[get_setting_key(d["setting"])] = d["result"]
+
+    def get(self, setting: dict):
+        """"""
+        return self.results.get(get_setting_key(setting), None)
+
+    def add(self, setting: dict, result):
+        """"""
+        self.results[get_setting_key(setting)] = result
+        line = json.dumps({"setting": setting, "result": result}, default=to_json, ensure_ascii=False)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+def run_setting(func, setting: dict):
+    """"""
+    return setting, func(setting)
+
+
+def run_sweep(
+    func,
+    settings: list,
+    processes: int = 0,
+    checkpoint_path: str = "",
+    initializer=None,
+    initargs: tuple = (),
+):
+    """
+    Run func(setting) for every setting in a process pool and yield
+    (setting, result) in the order they finish.
+
+    func, initializer and initargs must be picklable. initializer runs once
+    in each worker, e.g. to open memory-mapped data shared by all settings.
+    Settings with a result in the checkpoint file are yielded first without
+    running again.
+    """
+    checkpoint = SweepCheckpoint(checkpoint_path) if checkpoint_path else None
+
+    pending = []
+    keys = set()
+    for setting in settings:
+        key = get_setting_key(setting)
+        if key in keys:
+            continue
+        keys.add(key)
+
+        result = checkpoint.get(setting) if checkpoint else None
+        if result is not None:
+            yield setting, result
+        else:
+            pending.append(setting)
+
+    if not pending:
+        return
+
+    processes = min(processes or multiprocessing.cpu_count(), len(pending))
+    with multiprocessing.Pool(processes, initializer, initargs) as pool:
+        for setting, result in pool.imap_unordered(partial(run_setting, func), pending):
+            if checkpoint:
+                checkpoint.add(setting, result)
+            yield setting, result
@@ -0,0 +1,74 @@
+"""
+Filter dropping ticks whose top of book did not change.
+"""
+
+from enum import Enum
+from operator import attrgetter
+
+from .object import TickData
+
+
+class TickFilterMode(Enum):
+    PRICE = "price"  # Only prices of watched levels
+    PRICE_SIZE = "price_size"  # Prices and volumes of watched levels
+
+
+class TickChangeFilter:
+    """
+    Pass a tick only if watched levels differ from the last tick passed for
+    the same vt_symbol.
+
+    levels: number of book levels watched (1-5)
+    mode: compare prices only or prices and volumes
+    """
+
+    def __init__(self, levels: int = 1, mode: TickFilterMode = TickFilterMode.PRICE_SIZE):
+        """"""
+        if not 1 <= levels <= 5:
+            raise ValueError("levels must be between 1 and 5")
+        mode = TickFilterMode(mode)
+
+        fields = []
+        for n in range(1, levels + 1):
+            fields.extend([f"bid_price_{n}", f"ask_price_{n}"])
+            if mode == TickFilterMode.PRICE_SIZE:
+                fields.extend([f"bid_volume_{n}", f"ask_volume_{n}"])
+
+        self.levels = levels
+        self.mode = mode
+        self._getter = attrgetter(*fields)
+        self._last = {}  # vt_symbol: watched values
+
+        self.passed_count = 0
+        self.dropped_count = 0
+        self.dropped = {}  # vt_symbol: dropped count
+
+    def accept(self, tick: TickData):
+        """"""
+        values = self._getter(tick)
+        vt_symbol = tick.vt_symbol
+        if self._last.get(vt_symbol, None) == values:
+            self.dropped_count += 1
+            self.dropped[vt_symbol] = self.dropped.get(vt_symbol, 0) + 1
+            return False
+
+        self._last[vt_symbol] = values
+        self.passed_count += 1
+        return True
+
+    def reset(self, vt_symbol: str = ""):
+        """
+        Forget last tick so that next one always passes.
+        """
+        if vt_symbol:
+            self._last.pop(vt_symbol, None)
+        else:
+            self._last.clear()
+
+    def get_stats(self):
+        """"""
+        return {
+            "passed": self.passed_count,
+            "dropped": self.dropped_count,
+            "dropped_by_symbol": dict(self.dropped),
+        }
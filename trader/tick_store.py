@@ -0,0 +1,304 @@
+"""
+Columnar tick storage for backtesting, one memory-mapped NumPy file per
+column, partitioned by vt_symbol and day.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+
+from .utility import get_temp_path
+
+MANIFEST_NAME = "manifest.json"
+COLUMN_SUFFIX = ".npy"
+
+# datetime is int64 nanoseconds of the naive datetime saved by tick recorder
+DATETIME_FIELD = "datetime"
+
+PRICE_FIELDS = (
+    ["last_price", "volume"]
+    + [f"bid_price_{n}" for n in range(1, 6)]
+    + [f"ask_price_{n}" for n in range(1, 6)]
+    + [f"bid_volume_{n}" for n in range(1, 6)]
+    + [f"ask_volume_{n}" for n in range(1, 6)]
+)
+
+TICK_FIELDS = [DATETIME_FIELD] + PRICE_FIELDS
+
+TICK_DB_NAME = "VnTrader_Tick_Db"
+
+
+def to_ns(dt: datetime):
+    """"""
+    return np.datetime64(dt, "ns").astype(np.int64)
+
+
+def from_ns(ns: int):
+    """"""
+    return datetime(1970, 1, 1) + timedelta(microseconds=int(ns) // 1000)
+
+
+def file_checksum(path: Path):
+    """"""
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class TickStore:
+    """
+    Ticks of each vt_symbol are split into day partitions:
+
+        root/<vt_symbol>/<YYYYMMDD>/<field>.npy
+        root/<vt_symbol>/manifest.json
+
+    Each column is a plain .npy array (datetime int64 ns, others float64),
+    so a partition is opened with np.load(mmap_mode="r") without parsing or
+    copying and pages are read only when touched. The manifest records row
+    count, time range and a checksum of every partition, the checksum also
+    identifies the content of a partition for result caching.
+
+    Partitions are written to a temporary directory and renamed, so readers
+    never see half written days.
+    """
+
+    def __init__(self, root: str = ""):
+        """"""
+        self.root = Path(root) if root else get_temp_path("tick_store")
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._manifests = {}  # vt_symbol: manifest
+
+    def get_manifest(self, vt_symbol: str):
+        """
+        Get {day: {"count", "start", "end", "checksum"}} of vt_symbol, day is
+        "YYYYMMDD".
+        """
+        manifest = self._manifests.get(vt_symbol, None)
+        if manifest is None:
+            path = self.root.joinpath(vt_symbol, MANIFEST_NAME)
+            if path.exists():
+                with open(path) as f:
+                    manifest = json.load(f)
+            else:
+                manifest = {}
+            self._manifests[vt_symbol] = manifest
+        return manifest
+
+    def _save_manifest(self, vt_symbol: str):
+        """"""
+        path = self.root.joinpath(vt_symbol, MANIFEST_NAME)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.get_manifest(vt_symbol), f, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+
+    def get_symbols(self):
+        """"""
+        return sorted(p.name for p in self.root.iterdir() if p.joinpath(MANIFEST_NAME).exists())
+
+    def get_days(self, vt_symbol: str, start: datetime = None, end: datetime = None):
+        """
+        Get sorted days of vt_symbol overlapping [start, end].
+        """
+        days = sorted(self.get_manifest(vt_symbol))
+        if start:
+            days = [d for d in days if d >= start.strftime("%Y%m%d")]
+        if end:
+            days = [d for d in days if d <= end.strftime("%Y%m%d")]
+        return days
+
+    def get_checksum(self, vt_symbol: str, day: str):
+        """"""
+        return self.get_manifest(vt_symbol)[day]["checksum"]
+
+    def write_day(self, vt_symbol: str, day: str, columns: dict):
+        """
+        Write (replace) one day partition, columns is {field: array}, rows
+        are sorted by datetime before writing. Empty days are not stored.
+        """
+        dt = np.asarray(columns[DATETIME_FIELD], dtype=np.int64)
+        if not len(dt):
+            return
+        order = np.argsort(dt, kind="stable")
+
+        symbol_path = self.root.joinpath(vt_symbol)
+        symbol_path.mkdir(exist_ok=True)
+        day_path = symbol_path.joinpath(day)
+        tmp_path = symbol_path.joinpath(day + ".tmp")
+        if tmp_path.exists():
+            shutil.rmtree(tmp_path)
+        tmp_path.mkdir()
+
+        h = hashlib.sha1()
+        for field in TICK_FIELDS:
+            if field == DATETIME_FIELD:
+                array = dt[order]
+            else:
+                values = columns.get(field, None)
+                if values is None:
+                    array = np.zeros(len(dt), dtype=np.float64)
+                else:
+                    array = np.asarray(values, dtype=np.float64)[order]
+            path = tmp_path.joinpath(field + COLUMN_SUFFIX)
+            np.save(path, array)
+            h.update(field.encode())
+            h.update(file_checksum(path).encode())
+
+        if day_path.exists():
+            shutil.rmtree(day_path)
+        os.replace(tmp_path, day_path)
+
+        manifest = self.get_manifest(vt_symbol)
+        manifest[day] = {
+            "count": int(len(dt)),
+            "start": int(dt[order[0]]) if len(dt) else 0,
+            "end": int(dt[order[-1]]) if len(dt) else 0,
+            "checksum": h.hexdigest(),
+        }
+        self._save_manifest(vt_symbol)
+
+    def write_ticks(self, vt_symbol: str, ticks):
+        """
+        Write ticks (dicts or objects with TICK_FIELDS attributes), split into
+        day partitions. Ticks must be sorted by datetime, each day is
+        written as soon as the next one starts.
+        @:return number of ticks written
+        """
+        count = 0
+        day = None
+        rows = []
+
+        for tick in ticks:
+            d = tick if isinstance(tick, dict) else tick.__dict__
+            dt = d[DATETIME_FIELD]
+            tick_day = dt.strftime("%Y%m%d")
+            if tick_day != day:
+                if rows:
+                    self._write_rows(vt_symbol, day, rows)
+                    count += len(rows)
+                day = tick_day
+                rows = []
+            rows.append([to_ns(dt)] + [d.get(field, 0) or 0 for field in PRICE_FIELDS])
+
+        if rows:
+            self._write_rows(vt_symbol, day, rows)
+            count += len(rows)
+        return count
+
+    def _write_rows(self, vt_symbol: str, day: str, rows: list):
+        """"""
+        dt = np.array([row[0] for row in rows], dtype=np.int64)
+        values = np.array([row[1:] for row in rows], dtype=np.float64)
+        columns = {DATETIME_FIELD: dt}
+        for n, field in enumerate(PRICE_FIELDS):
+            columns[field] = values[:, n]
+        self.write_day(vt_symbol, day, columns)
+
+    def load_day(self, vt_symbol: str, day: str, fields: list = None, mmap: bool = True):
+        """
+        Open columns of one day partition, memory-mapped by default.
+        @:return {field: array}
+        """
+        day_path = self.root.joinpath(vt_symbol, day)
+        mmap_mode = "r" if mmap else None
+        return {
+            field: np.load(day_path.joinpath(field + COLUMN_SUFFIX), mmap_mode=mmap_mode)
+            for field in (fields or TICK_FIELDS)
+        }
+
+    def iter_days(self, vt_symbol: str, start: datetime, end: datetime, fields: list = None):
+        """
+        Yield (day, columns) of partitions in [start, end], rows outside the
+        range are sliced off without copying.
+        """
+        fields = list(fields or TICK_FIELDS)
+        if DATETIME_FIELD not in fields:
+            fields.insert(0, DATETIME_FIELD)
+
+        start_ns = to_ns(start)
+        end_ns = to_ns(end)
+        for day in self.get_days(vt_symbol, start, end):
+            columns = self.load_day(vt_symbol, day, fields)
+            dt = columns[DATETIME_FIELD]
+            i = np.searchsorted(dt, start_ns, "left")
+            j = np.searchsorted(dt, end_ns, "right")
+            if i >= j:
+                continue
+            if i or j < len(dt):
+                columns = {field: array[i:j] for field, array in columns.items()}
+            yield day, columns
+
+    def load(self, vt_symbol: str, start: datetime, end: datetime, fields: list = None):
+        """
+        Load columns of [start, end] as contiguous arrays (copied once).
+        """
+        fields = list(fields or TICK_FIELDS)
+        if DATETIME_FIELD not in fields:
+            fields.insert(0, DATETIME_FIELD)
+
+        parts = [columns for _, columns in self.iter_days(vt_symbol, start, end, fields)]
+        if not parts:
+            return {
+                field: np.empty(0, dtype=np.int64 if field == DATETIME_FIELD else np.float64)
+                for field in fields
+            }
+        return {field: np.concatenate([part[field] for part in parts]) for field in fields}
+
+    def verify(self, vt_symbol: str):
+        """
+        Recalculate checksums of all partitions.
+        @:return list of days whose files do not match manifest
+        """
+        bad = []
+        for day, info in self.get_manifest(vt_symbol).items():
+            day_path = self.root.joinpath(vt_symbol, day)
+            h = hashlib.sha1()
+            try:
+                for field in TICK_FIELDS:
+                    h.update(field.encode())
+                    h.update(file_checksum(day_path.joinpath(field + COLUMN_SUFFIX)).encode())
+            except FileNotFoundError:
+                bad.append(day)
+                continue
+            if h.hexdigest() != info["checksum"]:
+                bad.append(day)
+        return sorted(bad)
+
+
+def convert_mongo_ticks(
+    store: TickStore,
+    vt_symbol: str,
+    start: datetime = None,
+    end: datetime = None,
+    db_client=None,
+    db_name: str = TICK_DB_NAME,
+):
+    """
+    Copy ticks of vt_symbol from MongoDB tick database (written by
+    tick_record) into store, streaming the cursor one day at a time.
+    @:return number of ticks converted
+    """
+    if db_client is None:
+        import pymongo
+        db_client = pymongo.MongoClient("localhost", 27017)
+
+    flt = {}
+    if start or end:
+        flt[DATETIME_FIELD] = {}
+        if start:
+            flt[DATETIME_FIELD]["$gte"] = start
+        if end:
+            flt[DATETIME_FIELD]["$lte"] = end
+
+    projection = {field: 1 for field in TICK_FIELDS}
+    projection["_id"] = 0
+    cursor = db_client[db_name][vt_symbol].find(flt, projection).sort(DATETIME_FIELD)
+    return store.write_ticks(vt_symbol, cursor)
+
@@ -5,13 +5,19 @@ import sys
 import os
 curPath = os.path.abspath(os.path.dirname(__file__))
 import shelve
+import time
+from collections import defaultdict
 from pathlib import Path
+from queue import Queue, Empty
+from threading import Condition, Thread
 from typing import Callable
 from decimal import Decimal
 import numpy as np
 # import talib
-from pymongo import MongoClient, ASCENDING
+from pymongo import MongoClient, ASCENDING, InsertOne, ReplaceOne, ReturnDocument
+from pymongo.errors import BulkWriteError
 from trader.object import BarData, TickData
+from trader.constant import DB_INDEXES
 
 
 class Singleton(type):
@@ -388,12 +394,49 @@ def getJsonPath(name, moduleFile):
 
 class DBEngine(metaclass=Singleton):
     """
+    MongoDB读写。
+
+    * dbInsert/dbUpdate默认只放入有界写队列，由后台线程按集合批量bulk_write，
+      同一过滤条件的多次更新在一批内合并为最后一次；sync=True时同步写入
+    * dbQuery等查询先等该集合的待写数据落库再查询MongoDB，最多等flush_timeout秒，
+      MongoDB不可用时查询不会一直阻塞；委托等常用数据由各自的内存账本读取
+    * 批量写入失败时按退避间隔重试未写入的部分，出错的单条写入跳过，错误通过
+      write_log报告（StEngine设为主引擎的日志）
+    * close()先停止无限重试再写完队列，最多等close_timeout秒，get_metrics()返回
+      积压和写入延时
+    * 连接时按DB_INDEXES创建各集合的复合索引，dbQuery可指定projection只返回所需字段
     """
+    queue_size = 100000
+    batch_size = 500
+    retry_interval = 0.5  # 秒，每次失败后加倍
+    max_retry_interval = 10
+    close_retry_count = 3  # close()后MongoDB仍不可用时，每批最多重试的次数
+    flush_timeout = 5  # 秒，查询前等待待写数据落库的最长时间
+    close_timeout = 30  # 秒，close()等待队列写完的最长时间
+
     def __init__(self):
         """"""
         # MongoDB数据库相关
         self.dbClient = None  # MongoDB客户端对象
+        self.write_log = print
         self.dbConnect()
+
+        # 后台写入相关
+        self._queue = Queue(maxsize=self.queue_size)
+        self._cond = Condition()
+        self._pending = defaultdict(int)  # (dbName, collectionName): 未写入数量
+
+        self.written_count = 0
+        self.batch_count = 0
+        self.error_count = 0
+        self.last_latency = 0
+        self.max_latency = 0
+        self._total_latency = 0
+
+        self._active = True
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
     # ----------------------------------------------------------------------
     def dbConnect(self,address=None):
         """连接MongoDB数据库"""
@@ -409,30 +452,52 @@ class DBEngine(metaclass=Singleton):
                 # 调用server_info查询服务器状态，防止服务器异常并未连接成功
                 self.dbClient.server_info()
                 print('MongoDB is connected.')
+                self.dbEnsureIndexes()
 
             except :
                 print('Failed to connect to MongoDB,address={}'.format(address))
 
     #----------------------------------------------------------------------
-    def dbInsert(self, dbName, collectionName, d):
+    def dbEnsureIndexes(self, indexes=None):
+        """创建索引，已存在的索引不会重复创建"""
+        if indexes is None:
+            indexes = DB_INDEXES
+        for (dbName, collectionName), keys_list in indexes.items():
+            collection = self.dbClient[dbName][collectionName]
+            for keys in keys_list:
+                try:
+                    collection.create_index(keys, background=True)
+                except:  # noqa
+                    print('MongoDB创建索引失败：{}.{}, {}'.format(dbName, collectionName, keys))
+
+    #----------------------------------------------------------------------
+    def dbInsert(self, dbName, collectionName, d, sync=False):
         """向MongoDB中插入数据，d是具体数据"""
         if self.dbClient:
-            db = self.dbClient[dbName]
-            collection = db[collectionName]
-            collection.insert_one(d)
+            if sync:
+                self.dbFlush(dbName, collectionName)
+                db = self.dbClient[dbName]
+                collection = db[collectionName]
+                collection.insert_one(d)
+            else:
+                self._put(dbName, collectionName, None, dict(d), False)
         else:
             print('Data insert failed，please connect MongoDB first.')
 
     # ----------------------------------------------------------------------
-    def dbQuery(self, dbName, collectionName, d, sortKey='', sortDirection=ASCENDING):
-        """从MongoDB中读取数据，d是查询要求，返回的是数据库查询的指针"""
+    def dbQuery(self, dbName, collectionName, d, sortKey='', sortDirection=ASCENDING, projection=None):
+        """从MongoDB中读取数据，d是查询要求，projection是需要返回的字段列表，返回的是数据库查询的指针"""
         if self.dbClient:
+            self.dbFlush(dbName, collectionName)
             db = self.dbClient[dbName]
             collection = db[collectionName]
+            if projection:
+                projection = dict.fromkeys(projection, True)
+                projection['_id'] = False
             if sortKey:
-                cursor = collection.find(d).sort(sortKey, sortDirection)  # 对查询出来的数据进行排序
+                cursor = collection.find(d, projection).sort(sortKey, sortDirection)  # 对查询出来的数据进行排序
             else:
-                cursor = collection.find(d)
+                cursor = collection.find(d, projection)
             if cursor:
                 return list(cursor)
             else:
@@ -443,11 +508,195 @@ class DBEngine(metaclass=Singleton):
             return []
 
     #----------------------------------------------------------------------
-    def dbUpdate(self, dbName, collectionName, d, flt, upsert=False):
+    def dbUpdate(self, dbName, collectionName, d, flt, upsert=False, sync=False):
         """向MongoDB中更新数据，d是具体数据，flt是过滤条件，upsert代表若无是否要插入"""
         if self.dbClient:
-            db = self.dbClient[dbName]
-            collection = db[collectionName]
-            collection.replace_one(flt, d, upsert)
+            d = dict(d)
+            if sync:
+                self.dbFlush(dbName, collectionName)
+                db = self.dbClient[dbName]
+                collection = db[collectionName]
+                collection.replace_one(flt, d, upsert)
+            else:
+                self._put(dbName, collectionName, flt, d, upsert)
         else:
-            print('Data update failed，please connect MongoDB first.')
\ No newline at end of file
+            print('Data update failed，please connect MongoDB first.')
+
+    #----------------------------------------------------------------------
+    def dbIncrement(self, dbName, collectionName, flt, field, amount):
+        """原子地给字段加上amount，不存在则插入，返回加后的值"""
+        if self.dbClient:
+            self.dbFlush(dbName, collectionName)
+            collection = self.dbClient[dbName][collectionName]
+            d = collection.find_one_and_update(
+                flt,
+                {'$inc': {field: amount}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+            return d[field]
+        else:
+            raise ConnectionError('Data increment failed，please connect MongoDB first.')
+
+    #----------------------------------------------------------------------
+    def dbAggregate(self, dbName, collectionName, pipeline):
+        """在MongoDB中执行聚合管道"""
+        if self.dbClient:
+            self.dbFlush(dbName, collectionName)
+            collection = self.dbClient[dbName][collectionName]
+            return list(collection.aggregate(pipeline))
+        else:
+            print('aggregate Fail')
+            return []
+
+    #----------------------------------------------------------------------
+    def dbFlush(self, dbName=None, collectionName=None, timeout=None):
+        """
+        等待队列中的数据写入，不指定集合时等待全部。
+        最多等待timeout秒（默认flush_timeout），返回是否已写完
+        """
+        if timeout is None:
+            timeout = self.flush_timeout
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._thread.is_alive():
+                if dbName:
+                    pending = self._pending.get((dbName, collectionName), 0)
+                else:
+                    pending = any(self._pending.values())
+                if not pending:
+                    return True
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(min(remaining, 1))
+            return not any(self._pending.values())
+
+    #----------------------------------------------------------------------
+    def close(self):
+        """
+        停止后台线程。先置_active为False，MongoDB不可用时每批只重试close_retry_count次，
+        再等待队列写完，超过close_timeout秒不再等待
+        """
+        self._active = False
+        self._thread.join(self.close_timeout)
+        if self._thread.is_alive():
+            self._report_error('MongoDB写入超时，{}条数据未写入'.format(sum(self._pending.values())))
+
+    #----------------------------------------------------------------------
+    def get_metrics(self):
+        """后台写入的积压和延时（秒）"""
+        with self._cond:
+            return {
+                'backlog': sum(self._pending.values()),
+                'written': self.written_count,
+                'batches': self.batch_count,
+                'errors': self.error_count,
+                'last_latency': self.last_latency,
+                'max_latency': self.max_latency,
+                'avg_latency': self._total_latency / self.written_count if self.written_count else 0,
+            }
+
+    #----------------------------------------------------------------------
+    def _put(self, dbName, collectionName, flt, d, upsert):
+        """flt为None时插入d，否则替换"""
+        with self._cond:
+            self._pending[(dbName, collectionName)] += 1
+        self._queue.put((dbName, collectionName, flt, d, upsert, time.time()))
+
+    @staticmethod
+    def _get_flt_key(flt):
+        """"""
+        return repr(sorted(flt.items()))
+
+    def _run(self):
+        """后台批量写入"""
+        while self._active or not self._queue.empty():
+            try:
+                items = [self._queue.get(timeout=0.1)]
+            except Empty:
+                continue
+            while len(items) < self.batch_size:
+                try:
+                    items.append(self._queue.get_nowait())
+                except Empty:
+                    break
+
+            # 按集合分组，同一过滤条件的更新只保留最后一次
+            groups = defaultdict(list)
+            replaces = {}
+            for dbName, collectionName, flt, d, upsert, t in items:
+                ops = groups[(dbName, collectionName)]
+                if flt is None:
+                    ops.append(InsertOne(d))
+                    continue
+
+                key = (dbName, collectionName, self._get_flt_key(flt))
+                if key in replaces:
+                    n, last_upsert = replaces[key]
+                    upsert = upsert or last_upsert
+                    ops[n] = ReplaceOne(flt, d, upsert=upsert)
+                else:
+                    n = len(ops)
+                    ops.append(ReplaceOne(flt, d, upsert=upsert))
+                replaces[key] = (n, upsert)
+
+            for (dbName, collectionName), ops in groups.items():
+                self._bulk_write(dbName, collectionName, ops)
+
+            now = time.time()
+            with self._cond:
+                for dbName, collectionName, flt, d, upsert, t in items:
+                    self._pending[(dbName, collectionName)] -= 1
+                    latency = now - t
+                    self._total_latency += latency
+                    self.max_latency = max(self.max_latency, latency)
+                self.last_latency = now - items[-1][-1]
+                self.written_count += len(items)
+                self.batch_count += 1
+                self._cond.notify_all()
+
+    def _bulk_write(self, dbName, collectionName, ops):
+        """
+        按顺序写入ops。ordered写入在第一条出错处停止：出错的一条重试也不会成功，
+        报告后跳过，其后的继续写入；连接等其他错误按退避间隔重试未写入的部分。
+        """
+        collection = self.dbClient[dbName][collectionName]
+        interval = self.retry_interval
+        retry_count = 0
+        while ops:
+            try:
+                collection.bulk_write(ops, ordered=True)
+                return
+            except BulkWriteError as e:
+                errors = e.details.get('writeErrors', [])
+                if errors:
+                    n = errors[0]['index']
+                    self._report_error('MongoDB写入失败，已跳过：{}.{}, {}'.format(
+                        dbName, collectionName, errors[0].get('errmsg', '')))
+                    ops = ops[n + 1:]
+                    continue
+                error = e
+            except Exception as e:  # noqa
+                error = e
+
+            # 写入结果未知，全部重试：替换可重复执行，插入的文档已有_id，已写入的会按重复键跳过
+            retry_count += 1
+            if not self._active and retry_count > self.close_retry_count:
+                self._report_error('MongoDB批量写入失败，丢弃{}条：{}.{}, {}'.format(
+                    len(ops), dbName, collectionName, error))
+                return
+            self._report_error('MongoDB批量写入失败，{}秒后重试{}条：{}.{}, {}'.format(
+                interval, len(ops), dbName, collectionName, error))
+            time.sleep(interval)
+            interval = min(interval * 2, self.max_retry_interval)
+
+    def _report_error(self, msg):
+        """"""
+        with self._cond:
+            self.error_count += 1
+        try:
+            self.write_log(msg)
+        except Exception:  # noqa
+            print(msg)
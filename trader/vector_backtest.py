@@ -0,0 +1,641 @@
+"""
+Fast backtest of SniperAlgo spreads computed on columnar tick arrays.
+"""
+
+import json
+import os
+import shutil
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+
+from .constant import Direction, Offset, StOrderType, ORDER_ST2VT, ORDER_HEDGE
+from .tick_store import from_ns
+from .utility import round_to_pricetick
+
+ACTIVE = 0
+PASSIVE = 1
+
+MINUTE_NS = 60 * 10 ** 9
+HOUR_NS = 60 * MINUTE_NS
+DAY_NS = 24 * HOUR_NS
+
+QUOTE_FIELDS = ["datetime", "bid_price_1", "ask_price_1", "bid_volume_1", "ask_volume_1"]
+
+# Parameters of one spread, same names as StSpread/StLeg attributes
+SETTING_NAMES = [
+    "buy_percent",
+    "sell_percent",
+    "short_percent",
+    "cover_percent",
+    "maxOrderSize",
+    "maxPosSize",
+    "active_payup",
+    "passive_payup",
+]
+
+DAILY_FIELDS = [
+    "trade_count",
+    "turnover",
+    "commission",
+    "slippage",
+    "trading_pnl",
+    "holding_pnl",
+    "total_pnl",
+    "net_pnl",
+]
+
+
+def get_week_range(start_date: datetime):
+    """
+    Trading week of the backtest starting from start_date: from Friday 17:00
+    to next Friday 16:00.
+    """
+    while start_date.weekday() != 4:
+        start_date += timedelta(days=1)
+    start_date = start_date + timedelta(17 / 24)
+    end_datetime = start_date + timedelta(7 - 1 / 24)
+    return start_date, end_datetime
+
+
+def get_weeks(start: datetime, end: datetime):
+    """
+    Yield (start, end) of each week replayed from start until end, the first
+    week is always replayed.
+    """
+    while True:
+        week_start, week_end = get_week_range(start)
+        yield week_start, week_end
+        start = datetime(week_end.year, week_end.month, week_end.day)
+        if start >= end:
+            return
+
+
+def round_to_tick(values: np.ndarray, pricetick: float):
+    """
+    Vectorized round_to_pricetick with the same result for ticks like 0.01.
+    """
+    steps = np.rint(values / pricetick)
+    scale = round(1 / pricetick)
+    if abs(scale * pricetick - 1) < 1e-12:
+        return steps / scale
+    return steps * pricetick
+
+
+class SpreadTicks:
+    """
+    Two legs of one week merged into a single time line, with each leg's
+    last quote carried forward and the spread prices of every tick.
+
+    Ticks at the same time keep the active leg first, like the merge of the
+    event driven engine. Only depends on data, so it is reused for every
+    parameter set, and can be saved once and opened memory-mapped by
+    every process of a parameter sweep.
+    """
+
+    # Arrays saved by save(), besides legs, positions and quotes
+    ARRAY_NAMES = [
+        "datetime",
+        "leg",
+        "bid",
+        "ask",
+        "bid_price",
+        "ask_price",
+        "price",
+        "valid",
+        "bid_percent",
+        "ask_percent",
+        "bid_volume",
+        "ask_volume",
+    ]
+
+    def __init__(self, active: dict, passive: dict):
+        """"""
+        self.legs = (active, passive)
+
+        dt = np.concatenate([active["datetime"], passive["datetime"]])
+        leg = np.concatenate([
+            np.full(len(active["datetime"]), ACTIVE, dtype=np.int8),
+            np.full(len(passive["datetime"]), PASSIVE, dtype=np.int8),
+        ])
+        order = np.lexsort((leg, dt))
+        self.datetime = dt[order]
+        self.leg = leg[order]
+        self.count = len(order)
+        # Position of each leg's rows in the merged time line
+        self.positions = (
+            np.flatnonzero(self.leg == ACTIVE),
+            np.flatnonzero(self.leg == PASSIVE),
+        )
+
+        self.bid = np.concatenate([active["bid_price_1"], passive["bid_price_1"]])[order]
+        self.ask = np.concatenate([active["ask_price_1"], passive["ask_price_1"]])[order]
+
+        self.active_quote = self.carry_forward(ACTIVE)
+        self.passive_quote = self.carry_forward(PASSIVE)
+        self.calculate_spread()
+
+    def carry_forward(self, leg: int):
+        """
+        Last (bid, ask, bid_volume, ask_volume) of leg at every tick, 0 before
+        the first tick of leg.
+        """
+        index = np.arange(self.count)
+        last = np.maximum.accumulate(np.where(self.leg == leg, index, -1))
+        seen = last >= 0
+        rows = np.searchsorted(self.positions[leg], last[seen])
+
+        quote = []
+        for field in QUOTE_FIELDS[1:]:
+            values = np.zeros(self.count)
+            values[seen] = self.legs[leg][field][rows]
+            quote.append(values)
+        return quote
+
+    def calculate_spread(self):
+        """
+        Same as StSpread.calculatePrice for every tick. valid is False where
+        the engine would skip the tick (a leg without bid, or both spread
+        prices 0).
+        """
+        a_bid, a_ask, a_bid_volume, a_ask_volume = self.active_quote
+        p_bid, p_ask, p_bid_volume, p_ask_volume = self.passive_quote
+
+        self.bid_price = round_to_tick(a_bid - p_ask, 0.000001)
+        self.ask_price = round_to_tick(a_ask - p_bid, 0.000001)
+        self.price = round_to_tick((a_bid + p_ask + a_ask + p_bid) / 4, 0.000001)
+
+        self.valid = (a_bid != 0) & (p_bid != 0)
+        self.bid_price[~self.valid] = 0
+        self.ask_price[~self.valid] = 0
+        self.valid &= (self.bid_price != 0) | (self.ask_price != 0)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.bid_percent = np.where(self.valid, self.bid_price / self.price, 0)
+            self.ask_percent = np.where(self.valid, self.ask_price / self.price, 0)
+
+        self.bid_volume = np.minimum(a_bid_volume, p_ask_volume)
+        self.ask_volume = np.minimum(a_ask_volume, p_bid_volume)
+
+        # Ticks from Friday 15:31 on start closing positions for rollover
+        minutes = self.datetime // MINUTE_NS
+        weekday = (self.datetime // DAY_NS + 3) % 7  # 1970-01-01 is Thursday
+        hits = np.flatnonzero(
+            self.valid & (weekday == 4) & (minutes // 60 % 24 == 15) & (minutes % 60 > 30)
+        )
+        self.rollover = int(hits[0]) if len(hits) else self.count
+
+    def get_arrays(self):
+        """
+        @:return {file name: array} of everything save() writes
+        """
+        arrays = {name: getattr(self, name) for name in self.ARRAY_NAMES}
+        for leg, prefix in ((ACTIVE, "active"), (PASSIVE, "passive")):
+            for field in QUOTE_FIELDS:
+                arrays["{}_{}".format(prefix, field)] = self.legs[leg][field]
+            for n, values in enumerate(self.active_quote if leg == ACTIVE else self.passive_quote):
+                arrays["{}_quote_{}".format(prefix, n)] = values
+            arrays["{}_positions".format(prefix)] = self.positions[leg]
+        return arrays
+
+    def save(self, path: Path):
+        """
+        Save arrays as .npy files into directory path, replacing it.
+        """
+        tmp_path = path.with_name(path.name + ".tmp")
+        if tmp_path.exists():
+            shutil.rmtree(tmp_path)
+        tmp_path.mkdir(parents=True)
+
+        for name, array in self.get_arrays().items():
+            np.save(tmp_path.joinpath(name + ".npy"), np.asarray(array))
+        with open(tmp_path.joinpath("meta.json"), "w") as f:
+            json.dump({"count": self.count, "rollover": self.rollover}, f)
+
+        if path.exists():
+            shutil.rmtree(path)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def open(cls, path: Path):
+        """
+        Open ticks saved by save(), arrays are memory-mapped read only.
+        """
+        ticks = cls.__new__(cls)
+        with open(path.joinpath("meta.json")) as f:
+            meta = json.load(f)
+        ticks.count = meta["count"]
+        ticks.rollover = meta["rollover"]
+
+        def load(name):
+            return np.load(path.joinpath(name + ".npy"), mmap_mode="r")
+
+        for name in cls.ARRAY_NAMES:
+            setattr(ticks, name, load(name))
+        legs = []
+        for prefix in ("active", "passive"):
+            legs.append({field: load("{}_{}".format(prefix, field)) for field in QUOTE_FIELDS})
+        ticks.legs = tuple(legs)
+        ticks.active_quote = [load("active_quote_{}".format(n)) for n in range(4)]
+        ticks.passive_quote = [load("passive_quote_{}".format(n)) for n in range(4)]
+        ticks.positions = (load("active_positions"), load("passive_positions"))
+        return ticks
+
+    def get_signals(self, setting: dict):
+        """
+        Ticks where each of SniperAlgo's conditions holds.
+        """
+        valid = self.valid
+        return {
+            StOrderType.BUY: np.flatnonzero(valid & (self.ask_percent <= setting["buy_percent"])),
+            StOrderType.SELL: np.flatnonzero(valid & (self.bid_percent >= setting["sell_percent"])),
+            StOrderType.SHORT: np.flatnonzero(valid & (self.bid_percent >= setting["short_percent"])),
+            StOrderType.COVER: np.flatnonzero(valid & (self.ask_percent <= setting["cover_percent"])),
+        }
+
+
+class VectorBacktester:
+    """
+    Backtest SniperAlgo on one spread directly on TickStore arrays.
+
+    The spread series and entry/exit conditions are computed for a whole
+    week at once. Between trades the position only changes when an order is
+    filled, so the algo state machine jumps from one signal tick to the next
+    with searchsorted instead of visiting every tick, and pending orders are
+    matched against the following ticks of their leg in array slices.
+
+    With week_path set, weeks saved by save_weeks() are opened memory-mapped
+    instead of loaded from the tick store, so processes of a sweep share the
+    same pages.
+
+    Orders, fills and daily pnl follow BacktestMainEngine exactly:
+    * active order at the spread quote with payup, rounded to pricetick
+    * fill on a later tick of the same leg whose quote crosses the price,
+      at the better of order price and quote
+    * passive hedge sent at the passive leg's last quote when the active
+      order fills
+    * positions closed from Friday 15:31 and the week finished once flat
+    * inverse contract daily pnl with commission on turnover
+    """
+
+    def __init__(
+        self,
+        tick_store,
+        active_vt_symbol: str,
+        passive_vt_symbol: str,
+        pricetick: float,
+        size: float,
+        rate: float,
+        slippage: float = 0,
+        week_path: str = "",
+    ):
+        """"""
+        self.tick_store = tick_store
+        self.week_path = Path(week_path) if week_path else None
+        self.vt_symbols = (active_vt_symbol, passive_vt_symbol)
+        self.pricetick = pricetick
+        self.size = size
+        self.rate = rate
+        self.slippage = slippage
+
+        self.weeks = {}  # (start, end): SpreadTicks
+        self.setting = {}
+
+        self.pos = [0, 0, 0, 0]  # active long, active short, passive long, passive short
+        self.trades = []  # (datetime ns, leg, direction, offset, price, volume)
+        self.processed = []  # (SpreadTicks, end) ticks replayed of each week
+        self.stopped_week = None  # end of the week positions were left open
+
+    def set_setting(self, setting: dict):
+        """
+        setting has SETTING_NAMES keys, spread percents are used as given.
+        """
+        self.setting = {name: setting[name] for name in SETTING_NAMES}
+
+    def load_week(self, start: datetime, end: datetime):
+        """"""
+        key = (start, end)
+        ticks = self.weeks.get(key, None)
+        if ticks is None:
+            path = self.get_week_path(start) if self.week_path else None
+            if path and path.exists():
+                ticks = SpreadTicks.open(path)
+            else:
+                ticks = self.read_week(start, end)
+            self.weeks[key] = ticks
+        return ticks
+
+    def read_week(self, start: datetime, end: datetime):
+        """"""
+        active, passive = [
+            self.tick_store.load(vt_symbol, start, end, QUOTE_FIELDS)
+            for vt_symbol in self.vt_symbols
+        ]
+        return SpreadTicks(active, passive)
+
+    def get_week_path(self, start: datetime):
+        """"""
+        return self.week_path.joinpath(start.strftime("%Y%m%d%H%M"))
+
+    def save_weeks(self, start: datetime, end: datetime):
+        """
+        Load every week from start until end and save it under week_path.
+        @:return number of weeks saved
+        """
+        count = 0
+        for week_start, week_end in get_weeks(start, end):
+            self.read_week(week_start, week_end).save(self.get_week_path(week_start))
+            count += 1
+        return count
+
+    def check_price(self):
+        """Same check as SniperAlgo.checkPrice"""
+        setting = self.setting
+        return (
+            setting["buy_percent"] < setting["cover_percent"]
+            and setting["short_percent"] > setting["sell_percent"]
+        )
+
+    def run_backtesting(self, start: datetime, end: datetime):
+        """
+        Replay weeks from start until end. Like the event driven engine, the
+        backtest stops after a week which could not be closed flat.
+        """
+        self.trades = []
+        self.processed = []
+        self.stopped_week = None
+
+        active = self.check_price()
+        for week_start, week_end in get_weeks(start, end):
+            ticks = self.load_week(week_start, week_end)
+            if not self.run_week(ticks, active):
+                self.stopped_week = week_end
+                break
+
+    def run_week(self, ticks: SpreadTicks, active: bool = True):
+        """
+        Run the algo state machine through one week.
+        @:return True if positions were closed and the week finished
+        """
+        setting = self.setting
+        max_pos = setting["maxPosSize"]
+        max_order = setting["maxOrderSize"]
+        signals = ticks.get_signals(setting)
+        rollover = ticks.rollover
+
+        self.pos = [0, 0, 0, 0]
+        i = 0
+        while active:
+            a_long, a_short, p_long, p_short = self.pos
+            net = int(min(a_long, p_short)) - int(min(a_short, p_long))
+
+            # Find next tick on which the algo acts
+            if a_long > max_pos + max_order or a_short > max_pos + max_order:
+                types = [StOrderType.SELL] if net > 0 else [StOrderType.COVER] if net < 0 else []
+            else:
+                types = []
+                if 0 <= net < max_pos:
+                    types.append(StOrderType.BUY)
+                if net > 0:
+                    types.append(StOrderType.SELL)
+                if 0 >= net > -max_pos:
+                    types.append(StOrderType.SHORT)
+                if net < 0:
+                    types.append(StOrderType.COVER)
+
+            j = ticks.count
+            for order_type in types:
+                index = signals[order_type]
+                n = np.searchsorted(index, i)
+                if n < len(index) and index[n] < j:
+                    j = int(index[n])
+
+            if j > rollover:
+                # Closing positions on every tick after rollover started
+                valid = np.flatnonzero(ticks.valid[max(i, rollover + 1):])
+                if not len(valid):
+                    break
+                j = int(valid[0]) + max(i, rollover + 1)
+                if net > 0:
+                    order_type = StOrderType.SELL
+                elif net < 0:
+                    order_type = StOrderType.COVER
+                else:
+                    self.processed.append((ticks, j + 1))
+                    return True
+            elif j >= ticks.count:
+                # Data ended before rollover, e.g. a week cut short without a
+                # Friday 15:31 tick
+                break
+            else:
+                order_type = self.get_order_type(ticks, j, net)
+
+            order = self.quote_active_leg(ticks, j, order_type) if order_type else None
+            if not order:
+                i = j + 1
+                continue
+
+            # Active order filled, hedge passive leg
+            k = self.cross_order(ticks, ACTIVE, j, order)
+            if k < 0:
+                break
+            direction, offset, _, volume = order
+            if ORDER_HEDGE[direction] == Direction.LONG:
+                price = ticks.passive_quote[1][k]
+            else:
+                price = ticks.passive_quote[0][k]
+            hedge = self.new_order(ORDER_HEDGE[direction], offset, price, volume, setting["passive_payup"])
+
+            m = self.cross_order(ticks, PASSIVE, k, hedge)
+            if m < 0:
+                break
+            i = m
+
+        self.processed.append((ticks, ticks.count))
+        return False
+
+    def get_order_type(self, ticks: SpreadTicks, j: int, net: int):
+        """SniperAlgo.updateSpreadTick on tick j"""
+        setting = self.setting
+        max_pos = setting["maxPosSize"]
+        max_order = setting["maxOrderSize"]
+        bid_percent = ticks.bid_percent[j]
+        ask_percent = ticks.ask_percent[j]
+
+        a_long, a_short = self.pos[0], self.pos[1]
+        if a_long > max_pos + max_order or a_short > max_pos + max_order:
+            if net > 0 and bid_percent >= setting["sell_percent"]:
+                return StOrderType.SELL
+            elif net < 0 and ask_percent <= setting["cover_percent"]:
+                return StOrderType.COVER
+            return None
+
+        if 0 <= net < max_pos and ask_percent <= setting["buy_percent"]:
+            return StOrderType.BUY
+        elif net > 0 and bid_percent >= setting["sell_percent"]:
+            return StOrderType.SELL
+        elif 0 >= net > -max_pos and bid_percent >= setting["short_percent"]:
+            return StOrderType.SHORT
+        elif net < 0 and ask_percent <= setting["cover_percent"]:
+            return StOrderType.COVER
+        return None
+
+    def quote_active_leg(self, ticks: SpreadTicks, j: int, order_type: StOrderType):
+        """SniperAlgo.quoteActiveLeg on tick j"""
+        setting = self.setting
+        a_bid, a_ask = ticks.active_quote[0], ticks.active_quote[1]
+
+        if order_type == StOrderType.BUY or order_type == StOrderType.COVER:
+            price = a_ask[j]
+            volume = min(ticks.ask_volume[j], setting["maxPosSize"], setting["maxOrderSize"])
+        else:
+            price = a_bid[j]
+            volume = min(ticks.bid_volume[j], setting["maxPosSize"], setting["maxOrderSize"])
+        if order_type == StOrderType.SELL:
+            volume = min(volume, self.pos[0])
+        elif order_type == StOrderType.COVER:
+            volume = min(volume, self.pos[1])
+        if volume <= 0:
+            return None
+
+        direction, offset = ORDER_ST2VT[order_type]
+        return self.new_order(direction, offset, price, volume, setting["active_payup"])
+
+    def new_order(self, direction: Direction, offset: Offset, price: float, volume: float, payup: float):
+        """Order price as StEngine.sendOrder of the backtest"""
+        price = float(price)
+        if (direction == Direction.LONG and offset == Offset.OPEN) or (
+                direction == Direction.SHORT and offset == Offset.CLOSE):
+            price = price * (1 + payup / 100)
+        else:
+            price = price * (1 - payup / 100)
+        price = round_to_pricetick(price, float(self.pricetick))
+        return direction, offset, price, float(volume)
+
+    def cross_order(self, ticks: SpreadTicks, leg: int, sent: int, order: tuple):
+        """
+        Fill order sent on tick sent with the first later tick of leg crossing
+        its price, record the trade and update position.
+        @:return index of the filling tick, -1 if never filled
+        """
+        direction, offset, price, volume = order
+        buy = (direction == Direction.LONG) == (offset == Offset.OPEN)
+        positions = ticks.positions[leg]
+        columns = ticks.legs[leg]
+        quotes = columns["ask_price_1"] if buy else columns["bid_price_1"]
+
+        start = int(np.searchsorted(positions, sent, "right"))
+        row = -1
+        chunk = 64
+        while start < len(positions):
+            quote = quotes[start:start + chunk]
+            if buy:
+                hits = np.flatnonzero((price >= quote) & (quote > 0))
+            else:
+                hits = np.flatnonzero((0 < price) & (price <= quote))
+            if len(hits):
+                row = start + int(hits[0])
+                break
+            start += chunk
+            chunk *= 4
+
+        if row < 0:
+            return -1
+
+        quote = float(quotes[row])
+        trade_price = min(price, quote) if buy else max(price, quote)
+        k = int(positions[row])
+        self.trades.append((int(ticks.datetime[k]), leg, direction, offset, trade_price, volume))
+
+        n = leg * 2 + (0 if direction == Direction.LONG else 1)
+        if offset == Offset.OPEN:
+            self.pos[n] += volume
+        else:
+            self.pos[n] -= volume
+        return k
+
+    def get_trades(self):
+        """
+        @:return list of (datetime, vt_symbol, direction, offset, price, volume)
+        """
+        return [
+            (from_ns(dt), self.vt_symbols[leg], direction, offset, price, volume)
+            for dt, leg, direction, offset, price, volume in self.trades
+        ]
+
+    def calculate_result(self):
+        """
+        Daily result as BacktestMainEngine.calculate_result.
+        @:return {"date": [date], field: array} for date and DAILY_FIELDS
+        """
+        if not self.processed:
+            return {name: [] for name in ["date"] + DAILY_FIELDS}
+
+        dt = np.concatenate([ticks.datetime[:end] for ticks, end in self.processed])
+        leg = np.concatenate([ticks.leg[:end] for ticks, end in self.processed])
+        mid = np.concatenate([(ticks.ask[:end] + ticks.bid[:end]) / 2 for ticks, end in self.processed])
+
+        # Daily close of each leg, the first tick of a day only creates the day
+        day = dt // DAY_NS
+        days = np.unique(day)
+        first = np.r_[True, day[1:] != day[:-1]]
+        close = np.full((len(days), 2), np.nan)
+        for n in (ACTIVE, PASSIVE):
+            rows = np.flatnonzero(~first & (leg == n))
+            if not len(rows):
+                continue
+            last = rows[np.r_[day[rows][1:] != day[rows][:-1], True]]
+            close[np.searchsorted(days, day[last]), n] = mid[last]
+
+        count = len(days)
+        daily = {name: np.zeros(count) for name in DAILY_FIELDS}
+        pos_change = np.zeros((count, 2))
+
+        if self.trades:
+            t_dt, t_leg, t_direction, t_offset, t_price, t_volume = zip(*self.trades)
+            t_day = np.searchsorted(days, np.array(t_dt) // DAY_NS)
+            t_leg = np.array(t_leg)
+            t_price = np.array(t_price)
+            t_volume = np.array(t_volume)
+            sign = np.array([
+                1 if (direction == Direction.LONG) == (offset == Offset.OPEN) else -1
+                for direction, offset in zip(t_direction, t_offset)
+            ])
+            t_change = sign * t_volume
+            turnover = t_volume * self.size / t_price
+            trading_pnl = t_change * (1 / t_price - 1 / close[t_day, t_leg]) * self.size
+
+            np.add.at(pos_change, (t_day, t_leg), t_change)
+            np.add.at(daily["trade_count"], t_day, 1)
+            np.add.at(daily["turnover"], t_day, turnover)
+            np.add.at(daily["trading_pnl"], t_day, trading_pnl)
+            np.add.at(daily["slippage"], t_day, t_volume * self.size * self.slippage)
+            daily["commission"] = daily["turnover"] * self.rate
+
+        # Holding pnl of position at day start, from previous day's close
+        start_pos = np.cumsum(pos_change, axis=0) - pos_change
+        pre_close = np.vstack([np.full((1, 2), np.nan), close[:-1]])
+        holding = (start_pos != 0) & ~np.isnan(close)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            holding_pnl = np.where(holding, start_pos * (1 / pre_close - 1 / close) * self.size, 0)
+        daily["holding_pnl"] = holding_pnl.sum(axis=1)
+
+        daily["total_pnl"] = daily["trading_pnl"] + daily["holding_pnl"]
+        daily["net_pnl"] = daily["total_pnl"] - daily["commission"] - daily["slippage"]
+
+        daily["date"] = [from_ns(d * DAY_NS).date() for d in days]
+        return daily
+
+
+def get_sniper_setting(st_setting: dict, setting: dict):
+    """
+    Spread setting of a backtest the same way as the backtest StEngine:
+    st_setting is one item of backtest_st_setting.json, setting is the
+    optimization setting whose buy_percent sets both entry thresholds.
+    """
+    sniper_setting = {name: st_setting[name] for name in SETTING_NAMES}
+    sniper_setting["buy_percent"] = -setting["buy_percent"]
+    sniper_setting["short_percent"] = setting["buy_percent"]
+    return sniper_setting
+